@@ -1,61 +1,205 @@
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import streamlit as st
-from scipy import stats
 import numpy as np
+# plotly and scipy are imported inside the functions that draw charts or run
+# tests, so importing this module (and pages without charts) stays fast
+from concurrent.futures import ThreadPoolExecutor
+from cache import cached_analysis, cached_figure
+from filter_index import get_bitmap_index, mark_derived, select_rows
+from classifier import clr_transform, fit_logistic_regression, cross_validate
+from utils import percentage_hundredths, responder_t_test
 
+CELL_TYPES = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
+COHORT_KEYS = ['condition', 'treatment', 'sample_type', 'time_from_treatment_start']
 
-def analyze_baseline_subset(db_data):
-    """Analyze baseline melanoma PBMC samples with tr1 treatment"""
+RESPONSE_LABELS = {'y': 'Responders', 'n': 'Non-Responders'}
+CROSSTAB_RESPONSE_LABELS = {'y': 'Responder', 'n': 'Non-Responder'}
+SEX_LABELS = {'M': 'Male', 'F': 'Female'}
+
+
+def select_cohort(db_data, condition=None, sample_type=None, treatment=None, time_point=None):
+    """Select the samples of one cohort (a criterion of None means no restriction)"""
+    mask = pd.Series(True, index=db_data.index)
+    criteria = {
+        'condition': condition,
+        'sample_type': sample_type,
+        'treatment': treatment,
+        'time_from_treatment_start': time_point
+    }
+    for column, value in criteria.items():
+        if value is not None:
+            mask &= db_data[column] == value
+    return mark_derived(db_data[mask])
+
+
+def _add_margins(table):
+    """Append 'All' row and column totals to a count table"""
+    table = table.copy()
+    table['All'] = table.sum(axis=1)
+    table.loc['All'] = table.sum(axis=0)
+    return table
+
+
+@cached_analysis
+def compute_cohort_breakdown(cohort_data):
+    """Compute project/response/sex/age breakdowns and cross-tabs for a cohort
+
+    The subject-level dimension is derived once, then every breakdown is
+    rolled up from a single grouped pass over (project, response, sex).
+    """
+    # One row per subject, carrying the number of samples they contribute
+    subjects = cohort_data.groupby('subject', sort=False).agg(
+        project=('project', 'first'),
+        response=('response', 'first'),
+        sex=('sex', 'first'),
+        age=('age', 'first'),
+        samples=('sample', 'size')
+    )
+
+    # Single grouped pass: every table below is a roll-up of these cells
+    cells = subjects.groupby(['project', 'response', 'sex'], dropna=False).agg(
+        subjects=('samples', 'size'),
+        samples=('samples', 'sum'),
+        age_sum=('age', 'sum'),
+        age_n=('age', 'count'),
+        age_min=('age', 'min'),
+        age_max=('age', 'max')
+    )
+
+    project_counts = (cells.groupby(level='project')['samples'].sum()
+                      .sort_values(ascending=False).reset_index())
+    project_counts.columns = ['Project', 'Sample Count']
+
+    # Subjects without a y/n response (or sex) are excluded from those breakdowns
+    response_cells = cells[cells.index.get_level_values('response').isin(list(RESPONSE_LABELS))]
+    response_totals = response_cells.groupby(level='response')['subjects'].sum().sort_values(ascending=False)
+    response_counts = response_totals.reset_index()
+    response_counts.columns = ['Response', 'Subject Count']
+    response_counts['Response'] = response_counts['Response'].map(RESPONSE_LABELS)
+    response_counts['Percentage (%)'] = (
+        response_counts['Subject Count'] / response_counts['Subject Count'].sum() * 100
+    ).round(1)
+
+    sex_cells = cells[cells.index.get_level_values('sex').isin(list(SEX_LABELS))]
+    sex_totals = sex_cells.groupby(level='sex')['subjects'].sum().sort_values(ascending=False)
+    sex_counts = sex_totals.reset_index()
+    sex_counts.columns = ['Sex', 'Subject Count']
+    sex_counts['Sex'] = sex_counts['Sex'].map(SEX_LABELS)
+    sex_counts['Percentage (%)'] = (
+        sex_counts['Subject Count'] / sex_counts['Subject Count'].sum() * 100
+    ).round(1)
+
+    age_by_response = response_cells.groupby(level='response').agg(
+        subjects=('subjects', 'sum'),
+        age_sum=('age_sum', 'sum'),
+        age_n=('age_n', 'sum'),
+        age_min=('age_min', 'min'),
+        age_max=('age_max', 'max')
+    )
+    age_by_response['Avg Age'] = (age_by_response['age_sum'] / age_by_response['age_n']).round(1)
+    age_by_response = age_by_response[['subjects', 'Avg Age', 'age_min', 'age_max']]
+    age_by_response.columns = ['Subject Count', 'Avg Age', 'Min Age', 'Max Age']
+    age_by_response.index = age_by_response.index.map(RESPONSE_LABELS)
+    age_by_response.index.name = 'Response'
+
+    response_by_sex = (response_cells[response_cells.index.get_level_values('sex').isin(list(SEX_LABELS))]
+                       .groupby(level=['sex', 'response'])['subjects'].sum()
+                       .unstack(fill_value=0)
+                       .rename(index=SEX_LABELS, columns=CROSSTAB_RESPONSE_LABELS))
+    response_by_project = (response_cells.groupby(level=['project', 'response'])['subjects'].sum()
+                           .unstack(fill_value=0)
+                           .rename(columns=CROSSTAB_RESPONSE_LABELS))
+
+    n_subjects = len(subjects)
+    n_responders = int(response_totals.get('y', 0))
+    n_non_responders = int(response_totals.get('n', 0))
+    age_n = cells['age_n'].sum()
+
+    summary = {
+        'samples': int(cells['samples'].sum()),
+        'subjects': n_subjects,
+        'projects': len(project_counts),
+        'samples_per_subject': cells['samples'].sum() / n_subjects if n_subjects else 0,
+        'age_mean': cells['age_sum'].sum() / age_n if age_n else None,
+        'age_min': cells['age_min'].min() if age_n else None,
+        'age_max': cells['age_max'].max() if age_n else None,
+        'responders': n_responders,
+        'non_responders': n_non_responders,
+        'response_rate': (n_responders / (n_responders + n_non_responders) * 100
+                          if n_responders + n_non_responders else None),
+        'males': int(sex_totals.get('M', 0)),
+        'females': int(sex_totals.get('F', 0))
+    }
+
+    return {
+        'subjects': subjects.reset_index(),
+        'project_counts': project_counts,
+        'response_counts': response_counts,
+        'sex_counts': sex_counts,
+        'age_by_response': age_by_response,
+        'response_by_sex': _add_margins(response_by_sex) if not response_by_sex.empty else response_by_sex,
+        'response_by_project': _add_margins(response_by_project) if not response_by_project.empty else response_by_project,
+        'summary': summary
+    }
+
+
+def describe_cohort(condition=None, sample_type=None, treatment=None, time_point=None):
+    """Human-readable cohort description, e.g. 'baseline melanoma PBMC samples with tr1 treatment'"""
+    timing = 'all time points' if time_point is None else 'baseline' if time_point == 0 else f"day {time_point}"
+    parts = [timing, condition or 'all-condition', sample_type or 'all-type', 'samples']
+    if treatment is not None:
+        parts.append(f"with {treatment} treatment")
+    return ' '.join(str(part) for part in parts)
+
+
+def analyze_baseline_subset(db_data, condition='melanoma', sample_type='PBMC', treatment='tr1', time_point=0):
+    """Analyze one cohort (by default baseline melanoma PBMC samples with tr1 treatment)"""
+    import plotly.express as px
+    cohort_label = describe_cohort(condition, sample_type, treatment, time_point)
     st.header("🔬 Baseline Treatment Effects Analysis")
-    st.markdown("### Early Treatment Effects - Baseline Melanoma PBMC Samples (TR1)")
+    st.markdown(f"### Early Treatment Effects - {cohort_label[0].upper() + cohort_label[1:]}")
     st.markdown("*Exploring baseline characteristics before treatment effects emerge*")
-    
-    # Filter for baseline melanoma PBMC samples with tr1 treatment
-    baseline_data = db_data[
-        (db_data['condition'] == 'melanoma') & 
-        (db_data['sample_type'] == 'PBMC') & 
-        (db_data['treatment'] == 'tr1') &
-        (db_data['time_from_treatment_start'] == 0)
-    ].copy()
-    
+
+    baseline_data = select_cohort(db_data, condition, sample_type, treatment, time_point)
+
     if baseline_data.empty:
-        st.warning("No baseline melanoma PBMC samples with tr1 treatment found in the dataset.")
+        st.warning(f"No {cohort_label} found in the dataset.")
         return
-    
+
+    breakdown = compute_cohort_breakdown(baseline_data)
+    summary = breakdown['summary']
+
     # Overview metrics
     st.subheader("📊 Baseline Sample Overview")
     col1, col2, col3, col4 = st.columns(4)
-    
+
     with col1:
-        st.metric("Total Baseline Samples", len(baseline_data))
+        st.metric("Total Baseline Samples", summary['samples'])
     with col2:
-        st.metric("Unique Subjects", baseline_data['subject'].nunique())
+        st.metric("Unique Subjects", summary['subjects'])
     with col3:
-        st.metric("Projects", baseline_data['project'].nunique())
+        st.metric("Projects", summary['projects'])
     with col4:
-        avg_age = baseline_data['age'].mean() if baseline_data['age'].notna().any() else 0
-        st.metric("Average Age", f"{avg_age:.1f}" if avg_age > 0 else "N/A")
-    
+        st.metric("Average Age", f"{summary['age_mean']:.1f}" if summary['age_mean'] else "N/A")
+
     # Display the filtered dataset
     st.subheader("🔍 Filtered Baseline Dataset")
     st.dataframe(baseline_data, use_container_width=True)
-    
+
     # Download button for baseline data
     csv_baseline = baseline_data.to_csv(index=False)
+    file_stem = '_'.join(str(part) for part in (condition, treatment, sample_type, time_point) if part is not None)
     st.download_button(
         label="📥 Download Baseline Dataset",
         data=csv_baseline,
-        file_name="baseline_melanoma_tr1_pbmc_samples.csv",
+        file_name=f"cohort_{file_stem or 'all'}_samples.csv".lower(),
         mime="text/csv"
     )
-    
+
     # Analysis 1: Samples per project
     st.subheader("📈 Samples per Project")
-    project_counts = baseline_data['project'].value_counts().reset_index()
-    project_counts.columns = ['Project', 'Sample Count']
-    
+    project_counts = breakdown['project_counts']
+
     col1, col2 = st.columns([1, 2])
     with col1:
         st.dataframe(project_counts, use_container_width=True)
@@ -69,31 +213,18 @@ def analyze_baseline_subset(db_data):
             color_continuous_scale='Blues'
         )
         st.plotly_chart(fig_project, use_container_width=True)
-    
+
     # Analysis 2: Response distribution by subject
     st.subheader("🎯 Treatment Response Distribution")
-    
-    # Get unique subjects and their responses (one response per subject)
-    subject_responses = baseline_data.drop_duplicates(subset=['subject'])[['subject', 'response']].copy()
-    
-    # Filter out subjects without response data
-    subject_responses = subject_responses[subject_responses['response'].isin(['y', 'n'])]
-    
-    if not subject_responses.empty:
-        response_counts = subject_responses['response'].value_counts().reset_index()
-        response_counts.columns = ['Response', 'Subject Count']
-        response_counts['Response'] = response_counts['Response'].map({'y': 'Responders', 'n': 'Non-Responders'})
-        
+    response_counts = breakdown['response_counts']
+
+    if not response_counts.empty:
         col1, col2 = st.columns([1, 2])
         with col1:
             st.dataframe(response_counts, use_container_width=True)
-            
-            # Calculate percentages
-            total_subjects = response_counts['Subject Count'].sum()
-            for _, row in response_counts.iterrows():
-                percentage = (row['Subject Count'] / total_subjects) * 100
-                st.write(f"**{row['Response']}**: {row['Subject Count']} subjects ({percentage:.1f}%)")
-        
+            for label, count, percentage in response_counts.itertuples(index=False):
+                st.write(f"**{label}**: {count} subjects ({percentage:.1f}%)")
+
         with col2:
             fig_response = px.pie(
                 response_counts,
@@ -103,33 +234,26 @@ def analyze_baseline_subset(db_data):
                 color_discrete_map={'Responders': '#2E8B57', 'Non-Responders': '#DC143C'}
             )
             st.plotly_chart(fig_response, use_container_width=True)
+
+        st.write("**Age by Response:**")
+        st.dataframe(breakdown['age_by_response'], use_container_width=True)
     else:
         st.info("No response data available for baseline subjects.")
-    
+
     # Analysis 3: Gender distribution
     st.subheader("👥 Gender Distribution")
-    
-    # Get unique subjects and their gender (one gender per subject)
-    subject_gender = baseline_data.drop_duplicates(subset=['subject'])[['subject', 'sex']].copy()
-    
-    if not subject_gender.empty and subject_gender['sex'].notna().any():
-        gender_counts = subject_gender['sex'].value_counts().reset_index()
-        gender_counts.columns = ['Sex', 'Subject Count']
-        gender_counts['Sex'] = gender_counts['Sex'].map({'M': 'Male', 'F': 'Female'})
-        
+    sex_counts = breakdown['sex_counts']
+
+    if not sex_counts.empty:
         col1, col2 = st.columns([1, 2])
         with col1:
-            st.dataframe(gender_counts, use_container_width=True)
-            
-            # Calculate percentages
-            total_subjects = gender_counts['Subject Count'].sum()
-            for _, row in gender_counts.iterrows():
-                percentage = (row['Subject Count'] / total_subjects) * 100
-                st.write(f"**{row['Sex']}**: {row['Subject Count']} subjects ({percentage:.1f}%)")
-        
+            st.dataframe(sex_counts, use_container_width=True)
+            for label, count, percentage in sex_counts.itertuples(index=False):
+                st.write(f"**{label}**: {count} subjects ({percentage:.1f}%)")
+
         with col2:
             fig_gender = px.bar(
-                gender_counts,
+                sex_counts,
                 x='Sex',
                 y='Subject Count',
                 title='Gender Distribution Among Baseline Subjects',
@@ -139,39 +263,27 @@ def analyze_baseline_subset(db_data):
             st.plotly_chart(fig_gender, use_container_width=True)
     else:
         st.info("No gender data available for baseline subjects.")
-    
+
     # Analysis 4: Cross-tabulation analysis
     st.subheader("📋 Cross-Tabulation Analysis")
-    
-    # Get unique subjects with all relevant info
-    subject_summary = baseline_data.drop_duplicates(subset=['subject'])[
-        ['subject', 'project', 'response', 'sex', 'age']
-    ].copy()
-    
-    # Response by Gender
-    if not subject_summary.empty and subject_summary['response'].isin(['y', 'n']).any() and subject_summary['sex'].notna().any():
+
+    if not breakdown['response_by_sex'].empty:
         st.write("**Response by Gender:**")
-        response_gender_crosstab = pd.crosstab(
-            subject_summary['sex'].map({'M': 'Male', 'F': 'Female'}),
-            subject_summary['response'].map({'y': 'Responder', 'n': 'Non-Responder'}),
-            margins=True
-        )
-        st.dataframe(response_gender_crosstab, use_container_width=True)
-    
-    # Response by Project
-    if not subject_summary.empty and subject_summary['response'].isin(['y', 'n']).any():
+        st.dataframe(breakdown['response_by_sex'], use_container_width=True)
+
+    if not breakdown['response_by_project'].empty:
         st.write("**Response by Project:**")
-        response_project_crosstab = pd.crosstab(
-            subject_summary['project'],
-            subject_summary['response'].map({'y': 'Responder', 'n': 'Non-Responder'}),
-            margins=True
-        )
-        st.dataframe(response_project_crosstab, use_container_width=True)
-    
+        st.dataframe(breakdown['response_by_project'], use_container_width=True)
+
     # Summary statistics
     st.subheader("📊 Summary Statistics")
-    
-    summary_stats = {
+
+    if summary['age_min'] is not None:
+        age_range = f"{summary['age_min']:.0f} - {summary['age_max']:.0f}"
+    else:
+        age_range = "N/A"
+
+    summary_df = pd.DataFrame({
         'Metric': [
             'Total Baseline Samples',
             'Unique Subjects',
@@ -180,59 +292,55 @@ def analyze_baseline_subset(db_data):
             'Age Range',
             'Response Rate (%)'
         ],
-        'Value': []
-    }
-    
-    # Calculate values
-    summary_stats['Value'].append(len(baseline_data))
-    summary_stats['Value'].append(baseline_data['subject'].nunique())
-    summary_stats['Value'].append(baseline_data['project'].nunique())
-    
-    samples_per_subject = len(baseline_data) / baseline_data['subject'].nunique()
-    summary_stats['Value'].append(f"{samples_per_subject:.1f}")
-    
-    if baseline_data['age'].notna().any():
-        age_range = f"{baseline_data['age'].min():.0f} - {baseline_data['age'].max():.0f}"
-    else:
-        age_range = "N/A"
-    summary_stats['Value'].append(age_range)
-    
-    if not subject_responses.empty:
-        response_rate = (subject_responses['response'] == 'y').sum() / len(subject_responses) * 100
-        summary_stats['Value'].append(f"{response_rate:.1f}%")
-    else:
-        summary_stats['Value'].append("N/A")
-    
-    summary_df = pd.DataFrame(summary_stats)
+        'Value': [
+            summary['samples'],
+            summary['subjects'],
+            summary['projects'],
+            f"{summary['samples_per_subject']:.1f}",
+            age_range,
+            f"{summary['response_rate']:.1f}%" if summary['response_rate'] is not None else "N/A"
+        ]
+    })
     st.dataframe(summary_df, use_container_width=True, hide_index=True)
-    
+
     # Key findings
     st.subheader("🔍 Key Findings")
-    
+
     findings = []
-    findings.append(f"✓ Identified **{len(baseline_data)}** baseline melanoma PBMC samples from **{baseline_data['subject'].nunique()}** subjects receiving tr1 treatment")
-    
+    findings.append(f"✓ Identified **{summary['samples']}** {cohort_label} from **{summary['subjects']}** subjects")
+
     if len(project_counts) > 0:
         largest_project = project_counts.iloc[0]
         findings.append(f"✓ **{largest_project['Project']}** has the most samples ({largest_project['Sample Count']} samples)")
-    
-    if not subject_responses.empty:
-        responder_count = (subject_responses['response'] == 'y').sum()
-        non_responder_count = (subject_responses['response'] == 'n').sum()
-        findings.append(f"✓ **{responder_count}** responders and **{non_responder_count}** non-responders identified")
-    
-    if not subject_gender.empty and subject_gender['sex'].notna().any():
-        male_count = (subject_gender['sex'] == 'M').sum()
-        female_count = (subject_gender['sex'] == 'F').sum()
-        findings.append(f"✓ Gender distribution: **{male_count}** males and **{female_count}** females")
-    
+
+    if not response_counts.empty:
+        findings.append(f"✓ **{summary['responders']}** responders and **{summary['non_responders']}** non-responders identified")
+
+    if not sex_counts.empty:
+        findings.append(f"✓ Gender distribution: **{summary['males']}** males and **{summary['females']}** females")
+
     for finding in findings:
         st.write(finding)
-    
+
     return baseline_data
 
-def create_custom_filter_interface(db_data):
-    """Create a flexible filtering interface for Bob to explore any subset"""
+def _filter_choices(db_data, options, column):
+    """Option values and {value: sample count} for one filter, from options if given"""
+    if options is not None and column in options:
+        counts = dict(options[column].itertuples(index=False))
+    else:
+        counts = db_data[column].dropna().value_counts().sort_index().to_dict()
+    return list(counts), counts
+
+def _with_count(counts):
+    return lambda option: option if option == 'All' else f"{option} ({counts.get(option, 0)})"
+
+def create_custom_filter_interface(db_data, options=None):
+    """Create a flexible filtering interface for Bob to explore any subset
+
+    options maps each filter column to a DataFrame of (value, sample_count),
+    e.g. db.get_filter_options; without it the options are counted from db_data.
+    """
     st.header("🔧 Custom Data Filtering & Analysis")
     st.markdown("### Flexible Data Exploration Tool")
     st.markdown("*Filter the data using any combination of criteria and get instant analysis*")
@@ -247,54 +355,53 @@ def create_custom_filter_interface(db_data):
         
         with col1:
             # Condition filter
-            conditions = ['All'] + sorted(db_data['condition'].dropna().unique().tolist())
-            selected_conditions = st.multiselect("Condition(s):", conditions, default=['All'])
+            conditions, counts = _filter_choices(db_data, options, 'condition')
+            selected_conditions = st.multiselect("Condition(s):", ['All'] + conditions, default=['All'],
+                                                 format_func=_with_count(counts))
             
             # Treatment filter
-            treatments = ['All'] + sorted(db_data['treatment'].dropna().unique().tolist())
-            selected_treatments = st.multiselect("Treatment(s):", treatments, default=['All'])
+            treatments, counts = _filter_choices(db_data, options, 'treatment')
+            selected_treatments = st.multiselect("Treatment(s):", ['All'] + treatments, default=['All'],
+                                                 format_func=_with_count(counts))
         
         with col2:
             # Sample type filter
-            sample_types = ['All'] + sorted(db_data['sample_type'].dropna().unique().tolist())
-            selected_sample_types = st.multiselect("Sample Type(s):", sample_types, default=['All'])
+            sample_types, counts = _filter_choices(db_data, options, 'sample_type')
+            selected_sample_types = st.multiselect("Sample Type(s):", ['All'] + sample_types, default=['All'],
+                                                   format_func=_with_count(counts))
             
             # Time point filter
-            time_points = sorted(db_data['time_from_treatment_start'].dropna().unique().tolist())
+            time_points, counts = _filter_choices(db_data, options, 'time_from_treatment_start')
             if time_points:
-                selected_times = st.multiselect("Time Points:", time_points, default=time_points)
+                selected_times = st.multiselect("Time Points:", time_points, default=time_points,
+                                                format_func=_with_count(counts))
             else:
                 selected_times = []
         
         with col3:
             # Response filter
-            responses = ['All'] + sorted(db_data['response'].dropna().unique().tolist())
-            selected_responses = st.multiselect("Response(s):", responses, default=['All'])
+            responses, counts = _filter_choices(db_data, options, 'response')
+            selected_responses = st.multiselect("Response(s):", ['All'] + responses, default=['All'],
+                                                format_func=_with_count(counts))
             
             # Project filter
-            projects = ['All'] + sorted(db_data['project'].dropna().unique().tolist())
-            selected_projects = st.multiselect("Project(s):", projects, default=['All'])
-    
-    # Apply filters
-    filtered_data = db_data.copy()
-    
-    if 'All' not in selected_conditions:
-        filtered_data = filtered_data[filtered_data['condition'].isin(selected_conditions)]
-    
-    if 'All' not in selected_treatments:
-        filtered_data = filtered_data[filtered_data['treatment'].isin(selected_treatments)]
-    
-    if 'All' not in selected_sample_types:
-        filtered_data = filtered_data[filtered_data['sample_type'].isin(selected_sample_types)]
-    
-    if selected_times:
-        filtered_data = filtered_data[filtered_data['time_from_treatment_start'].isin(selected_times)]
-    
-    if 'All' not in selected_responses:
-        filtered_data = filtered_data[filtered_data['response'].isin(selected_responses)]
-    
-    if 'All' not in selected_projects:
-        filtered_data = filtered_data[filtered_data['project'].isin(selected_projects)]
+            projects, counts = _filter_choices(db_data, options, 'project')
+            selected_projects = st.multiselect("Project(s):", ['All'] + projects, default=['All'],
+                                               format_func=_with_count(counts))
+    
+    # Apply filters: resolved on the bitmap index, then the matching rows taken once
+    def allowed(selected):
+        return None if 'All' in selected else selected
+    
+    criteria = {
+        'condition': allowed(selected_conditions),
+        'treatment': allowed(selected_treatments),
+        'sample_type': allowed(selected_sample_types),
+        'time_from_treatment_start': selected_times or None,
+        'response': allowed(selected_responses),
+        'project': allowed(selected_projects)
+    }
+    filtered_data = select_rows(db_data, get_bitmap_index(db_data).rows(criteria))
     
     # Display results
     if filtered_data.empty:
@@ -379,39 +486,86 @@ def create_custom_filter_interface(db_data):
     return filtered_data
 
 
-def calculate_cell_frequencies(db_data):
-    """Calculate relative frequencies of each cell type for each sample"""
-    if db_data.empty:
+def has_rows(db_data, rows=None):
+    """Whether the selection rows (see filter_index.select_rows) picks any row of db_data"""
+    if rows is None:
+        return not db_data.empty
+    rows = np.asarray(rows)
+    return bool(rows.any()) if rows.dtype == bool else len(rows) > 0
+
+def calculate_frequency_matrix(db_data, rows=None):
+    """Calculate per-sample relative frequencies as a wide sample x population table
+
+    Rows keep the index of db_data; values are percentages rounded to 2 decimals
+    (see utils.percentage_hundredths).
+    rows optionally selects the samples (see filter_index.select_rows), so
+    only the count columns of those samples are copied.
+    """
+    counts = select_rows(db_data[CELL_TYPES], rows)
+    return pd.DataFrame(percentage_hundredths(counts.to_numpy(dtype=float)) / 100,
+                        index=counts.index, columns=counts.columns)
+
+def _repeat_categorical(values, repeats):
+    """values (one per sample) with each repeated repeats times, as a categorical
+
+    Long-format tables store integer codes into one copy of each label
+    instead of repeating the labels, so they stay about as large as the
+    data they come from. Categories are sorted, so grouping and pivoting
+    order rows as they would for plain values.
+    """
+    if _strictly_increasing(values):
+        # e.g. a loaded frame's sample IDs (the load query orders by sample):
+        # already the sorted unique labels, so hashing them is skipped
+        codes, categories = np.arange(len(values), dtype=np.int32), values.array
+    else:
+        codes, categories = pd.factorize(values, sort=True)
+    return pd.Categorical.from_codes(np.repeat(codes.astype(np.int32), repeats), categories)
+
+def _strictly_increasing(values):
+    """Whether an Arrow-backed Series has no missing values and each value exceeds the previous one
+
+    Compared in Arrow; other Series report False rather than being converted.
+    """
+    try:
+        import pyarrow.compute as pc
+        array = values.array.__arrow_array__()
+    except (ImportError, AttributeError, TypeError):
+        return False
+    if array.null_count:
+        return False
+    return len(array) < 2 or bool(pc.all(pc.less(array[:-1], array[1:])).as_py())
+
+def _tile_populations(n_samples):
+    """CELL_TYPES once per sample, in order, as a categorical (see _repeat_categorical)"""
+    populations = sorted(CELL_TYPES)
+    codes = np.array([populations.index(population) for population in CELL_TYPES], dtype=np.int8)
+    return pd.Categorical.from_codes(np.tile(codes, n_samples), populations)
+
+@cached_analysis
+def calculate_cell_frequencies(db_data, rows=None):
+    """Calculate relative frequencies of each cell type for each sample (optionally only the selected rows)"""
+    if not has_rows(db_data, rows):
         return pd.DataFrame()
     
-    # Cell type columns
-    cell_types = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-    
-    results = []
-    
-    for _, row in db_data.iterrows():
-        sample_id = row['sample']
-        
-        # Calculate total count for this sample
-        total_count = sum(row[cell_type] for cell_type in cell_types if pd.notna(row[cell_type]))
-        
-        # Calculate frequency for each cell type
-        for cell_type in cell_types:
-            count = row[cell_type] if pd.notna(row[cell_type]) else 0
-            percentage = (count / total_count * 100) if total_count > 0 else 0
-            
-            results.append({
-                'sample': sample_id,
-                'total_count': total_count,
-                'population': cell_type,
-                'count': count,
-                'percentage': round(percentage, 2)
-            })
-    
-    return pd.DataFrame(results)
+    db_data = select_rows(db_data[['sample'] + CELL_TYPES], rows)
+    counts = db_data[CELL_TYPES].fillna(0)
+    total_counts = counts.sum(axis=1).to_numpy()
+    percentages = calculate_frequency_matrix(db_data)
+    n_populations = len(CELL_TYPES)
+    
+    # Long format, one row per (sample, population) in sample order; the
+    # columns are new arrays, so the frame takes them without copying
+    return pd.DataFrame({
+        'sample': _repeat_categorical(db_data['sample'], n_populations),
+        'total_count': np.repeat(total_counts, n_populations),
+        'population': _tile_populations(len(db_data)),
+        'count': counts.to_numpy().ravel(),
+        'percentage': percentages.to_numpy().ravel()
+    }, copy=False)
 
 def create_frequency_visualizations(frequency_data):
     """Create visualization charts for cell frequency data"""
+    import plotly.express as px
     visualizations = {}
     
     # Stacked bar chart showing cell type composition per sample
@@ -461,14 +615,47 @@ def calculate_summary_statistics(frequency_data):
     
     return summary_stats
 
-def display_frequency_analysis(filtered_data):
-    """Display the complete cell frequency analysis section"""
+def format_running_summary(summary, group_label=None):
+    """Shape a db.get_running_summary table like the per-group statistics tables
+
+    With group_label the rows are indexed by (group_label, population),
+    otherwise (for the 'all' dimension) by population alone.
+    """
+    table = summary.rename(columns={
+        'group_value': group_label, 'mean': 'Mean %', 'std': 'Std Dev %',
+        'min': 'Min %', 'max': 'Max %', 'n': 'Sample Count'
+    })
+    index = [group_label, 'population'] if group_label else ['population']
+    return table.set_index(index)[['Mean %', 'Std Dev %', 'Min %', 'Max %', 'Sample Count']].round(2)
+
+def format_percentage_summary(summary, group_by=()):
+    """Shape a db.get_percentage_summary table like the computed statistics tables
+
+    Without group_by it matches calculate_summary_statistics (indexed by
+    population); with group_by it is indexed by the grouping columns and
+    population and also carries the sample count, like compare_groups.
+    """
+    group_by = list(group_by)
+    table = summary.rename(columns={
+        'mean': 'Mean %', 'std': 'Std Dev %', 'min': 'Min %', 'max': 'Max %',
+        'median': 'Median %', 'n': 'Sample Count'
+    })
+    columns = ['Mean %', 'Std Dev %', 'Min %', 'Max %', 'Median %'] + (['Sample Count'] if group_by else [])
+    return table.set_index(group_by + ['population'])[columns].round(2)
+
+def display_frequency_analysis(filtered_data, summary_stats=None, rows=None):
+    """Display the complete cell frequency analysis section
+
+    summary_stats, if given, is a precomputed summary (format_running_summary)
+    shown instead of aggregating frequency_data. rows selects the samples of
+    filtered_data to analyze (default: all).
+    """
     st.header("📈 Data Analysis")
     st.markdown("### Cell Type Frequency Analysis")
     st.markdown("*Answering Bob's question: 'What is the frequency of each cell type in each sample?'*")
     
     # Calculate cell frequencies
-    frequency_data = calculate_cell_frequencies(filtered_data)
+    frequency_data = calculate_cell_frequencies(filtered_data, rows)
     
     if not frequency_data.empty:
         # Display summary table
@@ -507,7 +694,7 @@ def display_frequency_analysis(filtered_data):
         st.subheader("Cell Type Distribution Visualizations")
         
         # Create visualizations
-        viz = create_frequency_visualizations(frequency_data)
+        viz = cached_figure('frequency', filtered_data, rows, lambda: create_frequency_visualizations(frequency_data))
         
         # Create tabs for different visualizations
         viz_tab1, viz_tab2, viz_tab3 = st.tabs(["Stacked Bar Chart", "Heatmap", "Box Plot"])
@@ -523,7 +710,8 @@ def display_frequency_analysis(filtered_data):
         
         # Summary statistics
         st.subheader("Summary Statistics")
-        summary_stats = calculate_summary_statistics(frequency_data)
+        if summary_stats is None:
+            summary_stats = calculate_summary_statistics(frequency_data)
         st.dataframe(summary_stats, use_container_width=True)
         
         return frequency_data
@@ -531,31 +719,118 @@ def display_frequency_analysis(filtered_data):
         st.warning("No frequency data available for the selected filters.")
         return pd.DataFrame()
 
-def analyze_treatment_response_prediction(db_data):
-    """Analyze differences in cell populations between responders and non-responders for tr1 treatment"""
+def significance_stars(p_values):
+    """Map p-values to significance markers (***, **, *, ns)"""
+    p_values = np.asarray(p_values, dtype=float)
+    return np.select(
+        [p_values < 0.001, p_values < 0.01, p_values < 0.05],
+        ['***', '**', '*'],
+        default='ns'
+    )
+
+def compare_responders(percentages, is_responder):
+    """Compare every population between responders and non-responders at once
+
+    percentages is a sample x population frequency table and is_responder a
+    boolean array aligned with its rows. Runs the independent t-test and
+    Cohen's d for all populations in one vectorized call.
+    """
+    values = np.asarray(percentages, dtype=float)
+    is_responder = np.asarray(is_responder, dtype=bool)
+    responders = values[is_responder]
+    non_responders = values[~is_responder]
+    
+    return compare_responder_moments(
+        list(getattr(percentages, 'columns', CELL_TYPES)),
+        len(responders), responders.mean(axis=0), responders.var(axis=0, ddof=1),
+        len(non_responders), non_responders.mean(axis=0), non_responders.var(axis=0, ddof=1)
+    )
+
+def compare_responder_moments(populations, n_r, mean_r, var_r, n_n, mean_n, var_n):
+    """compare_responders from each group's size, means and variances (ddof=1) alone
+
+    The t-test and Cohen's d only need these moments, so they can come from
+    streamed aggregates (out_of_core.PartialAggregates.moments) as well as
+    from a loaded frequency table.
+    """
+    n_r, n_n = np.asarray(n_r, dtype=float), np.asarray(n_n, dtype=float)
+    mean_r, mean_n = np.asarray(mean_r, dtype=float), np.asarray(mean_n, dtype=float)
+    var_r, var_n = np.asarray(var_r, dtype=float), np.asarray(var_n, dtype=float)
+    t_stat, p_value, cohens_d = responder_t_test(n_r, mean_r, var_r, n_n, mean_n, var_n)
+    
+    return pd.DataFrame({
+        'population': list(populations),
+        'responder_n': n_r.astype(int),
+        'responder_mean': mean_r,
+        'responder_sd': np.sqrt(var_r),
+        'non_responder_n': n_n.astype(int),
+        'non_responder_mean': mean_n,
+        'non_responder_sd': np.sqrt(var_n),
+        'mean_difference': mean_r - mean_n,
+        't_statistic': t_stat,
+        'p_value': p_value,
+        'cohens_d': cohens_d
+    })
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (false discovery rate q-values)
+
+    NaN p-values (tests that could not run) are not counted as tests and
+    keep a NaN q-value.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    n = len(tested)
+    if n == 0:
+        return q_values
+    order = tested[np.argsort(p_values[tested])]
+    ranked = p_values[order] * n / np.arange(1, n + 1)
+    # Enforce monotonicity from the largest p-value downwards
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q_values[order] = np.minimum(ranked, 1.0)
+    return q_values
+
+def response_cohort_rows(db_data, rows=None):
+    """Positions of the melanoma tr1 PBMC samples with a y/n response, within the selection rows
+
+    Resolved on the bitmap index, so no column is copied; rows is a
+    selection as for filter_index.select_rows (default: every sample).
+    """
+    cohort = get_bitmap_index(db_data).rows({'condition': ['melanoma'], 'treatment': ['tr1'],
+                                             'sample_type': ['PBMC'], 'response': ['y', 'n']})
+    if rows is None:
+        return cohort
+    rows = np.asarray(rows)
+    return cohort[rows[cohort]] if rows.dtype == bool else np.intersect1d(cohort, rows)
+
+def analyze_treatment_response_prediction(db_data, rows=None):
+    """Analyze differences in cell populations between responders and non-responders for tr1 treatment
+
+    rows optionally restricts the samples considered (see
+    filter_index.select_rows); the cohort is passed on as row positions, so
+    the frame is never copied.
+    """
+    import plotly.express as px
     st.header("🎯 Treatment Response Prediction Analysis")
     st.markdown("### Melanoma Patients - TR1 Treatment Response Patterns")
     st.markdown("*Identifying biomarkers to predict treatment response for tr1 in melanoma patients*")
     
-    # Filter for melanoma patients with tr1 treatment and PBMC samples
-    filtered_data = db_data[
-        (db_data['condition'] == 'melanoma') & 
-        (db_data['treatment'] == 'tr1') & 
-        (db_data['sample_type'] == 'PBMC') &
-        (db_data['response'].isin(['y', 'n']))
-    ].copy()
+    # Melanoma patients with tr1 treatment, PBMC samples and a recorded response
+    cohort = response_cohort_rows(db_data, rows)
     
-    if filtered_data.empty:
+    if len(cohort) == 0:
         st.warning("No data found for melanoma patients with tr1 treatment and PBMC samples with response data.")
         return
     
     # Show filtered dataset info
-    responder_count = len(filtered_data[filtered_data['response'] == 'y'])
-    non_responder_count = len(filtered_data[filtered_data['response'] == 'n'])
+    responses = db_data['response'].iloc[cohort].to_numpy()
+    responder_count = int((responses == 'y').sum())
+    non_responder_count = int((responses == 'n').sum())
     
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Samples", len(filtered_data))
+        st.metric("Total Samples", len(cohort))
     with col2:
         st.metric("Responders", responder_count)
     with col3:
@@ -566,63 +841,36 @@ def analyze_treatment_response_prediction(db_data):
         return
     
     # Calculate cell frequencies
-    frequency_data = calculate_cell_frequencies(filtered_data)
-    
-    # Add response information
-    response_info = filtered_data[['sample', 'response']].drop_duplicates()
-    frequency_with_response = frequency_data.merge(response_info, on='sample')
+    frequency_data = calculate_cell_frequencies(db_data, cohort)
     
-    # Create response labels
-    frequency_with_response['response_label'] = frequency_with_response['response'].map({
-        'y': 'Responder',
-        'n': 'Non-Responder'
-    })
+    # Add response information: frequency rows are the samples in order, one per population
+    long_responses = np.repeat(responses, len(CELL_TYPES))
+    frequency_with_response = frequency_data.assign(
+        response=long_responses,
+        response_label=pd.Series(long_responses).map(CROSSTAB_RESPONSE_LABELS).to_numpy()
+    )
     
     # Statistical analysis
     st.subheader("📊 Statistical Analysis Results")
     
-    cell_types = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-    statistical_results = []
-    
-    for cell_type in cell_types:
-        responder_data = frequency_with_response[
-            (frequency_with_response['population'] == cell_type) & 
-            (frequency_with_response['response'] == 'y')
-        ]['percentage']
-        
-        non_responder_data = frequency_with_response[
-            (frequency_with_response['population'] == cell_type) & 
-            (frequency_with_response['response'] == 'n')
-        ]['percentage']
-        
-        if len(responder_data) > 0 and len(non_responder_data) > 0:
-            # Perform t-test
-            t_stat, p_value = stats.ttest_ind(responder_data, non_responder_data)
-            
-            # Calculate effect size (Cohen's d)
-            pooled_std = np.sqrt(((len(responder_data) - 1) * responder_data.var() + 
-                                 (len(non_responder_data) - 1) * non_responder_data.var()) / 
-                                (len(responder_data) + len(non_responder_data) - 2))
-            cohens_d = (responder_data.mean() - non_responder_data.mean()) / pooled_std if pooled_std > 0 else 0
-            
-            # Determine significance
-            significance = "***" if p_value < 0.001 else "**" if p_value < 0.01 else "*" if p_value < 0.05 else "ns"
-            
-            statistical_results.append({
-                'Cell_Population': cell_type.replace('_', ' ').title(),
-                'Responder_Mean_%': round(responder_data.mean(), 2),
-                'Responder_SD_%': round(responder_data.std(), 2),
-                'Non_Responder_Mean_%': round(non_responder_data.mean(), 2),
-                'Non_Responder_SD_%': round(non_responder_data.std(), 2),
-                'Mean_Difference_%': round(responder_data.mean() - non_responder_data.mean(), 2),
-                'T_Statistic': round(t_stat, 3),
-                'P_Value': f"{p_value:.4f}" if p_value >= 0.0001 else "<0.0001",
-                'Effect_Size_Cohens_d': round(cohens_d, 3),
-                'Significance': significance
-            })
+    percentages = calculate_frequency_matrix(db_data, cohort)
+    comparison = compare_responders(percentages, responses == 'y')
+    
+    stats_df = pd.DataFrame({
+        'Cell_Population': comparison['population'].str.replace('_', ' ').str.title(),
+        'Responder_Mean_%': comparison['responder_mean'].round(2),
+        'Responder_SD_%': comparison['responder_sd'].round(2),
+        'Non_Responder_Mean_%': comparison['non_responder_mean'].round(2),
+        'Non_Responder_SD_%': comparison['non_responder_sd'].round(2),
+        'Mean_Difference_%': comparison['mean_difference'].round(2),
+        'T_Statistic': comparison['t_statistic'].round(3),
+        'P_Value': comparison['p_value'].map(lambda p: f"{p:.4f}" if p >= 0.0001 else "<0.0001"),
+        'Effect_Size_Cohens_d': comparison['cohens_d'].round(3),
+        'Significance': significance_stars(comparison['p_value'])
+    })
+    statistical_results = stats_df.to_dict('records')
     
     # Display statistical results table
-    stats_df = pd.DataFrame(statistical_results)
     st.dataframe(
         stats_df,
         use_container_width=True,
@@ -655,6 +903,39 @@ def analyze_treatment_response_prediction(db_data):
     # Box plot visualization
     st.subheader("📈 Response Comparison Visualization")
     
+    fig = cached_figure('response_box_plot', db_data, cohort,
+                        lambda: create_response_box_plot(frequency_with_response, stats_df['Significance'].tolist()))
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Summary findings
+    st.subheader("🔍 Key Findings for Yah D'yada")
+    
+    # Identify significant differences
+    significant_pops = [result for result in statistical_results if result['Significance'] != 'ns']
+    
+    if significant_pops:
+        st.success(f"**Significant biomarkers identified:** {len(significant_pops)} cell population(s) show statistically significant differences between responders and non-responders.")
+        
+        for pop in significant_pops:
+            direction = "higher" if pop['Mean_Difference_%'] > 0 else "lower"
+            st.write(f"- **{pop['Cell_Population']}**: Responders have {direction} frequencies ({pop['Mean_Difference_%']}% difference, p={pop['P_Value']})")
+    else:
+        st.info("No statistically significant differences found between responders and non-responders in this dataset.")
+    
+    # Download statistical results
+    csv_stats = stats_df.to_csv(index=False)
+    st.download_button(
+        label="📥 Download Statistical Analysis Results",
+        data=csv_stats,
+        file_name="tr1_response_biomarker_analysis.csv",
+        mime="text/csv"
+    )
+    
+    return frequency_with_response, stats_df
+
+def create_response_box_plot(frequency_with_response, significance):
+    """Responder vs non-responder box plot with a significance marker (***, **, *) per population"""
+    import plotly.express as px
     fig = px.box(
         frequency_with_response,
         x='population',
@@ -680,106 +961,637 @@ def analyze_treatment_response_prediction(db_data):
     
     # Add significance annotations
     y_max = frequency_with_response['percentage'].max()
-    for i, result in enumerate(statistical_results):
-        if result['Significance'] != 'ns':
+    for i, marker in enumerate(significance):
+        if marker != 'ns':
             fig.add_annotation(
                 x=i,
                 y=y_max * 1.1,
-                text=result['Significance'],
+                text=marker,
                 showarrow=False,
                 font=dict(size=16, color='red')
             )
     
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+@cached_analysis
+def scan_response_biomarkers(db_data, min_group_size=3, max_workers=None):
+    """Run the responder vs non-responder comparison for every cohort
+
+    Cohorts are all (condition, treatment, sample_type, time point) combinations
+    with at least min_group_size responders and non-responders. Frequencies are
+    computed once for all samples; cohorts are compared in parallel and the
+    combined table is ranked by Benjamini-Hochberg q-value.
+    """
+    response_data = db_data[db_data['response'].isin(['y', 'n'])]
+    if response_data.empty:
+        return pd.DataFrame()
     
-    # Summary findings
-    st.subheader("🔍 Key Findings for Yah D'yada")
+    # One frequency computation shared by every cohort
+    percentages = calculate_frequency_matrix(response_data).to_numpy()
+    is_responder = response_data['response'].eq('y').to_numpy()
+    
+    grouped = response_data.assign(is_responder=is_responder).groupby(COHORT_KEYS)
+    group_sizes = grouped['is_responder'].agg(['sum', 'size'])
+    eligible = group_sizes[
+        (group_sizes['sum'] >= min_group_size) &
+        (group_sizes['size'] - group_sizes['sum'] >= min_group_size)
+    ].index
+    if len(eligible) == 0:
+        return pd.DataFrame()
     
-    # Identify significant differences
-    significant_pops = [result for result in statistical_results if result['Significance'] != 'ns']
+    positions = grouped.indices
     
-    if significant_pops:
-        st.success(f"**Significant biomarkers identified:** {len(significant_pops)} cell population(s) show statistically significant differences between responders and non-responders.")
-        
-        for pop in significant_pops:
-            direction = "higher" if pop['Mean_Difference_%'] > 0 else "lower"
-            st.write(f"- **{pop['Cell_Population']}**: Responders have {direction} frequencies ({pop['Mean_Difference_%']}% difference, p={pop['P_Value']})")
-    else:
-        st.info("No statistically significant differences found between responders and non-responders in this dataset.")
+    def compare_cohort(cohort):
+        rows = positions[cohort]
+        result = compare_responders(
+            pd.DataFrame(percentages[rows], columns=CELL_TYPES), is_responder[rows]
+        )
+        for key, value in zip(COHORT_KEYS, cohort):
+            result[key] = value
+        return result
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(compare_cohort, eligible))
+    
+    scan = pd.concat(results, ignore_index=True)
+    scan['q_value'] = benjamini_hochberg(scan['p_value'])
+    scan['significance'] = significance_stars(scan['q_value'])
+    scan = scan[COHORT_KEYS + [column for column in scan.columns if column not in COHORT_KEYS]]
+    return scan.sort_values(['q_value', 'p_value']).reset_index(drop=True)
+
+def display_response_biomarker_scan(db_data):
+    """Display the ranked responder comparison across every cohort"""
+    st.subheader("🧭 Biomarker Scan Across All Cohorts")
+    st.markdown("*Every condition × treatment × sample type × time point with enough responders and non-responders*")
+    
+    min_group_size = st.number_input(
+        "Minimum samples per response group:", min_value=2, value=3, key="scan_min_group_size"
+    )
+    scan = scan_response_biomarkers(db_data, min_group_size=int(min_group_size))
+    
+    if scan.empty:
+        st.info("No cohort has enough responders and non-responders for comparison.")
+        return scan
+    
+    n_cohorts = len(scan.drop_duplicates(COHORT_KEYS))
+    n_significant = int((scan['q_value'] < 0.05).sum())
+    st.write(f"Compared **{n_cohorts}** cohorts; **{n_significant}** population comparisons "
+             f"significant after Benjamini-Hochberg correction (q < 0.05).")
+    
+    st.dataframe(
+        scan.round({'responder_mean': 2, 'responder_sd': 2, 'non_responder_mean': 2,
+                    'non_responder_sd': 2, 'mean_difference': 2, 't_statistic': 3,
+                    'cohens_d': 3}),
+        use_container_width=True,
+        column_config={
+            "p_value": st.column_config.NumberColumn("P-Value", format="%.4g"),
+            "q_value": st.column_config.NumberColumn("Q-Value (BH)", format="%.4g")
+        }
+    )
     
-    # Download statistical results
-    csv_stats = stats_df.to_csv(index=False)
     st.download_button(
-        label="📥 Download Statistical Analysis Results",
-        data=csv_stats,
-        file_name="tr1_response_biomarker_analysis.csv",
+        label="📥 Download Cohort Biomarker Scan",
+        data=scan.to_csv(index=False),
+        file_name="response_biomarker_scan.csv",
         mime="text/csv"
     )
     
-    return frequency_with_response, stats_df
+    return scan
 
-def compare_treatments(db_data):
-    """Compare cell frequencies between different treatments"""
+@cached_analysis
+def cross_validate_response_classifier(db_data, condition='melanoma', treatment='tr1', sample_type='PBMC',
+                                       n_splits=5, n_repeats=20, l2=1.0, seed=0, max_workers=None):
+    """Cross-validated logistic classifier of response from the full frequency profile
+
+    Features are the centered log-ratios of the cohort's per-sample
+    frequencies; folds keep each subject's samples together. Returns None if
+    the cohort has fewer than n_splits subjects in either response group,
+    otherwise the cross_validate results plus the coefficients of a model
+    fitted on the whole cohort.
+    """
+    cohort = select_cohort(db_data, condition=condition, sample_type=sample_type, treatment=treatment)
+    cohort = cohort[cohort['response'].isin(['y', 'n'])]
+    subject_response = cohort.drop_duplicates('subject')['response']
+    if min((subject_response == 'y').sum(), (subject_response == 'n').sum()) < n_splits:
+        return None
+    
+    features = clr_transform(calculate_frequency_matrix(cohort).to_numpy())
+    labels = cohort['response'].eq('y').to_numpy()
+    result = cross_validate(features, labels, groups=cohort['subject'].to_numpy(), n_splits=n_splits,
+                            n_repeats=n_repeats, l2=l2, seed=seed, max_workers=max_workers)
+    
+    model = fit_logistic_regression(features, labels, l2)
+    result['coefficients'] = pd.DataFrame({
+        'population': CELL_TYPES,
+        'coefficient': model['coefficients'],
+        'odds_ratio_per_sd': np.exp(model['coefficients'])
+    })
+    result['n_samples'] = len(cohort)
+    result['n_responders'] = int(labels.sum())
+    return result
+
+def display_response_classifier(db_data, condition='melanoma', treatment='tr1', sample_type='PBMC'):
+    """Display cross-validated prediction performance of the multivariate classifier"""
+    import plotly.graph_objects as go
+    st.subheader("🤖 Multivariate Response Classifier")
+    st.markdown("*Regularized logistic regression on log-ratio cell frequencies, "
+                "scored by repeated subject-grouped cross-validation*")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        n_splits = st.number_input("Folds:", min_value=2, max_value=10, value=5, key="classifier_folds")
+    with col2:
+        n_repeats = st.number_input("Repeats:", min_value=1, max_value=200, value=20, key="classifier_repeats")
+    with col3:
+        l2 = st.select_slider("L2 penalty:", options=[0.01, 0.1, 1.0, 10.0, 100.0], value=1.0,
+                              key="classifier_l2")
+    
+    result = cross_validate_response_classifier(db_data, condition, treatment, sample_type,
+                                                n_splits=int(n_splits), n_repeats=int(n_repeats), l2=l2)
+    if result is None:
+        st.info(f"Need at least {int(n_splits)} responder and non-responder subjects for cross-validation.")
+        return None
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Cross-validated AUC", f"{result['auc']:.3f}")
+    with col2:
+        st.metric("95% CI", f"{result['ci_low']:.3f} – {result['ci_high']:.3f}")
+    with col3:
+        st.metric("Samples (responders)", f"{result['n_samples']} ({result['n_responders']})")
+    
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=result['fpr'], y=result['tpr'], mode='lines', name='Classifier'))
+    fig.add_trace(go.Scatter(x=[0, 1], y=[0, 1], mode='lines', name='Chance', line=dict(dash='dash')))
+    fig.update_layout(title='ROC Curve (repeat-averaged out-of-fold scores)',
+                      xaxis_title='False Positive Rate', yaxis_title='True Positive Rate', height=450)
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.dataframe(result['coefficients'].round(3), use_container_width=True,
+                 column_config={"odds_ratio_per_sd": "Odds Ratio (per SD of log-ratio)"})
+    
+    return result
+
+@cached_analysis
+def calculate_longitudinal_changes(db_data, pseudocount=0.1):
+    """Align every sample to its subject's baseline and compute per-population changes
+
+    Baseline is the time-0 sample of the same subject and sample type (averaged
+    if there are several). Returns one row per (sample, population) with the
+    absolute change in percentage points and the log2 fold change
+    (pseudocount added to both frequencies). Samples without a baseline are dropped.
+    """
     if db_data.empty:
-        return
+        return pd.DataFrame()
     
-    st.subheader("Treatment Comparison Analysis")
+    keys = ['subject', 'sample_type']
+    percentages = calculate_frequency_matrix(db_data)
+    frame = pd.concat([
+        db_data[['sample'] + keys + ['treatment', 'condition', 'response', 'time_from_treatment_start']],
+        percentages
+    ], axis=1)
+    
+    # Baseline profile per (subject, sample type), joined back onto every sample
+    baseline = frame[frame['time_from_treatment_start'] == 0].groupby(keys)[CELL_TYPES].mean()
+    aligned = frame.join(baseline, on=keys, rsuffix='_baseline', how='inner')
+    if aligned.empty:
+        return pd.DataFrame()
     
-    frequency_data = calculate_cell_frequencies(db_data)
+    current = aligned[CELL_TYPES].to_numpy()
+    reference = aligned[[f"{cell_type}_baseline" for cell_type in CELL_TYPES]].to_numpy()
+    n_populations = len(CELL_TYPES)
+    
+    def repeat(column):
+        return np.repeat(aligned[column].to_numpy(), n_populations)
+    
+    return pd.DataFrame({
+        'sample': repeat('sample'),
+        'subject': repeat('subject'),
+        'sample_type': repeat('sample_type'),
+        'treatment': repeat('treatment'),
+        'condition': repeat('condition'),
+        'response': repeat('response'),
+        'time_from_treatment_start': repeat('time_from_treatment_start'),
+        'population': np.tile(CELL_TYPES, len(aligned)),
+        'baseline_percentage': reference.ravel(),
+        'percentage': current.ravel(),
+        'absolute_change': (current - reference).ravel(),
+        'log2_fold_change': np.log2((current + pseudocount) / (reference + pseudocount)).ravel()
+    })
+
+def summarize_trajectories(changes):
+    """Summarize change from baseline per response group, time point and population"""
+    if changes.empty:
+        return pd.DataFrame()
     
-    if not frequency_data.empty:
-        # Add treatment information to frequency data
-        treatment_info = db_data[['sample', 'treatment']].drop_duplicates()
-        frequency_with_treatment = frequency_data.merge(treatment_info, on='sample')
-        
-        # Create comparison visualization
-        fig = px.box(
-            frequency_with_treatment,
-            x='treatment',
-            y='percentage',
-            color='population',
-            title='Cell Type Percentage Distribution by Treatment',
-            labels={'percentage': 'Percentage (%)', 'treatment': 'Treatment'},
-            height=600
+    response_changes = changes[changes['response'].isin(['y', 'n'])]
+    summary = response_changes.groupby(['response', 'time_from_treatment_start', 'population']).agg(
+        subjects=('subject', 'nunique'),
+        samples=('sample', 'size'),
+        mean_change=('absolute_change', 'mean'),
+        median_change=('absolute_change', 'median'),
+        sem_change=('absolute_change', 'sem'),
+        mean_log2_fc=('log2_fold_change', 'mean'),
+        sem_log2_fc=('log2_fold_change', 'sem')
+    ).reset_index()
+    summary['response_label'] = summary['response'].map(CROSSTAB_RESPONSE_LABELS)
+    return summary
+
+def display_longitudinal_analysis(db_data):
+    """Display per-subject change from baseline over time for one cohort"""
+    import plotly.express as px
+    st.header("⏱️ Longitudinal Change from Baseline")
+    st.markdown("*How each population moves per subject relative to their day-0 sample*")
+    
+    col1, col2, col3 = st.columns(3)
+    cohort = {}
+    for col, (column, label, default) in zip(
+        (col1, col2, col3),
+        (('condition', 'Condition', 'melanoma'), ('treatment', 'Treatment', 'tr1'),
+         ('sample_type', 'Sample Type', 'PBMC'))
+    ):
+        options = ['All'] + sorted(db_data[column].dropna().unique().tolist())
+        with col:
+            selected = st.selectbox(f"{label}:", options,
+                                    index=options.index(default) if default in options else 0,
+                                    key=f"longitudinal_{column}")
+        cohort[column] = None if selected == 'All' else selected
+    
+    cohort_data = select_cohort(db_data, cohort['condition'], cohort['sample_type'], cohort['treatment'])
+    changes = calculate_longitudinal_changes(cohort_data)
+    
+    if changes.empty:
+        st.warning("No subjects in this cohort have both a baseline and follow-up samples.")
+        return changes
+    
+    follow_up = changes[changes['time_from_treatment_start'] > 0]
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Subjects with Baseline", changes['subject'].nunique())
+    with col2:
+        st.metric("Subjects with Follow-up", follow_up['subject'].nunique())
+    with col3:
+        st.metric("Follow-up Samples", follow_up['sample'].nunique())
+    
+    trajectories = summarize_trajectories(changes)
+    if not trajectories.empty:
+        fig = px.line(
+            trajectories,
+            x='time_from_treatment_start',
+            y='mean_log2_fc',
+            color='response_label',
+            facet_col='population',
+            markers=True,
+            title='Mean log2 Fold Change from Baseline: Responders vs Non-Responders',
+            labels={
+                'time_from_treatment_start': 'Days from Treatment Start',
+                'mean_log2_fc': 'Mean log2 FC',
+                'response_label': 'Response Group'
+            },
+            color_discrete_map={'Responder': '#2E8B57', 'Non-Responder': '#DC143C'},
+            height=450
         )
         st.plotly_chart(fig, use_container_width=True)
         
-        # Statistical comparison table
-        treatment_stats = frequency_with_treatment.groupby(['treatment', 'population']).agg({
-            'percentage': ['mean', 'std', 'count']
-        }).round(2)
-        treatment_stats.columns = ['Mean %', 'Std Dev %', 'Sample Count']
-        st.dataframe(treatment_stats, use_container_width=True)
-
-def compare_conditions(db_data):
-    """Compare cell frequencies between different conditions"""
-    if db_data.empty:
-        return
+        st.subheader("📋 Trajectory Summary")
+        st.dataframe(trajectories.drop(columns='response_label').round(3), use_container_width=True)
+    else:
+        st.info("No response data available to split trajectories by response.")
     
-    st.subheader("Condition Comparison Analysis")
+    st.download_button(
+        label="📥 Download Per-Sample Changes from Baseline",
+        data=changes.to_csv(index=False),
+        file_name="longitudinal_changes.csv",
+        mime="text/csv"
+    )
     
-    frequency_data = calculate_cell_frequencies(db_data)
+    return changes
+
+@cached_analysis
+def compare_datasets(old_data, new_data):
+    """Diff two versions of the dataset (e.g. two snapshots) with vectorized joins
+
+    Returns a dict with 'samples' (one row per added, removed or changed sample,
+    listing the changed columns) and 'frequency_shift' (per-population mean
+    percentage in each version, plus the mean per-sample shift for samples
+    present in both).
+    """
+    columns = [column for column in old_data.columns if column != 'sample' and column in new_data.columns]
+    merged = old_data.merge(new_data, on='sample', how='outer', suffixes=('_old', '_new'), indicator=True)
+    
+    old_values = merged[[f"{column}_old" for column in columns]].set_axis(columns, axis=1)
+    new_values = merged[[f"{column}_new" for column in columns]].set_axis(columns, axis=1)
+    in_both = merged['_merge'] == 'both'
+    differs = ((old_values != new_values) & ~(old_values.isna() & new_values.isna())).mul(in_both, axis=0).astype(bool)
+    changed = differs.any(axis=1)
+    
+    merged['status'] = np.select(
+        [merged['_merge'] == 'left_only', merged['_merge'] == 'right_only', changed],
+        ['removed', 'added', 'changed'],
+        default='unchanged'
+    )
+    # Comma-separated names of the columns that differ, built with one matrix product
+    merged['changed_columns'] = differs.dot(
+        pd.Series([f"{column}, " for column in columns], index=columns)
+    ).str.rstrip(', ')
+    
+    sample_diff = merged.loc[merged['status'] != 'unchanged', ['sample', 'status', 'changed_columns']]
+    
+    old_percentages = calculate_frequency_matrix(old_data).set_index(old_data['sample'])
+    new_percentages = calculate_frequency_matrix(new_data).set_index(new_data['sample'])
+    common = old_percentages.index.intersection(new_percentages.index)
+    per_sample_shift = (new_percentages.loc[common] - old_percentages.loc[common]).abs()
+    
+    frequency_shift = pd.DataFrame({
+        'old_mean_%': old_percentages.mean(),
+        'new_mean_%': new_percentages.mean(),
+    }).reindex(CELL_TYPES)
+    frequency_shift['shift_%'] = frequency_shift['new_mean_%'] - frequency_shift['old_mean_%']
+    frequency_shift['mean_abs_sample_shift_%'] = per_sample_shift.mean()
+    frequency_shift.index.name = 'population'
+    
+    return {
+        'counts': merged['status'].value_counts().reindex(['added', 'removed', 'changed', 'unchanged'], fill_value=0),
+        'samples': sample_diff.sort_values(['status', 'sample']).reset_index(drop=True),
+        'frequency_shift': frequency_shift.round(3).reset_index()
+    }
+
+def display_snapshot_comparison(old_data, new_data, old_label, new_label):
+    """Display added/removed/changed samples and population frequency shifts between two datasets"""
+    import plotly.express as px
+    st.subheader(f"🔀 Snapshot Comparison: {old_label} → {new_label}")
     
-    if not frequency_data.empty:
-        # Add condition information to frequency data
-        condition_info = db_data[['sample', 'condition']].drop_duplicates()
-        frequency_with_condition = frequency_data.merge(condition_info, on='sample')
-        
-        # Create comparison visualization
-        fig = px.violin(
-            frequency_with_condition,
-            x='condition',
-            y='percentage',
-            color='population',
-            title='Cell Type Percentage Distribution by Condition',
-            labels={'percentage': 'Percentage (%)', 'condition': 'Condition'},
-            height=600
+    comparison = compare_datasets(old_data, new_data)
+    counts = comparison['counts']
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Added Samples", int(counts['added']))
+    with col2:
+        st.metric("Removed Samples", int(counts['removed']))
+    with col3:
+        st.metric("Changed Samples", int(counts['changed']))
+    with col4:
+        st.metric("Unchanged Samples", int(counts['unchanged']))
+    
+    st.write("**Population Frequency Shifts:**")
+    frequency_shift = comparison['frequency_shift']
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.dataframe(frequency_shift, use_container_width=True, hide_index=True)
+    with col2:
+        fig = px.bar(
+            frequency_shift,
+            x='population',
+            y='shift_%',
+            title='Change in Mean Population Frequency',
+            labels={'shift_%': 'Shift (percentage points)', 'population': 'Cell Population'}
         )
         st.plotly_chart(fig, use_container_width=True)
-        
-        # Statistical comparison table
-        condition_stats = frequency_with_condition.groupby(['condition', 'population']).agg({
-            'percentage': ['mean', 'std', 'count']
-        }).round(2)
-        condition_stats.columns = ['Mean %', 'Std Dev %', 'Sample Count']
-        st.dataframe(condition_stats, use_container_width=True)
\ No newline at end of file
+    
+    if not comparison['samples'].empty:
+        st.write("**Sample Differences:**")
+        st.dataframe(comparison['samples'], use_container_width=True, hide_index=True)
+        st.download_button(
+            label="📥 Download Snapshot Differences",
+            data=comparison['samples'].to_csv(index=False),
+            file_name=f"snapshot_diff_{old_label}_vs_{new_label}.csv",
+            mime="text/csv"
+        )
+    else:
+        st.info("The two datasets contain identical samples.")
+    
+    return comparison
+
+GROUPING_COLUMNS = {
+    'treatment': 'Treatment',
+    'condition': 'Condition',
+    'project': 'Project',
+    'sample_type': 'Sample Type',
+    'time_from_treatment_start': 'Time Point',
+    'sex': 'Sex',
+    'response': 'Response'
+}
+
+def _grouped_anova(group_stats, n_total):
+    """One-way ANOVA F-test for every population from per-group count, mean and variance"""
+    from scipy import stats
+    counts = group_stats['count']
+    means = group_stats['mean']
+    variances = group_stats['var'].fillna(0)
+    n_groups = len(counts)
+    grand_mean = (means.mul(counts, axis=0)).sum() / counts.sum()
+    between = means.sub(grand_mean, axis=1).pow(2).mul(counts, axis=0).sum()
+    within = variances.mul(counts - 1, axis=0).sum()
+    df_between, df_within = n_groups - 1, n_total - n_groups
+    if df_between < 1 or df_within < 1:
+        return pd.Series(np.nan, index=means.columns), pd.Series(np.nan, index=means.columns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_statistic = (between / df_between) / (within / df_within)
+    return f_statistic, pd.Series(stats.f.sf(f_statistic, df_between, df_within), index=means.columns)
+
+def _grouped_kruskal(percentages, group_index, n_groups):
+    """Kruskal-Wallis H-test for every population, ranking all populations at once"""
+    from scipy import stats
+    n_total = len(percentages)
+    columns = percentages.columns
+    if n_groups < 2 or n_total < 2:
+        return pd.Series(np.nan, index=columns), pd.Series(np.nan, index=columns)
+    ranks = stats.rankdata(percentages.to_numpy(), axis=0)
+    rank_sums = np.zeros((n_groups, ranks.shape[1]))
+    np.add.at(rank_sums, group_index, ranks)
+    group_sizes = np.bincount(group_index, minlength=n_groups)[:, None]
+    h_statistic = 12 / (n_total * (n_total + 1)) * (rank_sums ** 2 / group_sizes).sum(axis=0) - 3 * (n_total + 1)
+    
+    # Tie correction: sum of (t^3 - t) over tied values in each column
+    sorted_values = np.sort(percentages.to_numpy(), axis=0)
+    ties = np.zeros(ranks.shape[1])
+    for column in range(ranks.shape[1]):
+        _, tie_counts = np.unique(sorted_values[:, column], return_counts=True)
+        ties[column] = (tie_counts ** 3 - tie_counts).sum()
+    correction = 1 - ties / (n_total ** 3 - n_total)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_statistic = np.where(correction > 0, h_statistic / correction, np.nan)
+    return pd.Series(h_statistic, index=columns), pd.Series(stats.chi2.sf(h_statistic, n_groups - 1), index=columns)
+
+@cached_analysis
+def compare_groups(db_data, group_by, rows=None):
+    """Compare population frequencies across the groups formed by one or more columns
+
+    Frequencies are computed once; group summaries (mean, std, min, max,
+    count), one-way ANOVA and Kruskal-Wallis tests for every population come
+    from the same grouped pass. Rows missing a grouping value are left out.
+    Returns a dict with 'frequencies' (long format, for charts), 'summary'
+    (indexed by the grouping columns and population) and 'tests' (one row per
+    population, with Benjamini-Hochberg q-values). rows selects the samples
+    compared (default: all); only the columns used are copied.
+    """
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    grouped_data = select_rows(db_data[['sample'] + group_by + CELL_TYPES], rows).dropna(subset=group_by)
+    if grouped_data.empty:
+        return {'frequencies': pd.DataFrame(), 'summary': pd.DataFrame(), 'tests': pd.DataFrame()}
+    
+    percentages = calculate_frequency_matrix(grouped_data)
+    keys = [grouped_data[column] for column in group_by]
+    group_stats = percentages.groupby(keys).agg(['count', 'mean', 'var', 'min', 'max'])
+    group_stats = {statistic: group_stats.xs(statistic, axis=1, level=1)
+                   for statistic in ['count', 'mean', 'var', 'min', 'max']}
+    
+    summary = pd.concat({
+        'Mean %': group_stats['mean'].stack(),
+        'Std Dev %': np.sqrt(group_stats['var']).stack(),
+        'Min %': group_stats['min'].stack(),
+        'Max %': group_stats['max'].stack(),
+        'Sample Count': group_stats['count'].stack()
+    }, axis=1).round(2)
+    summary.index = summary.index.set_names(group_by + ['population'])
+    
+    n_groups = len(group_stats['count'])
+    group_index = percentages.groupby(keys).ngroup().to_numpy()
+    f_statistic, anova_p = _grouped_anova(group_stats, len(percentages))
+    h_statistic, kruskal_p = _grouped_kruskal(percentages, group_index, n_groups)
+    tests = pd.DataFrame({
+        'population': CELL_TYPES,
+        'n_groups': n_groups,
+        'f_statistic': f_statistic.to_numpy(),
+        'anova_p': anova_p.to_numpy(),
+        'h_statistic': h_statistic.to_numpy(),
+        'kruskal_p': kruskal_p.to_numpy()
+    })
+    if tests['anova_p'].notna().all():
+        tests['anova_q'] = benjamini_hochberg(tests['anova_p'])
+        tests['kruskal_q'] = benjamini_hochberg(tests['kruskal_p'])
+        tests['significance'] = significance_stars(tests['kruskal_q'])
+    
+    # Group labels are built once per sample with vectorized string concatenation
+    labels = [grouped_data[column].astype(str) for column in group_by]
+    group_labels = labels[0].str.cat(labels[1:], sep=' / ') if len(labels) > 1 else labels[0]
+    n_populations = len(CELL_TYPES)
+    frequencies = pd.DataFrame({
+        'sample': _repeat_categorical(grouped_data['sample'], n_populations),
+        **{column: _repeat_categorical(grouped_data[column], n_populations) for column in group_by},
+        'population': _tile_populations(len(grouped_data)),
+        'percentage': percentages.to_numpy().ravel(),
+        'group': _repeat_categorical(group_labels, n_populations)
+    }, copy=False)
+    
+    return {'frequencies': frequencies, 'summary': summary, 'tests': tests}
+
+def display_group_comparison(db_data, group_by, chart='box', summary=None, rows=None):
+    """Chart, summary table and omnibus tests for a compare_groups comparison
+
+    summary, if given, replaces the computed summary table (e.g. one served
+    by format_running_summary).
+    """
+    import plotly.express as px
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    comparison = compare_groups(db_data, group_by, rows)
+    frequencies = comparison['frequencies']
+    if frequencies.empty:
+        st.info("No samples have values for the selected grouping.")
+        return comparison
+    
+    label = ' × '.join(GROUPING_COLUMNS.get(column, column) for column in group_by)
+    plot = px.violin if chart == 'violin' else px.box
+    fig = cached_figure('group_comparison', db_data, rows, lambda: plot(
+        frequencies,
+        x='group',
+        y='percentage',
+        color='population',
+        title=f'Cell Type Percentage Distribution by {label}',
+        labels={'percentage': 'Percentage (%)', 'group': label},
+        height=600
+    ), group_by=group_by, chart=chart)
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.dataframe(comparison['summary'] if summary is None else summary, use_container_width=True)
+    
+    st.markdown(f"**Omnibus tests across {label.lower()} groups** (ANOVA and Kruskal-Wallis)")
+    st.dataframe(
+        comparison['tests'].round({'f_statistic': 3, 'h_statistic': 3}),
+        use_container_width=True,
+        column_config={
+            "anova_p": st.column_config.NumberColumn("ANOVA P", format="%.4g"),
+            "kruskal_p": st.column_config.NumberColumn("Kruskal-Wallis P", format="%.4g"),
+            "anova_q": st.column_config.NumberColumn("ANOVA Q (BH)", format="%.4g"),
+            "kruskal_q": st.column_config.NumberColumn("Kruskal-Wallis Q (BH)", format="%.4g")
+        }
+    )
+    return comparison
+
+def compare_treatments(db_data, summary=None, rows=None):
+    """Compare cell frequencies between different treatments"""
+    if not has_rows(db_data, rows):
+        return
+    
+    st.subheader("Treatment Comparison Analysis")
+    return display_group_comparison(db_data, ['treatment'], chart='box', summary=summary, rows=rows)
+
+def compare_conditions(db_data, summary=None, rows=None):
+    """Compare cell frequencies between different conditions"""
+    if not has_rows(db_data, rows):
+        return
+    
+    st.subheader("Condition Comparison Analysis")
+    return display_group_comparison(db_data, ['condition'], chart='violin', summary=summary, rows=rows)
+
+def display_custom_group_comparison(db_data, rows=None):
+    """Let the user compare frequencies across any combination of grouping columns"""
+    st.subheader("Custom Group Comparison")
+    group_by = st.multiselect(
+        "Compare by:",
+        list(GROUPING_COLUMNS),
+        default=['project'],
+        format_func=GROUPING_COLUMNS.get,
+        key="custom_group_by"
+    )
+    if not group_by:
+        st.info("Select at least one column to group by.")
+        return None
+    chart = st.radio("Chart:", ['box', 'violin'], horizontal=True, key="custom_group_chart")
+    return display_group_comparison(db_data, group_by, chart=chart, rows=rows)
+
+def display_out_of_core_analysis(aggregates, filters=None):
+    """Summaries, cross-tabs and the responder comparison from streamed aggregates
+
+    aggregates is an out_of_core.PartialAggregates; no per-sample table is
+    loaded, so the sections that plot individual samples are not shown.
+    filters ({column: allowed values}, None for all) restricts every section.
+    """
+    filters = filters or {}
+    st.header("📈 Data Analysis (streamed)")
+    st.metric("Samples", f"{aggregates.count(filters):,}")
+    
+    st.subheader("Summary Statistics")
+    st.dataframe(format_percentage_summary(aggregates.summary(filters=filters)), use_container_width=True)
+    
+    for group_by, label in [(['treatment'], "Treatment"), (['condition'], "Condition")]:
+        st.subheader(f"{label} Comparison")
+        st.dataframe(format_percentage_summary(aggregates.summary(group_by, filters), group_by),
+                     use_container_width=True)
+    if any(values is not None for values in filters.values()):
+        st.caption("Medians are only kept per group over all samples, so they are left blank "
+                   "where a filter applies to columns other than the grouping.")
+    
+    st.subheader("Samples by Project and Response")
+    crosstab = aggregates.crosstab('project', 'response', filters)
+    crosstab = crosstab.rename(columns=lambda value: CROSSTAB_RESPONSE_LABELS.get(value, 'Unknown'))
+    st.dataframe(_add_margins(crosstab), use_container_width=True)
+    
+    st.subheader("Responders vs Non-Responders (Melanoma, TR1, PBMC)")
+    cohort = dict(filters)
+    for column, value in [('condition', 'melanoma'), ('treatment', 'tr1'), ('sample_type', 'PBMC')]:
+        cohort[column] = [value] if cohort.get(column) is None or value in cohort[column] else []
+    moments = aggregates.moments(['response'], cohort)
+    if not {'y', 'n'} <= set(moments.index.get_level_values('response')):
+        st.warning("Need both responders and non-responders for comparison analysis.")
+        return None
+    responders, non_responders = moments.loc['y'].reindex(CELL_TYPES), moments.loc['n'].reindex(CELL_TYPES)
+    comparison = compare_responder_moments(
+        CELL_TYPES,
+        responders['n'], responders['mean'], responders['var'],
+        non_responders['n'], non_responders['mean'], non_responders['var']
+    )
+    comparison['significance'] = significance_stars(comparison['p_value'])
+    st.dataframe(comparison.round(4), use_container_width=True)
+    return comparison
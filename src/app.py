@@ -1,11 +1,320 @@
 import streamlit as st
 import pandas as pd
-from db import initialize_db, load_data, process_and_load_data, remove_sample, add_sample
+import numpy as np
+from jobs import start_ingest_job, get_ingest_job
+from snapshots import create_snapshot, list_snapshots, snapshot_path
+from cache import get_figure_cache, get_result_cache
+from filter_index import get_bitmap_index, select_rows
 from analysis import (display_frequency_analysis, compare_treatments, compare_conditions, 
                      analyze_treatment_response_prediction, analyze_baseline_subset, 
-                     create_custom_filter_interface)
+                     create_custom_filter_interface, display_response_biomarker_scan,
+                     display_longitudinal_analysis, display_snapshot_comparison,
+                     format_running_summary, format_percentage_summary, display_response_classifier,
+                     display_custom_group_comparison, display_out_of_core_analysis)
+from out_of_core import MEMORY_BUDGET_MB, exceeds_memory_budget, aggregate_databases
+from shards import list_shards
+from utils import validate_chunks, summarize_validation_errors
+import hashlib
 import os
 
+from backends import get_backend
+from db import (load_data as load_snapshot_data, get_running_summary as get_snapshot_summary,
+                get_filter_options as get_snapshot_filter_options, count_dimension_values,
+                search_ids as search_snapshot_ids,
+                get_percentage_summary as get_snapshot_percentage_summary)
+
+# Analyses share the loaded dataset instead of copying it; copy-on-write (always
+# on from pandas 3) makes any function that modifies its input copy first
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Storage backend chosen with SAMPLES_DB_BACKEND (sqlite, sharded or duckdb; see backends.py)
+backend = get_backend()
+SHARDED_LAYOUT = backend.__name__ == 'shards'
+
+@st.fragment(run_every=1)
+def show_ingest_progress(db_name):
+    """Poll the background load for db_name without rerunning the rest of the page"""
+    job = get_ingest_job(db_name)
+    if job is None:
+        return
+    
+    if not job.finished:
+        total = f"{job.total_rows:,}" if job.total_rows is not None else "?"
+        st.progress(job.fraction_complete,
+                    text=f"Loading data... parsed {job.rows_parsed:,} rows, "
+                         f"wrote {job.rows_written:,} / {total} ({job.elapsed:.0f}s)")
+        if st.button("✖️ Cancel Load", key=f"cancel_ingest_{job.job_id}"):
+            job.cancel()
+        return
+    
+    # Finished: record the outcome once for this session and refresh the whole page
+    st.session_state.acknowledged_ingest_job = job.job_id
+    if job.status == 'done':
+        st.session_state.data_loaded = True
+        st.session_state.database_cleared = False  # Data is loaded
+        st.session_state.ingest_notice = ('success', f"✅ Data loaded successfully! ({job.rows_written:,} samples in {job.elapsed:.1f}s)")
+    elif job.status == 'cancelled':
+        st.session_state.ingest_notice = ('warning', "Data load cancelled. The database was left unchanged.")
+    else:
+        st.session_state.ingest_notice = ('error', f"❌ Error loading data into database. {job.error or ''}")
+    st.rerun(scope='app')
+
+LIVE_DATABASE = 'Live database'
+
+def load_dataset(db_name, source):
+    """Load the live database or a named snapshot (read-only)"""
+    if source == LIVE_DATABASE:
+        return backend.load_data(db_name)
+    return load_snapshot_data(snapshot_path(db_name, source), readonly=True)
+
+def load_running_summaries(db_name, source):
+    """Overall, per-treatment and per-condition statistics kept up to date by the database"""
+    if source == LIVE_DATABASE:
+        summaries = {dimension: backend.get_running_summary(db_name, dimension)
+                     for dimension in ('all', 'treatment', 'condition')}
+    else:
+        path = snapshot_path(db_name, source)
+        summaries = {dimension: get_snapshot_summary(path, dimension, readonly=True)
+                     for dimension in ('all', 'treatment', 'condition')}
+    if any(summary.empty for summary in summaries.values()):
+        return None  # fall back to aggregating the samples
+    return {
+        'all': format_running_summary(summaries['all']).drop(columns='Sample Count'),
+        'treatment': format_running_summary(summaries['treatment'], 'treatment'),
+        'condition': format_running_summary(summaries['condition'], 'condition')
+    }
+
+def load_summaries(db_name, source, filters=None):
+    """Overall, per-treatment and per-condition statistics for the selected filters, aggregated by the database
+
+    filters is select_filters' {column: [value] or None}. Returns None when
+    the database cannot serve them, so the sections aggregate the samples
+    themselves.
+    """
+    filters = filters or {}
+    if source == LIVE_DATABASE:
+        summaries = {dimension: backend.get_percentage_summary(db_name, group_by, filters)
+                     for dimension, group_by in (('all', []), ('treatment', ['treatment']),
+                                                 ('condition', ['condition']))}
+    else:
+        path = snapshot_path(db_name, source)
+        summaries = {dimension: get_snapshot_percentage_summary(path, group_by, filters, readonly=True)
+                     for dimension, group_by in (('all', []), ('treatment', ['treatment']),
+                                                 ('condition', ['condition']))}
+    if any(summary is None for summary in summaries.values()):
+        # e.g. older snapshots, or sharded data the shards cannot summarize exactly
+        if all(values is None for values in filters.values()):
+            return load_running_summaries(db_name, source)
+        return None
+    return {
+        'all': format_percentage_summary(summaries['all']),
+        'treatment': format_percentage_summary(summaries['treatment'], ['treatment']),
+        'condition': format_percentage_summary(summaries['condition'], ['condition'])
+    }
+
+def load_filter_options(db_name, source, db_data):
+    """Filter option values with sample counts, from the database's lookup tables"""
+    if source == LIVE_DATABASE:
+        options = backend.get_filter_options(db_name)
+    else:
+        options = get_snapshot_filter_options(snapshot_path(db_name, source), readonly=True)
+    if options is None:
+        # Snapshots taken before the lookup tables existed
+        options = count_dimension_values(db_data)
+    return options
+
+def option_label(counts):
+    """format_func for filter widgets: the option followed by its sample count"""
+    return lambda option: option if option == 'All' else f"{option} ({counts.get(option, 0)})"
+
+def select_filters(filter_options):
+    """Project and condition filter widgets; returns {column: [selected value] or None for all}"""
+    filters = {}
+    for column, (dimension, label) in zip(st.columns(2), [('project', "Project"), ('condition', "Condition")]):
+        with column:
+            counts = dict(filter_options[dimension].itertuples(index=False))
+            selected = st.selectbox(f"Filter by {label}:", ['All'] + list(counts), format_func=option_label(counts))
+        filters[dimension] = None if selected == 'All' else [selected]
+    return filters
+
+def id_picker(label, db_name, source, kind='sample', key=None):
+    """Type-ahead picker for a sample or subject ID, searched in the database
+
+    Only the top matches of the typed text reach the browser, so it works at
+    any dataset size. Returns the chosen ID, or None if nothing matches.
+    """
+    key = key or f"{kind}_picker"
+    query = st.text_input(f"Search {kind} IDs:", key=f"{key}_query",
+                          placeholder="Type the start of an ID (or any part of it)").strip()
+    if source == LIVE_DATABASE:
+        matches = backend.search_ids(db_name, kind, query)
+    else:
+        matches = search_snapshot_ids(snapshot_path(db_name, source), kind, query, readonly=True)
+    if not matches:
+        st.info(f"No {kind} IDs match '{query}'.")
+        return None
+    return st.selectbox(label, matches, key=key)
+
+def dataset_files(db_name, source):
+    """SQLite files holding the live database (every shard when sharded) or a snapshot"""
+    if source != LIVE_DATABASE:
+        return [snapshot_path(db_name, source)]
+    return list_shards(db_name) if SHARDED_LAYOUT else [db_name]
+
+def show_out_of_core_analysis(db_name, source):
+    """Stream and summarize the dataset if loading it would exceed the memory budget
+
+    Returns False, showing nothing, when the dataset fits and should be loaded.
+    """
+    files = dataset_files(db_name, source)
+    readonly = source != LIVE_DATABASE
+    if not exceeds_memory_budget(files, readonly=readonly):
+        return False
+    
+    st.info(f"💾 This dataset is larger than the {MEMORY_BUDGET_MB:,g} MB analysis memory budget "
+            "(ANALYSIS_MEMORY_BUDGET_MB), so it is summarized by streaming it from the database. "
+            "Per-sample tables and charts are not shown.")
+    status = st.empty()
+    with st.spinner("Streaming samples..."):
+        aggregates = aggregate_databases(files, readonly=readonly,
+                                         progress=lambda samples: status.caption(f"Read {samples:,} samples"))
+    status.empty()
+    display_out_of_core_analysis(aggregates, select_filters(aggregates.filter_options()))
+    return True
+
+def show_snapshot_controls(db_name):
+    """Sidebar controls to take snapshots and pick the dataset to view; returns a snapshot name or None"""
+    with st.sidebar:
+        st.header("🗂️ Snapshots")
+        if SHARDED_LAYOUT:
+            st.caption("Snapshots are only available for the single-file database layout.")
+            show_cache_stats()
+            return None
+        snapshot_name = st.text_input("Snapshot name (optional):", placeholder="e.g. week-12")
+        if st.button("📸 Take Snapshot", disabled=not backend.database_exists(db_name)):
+            try:
+                name = create_snapshot(db_name, snapshot_name)
+                st.success(f"✅ Snapshot {name} created.")
+            except (ValueError, OSError) as e:
+                st.error(str(e))
+        
+        snapshots = list_snapshots(db_name)
+        sources = [LIVE_DATABASE] + snapshots['name'].tolist()
+        view = st.selectbox("View data from:", sources)
+        
+        if len(sources) > 1:
+            st.subheader("🔀 Compare")
+            base = st.selectbox("Base:", sources, index=1, key="compare_base")
+            target = st.selectbox("Compare with:", sources, index=0, key="compare_target")
+            if st.button("Compare Datasets", disabled=base == target):
+                st.session_state.snapshot_comparison = (base, target)
+    
+        show_cache_stats()
+    
+    return None if view == LIVE_DATABASE else view
+
+def show_cache_stats():
+    """Sidebar summary of the shared analysis result and figure caches"""
+    for label, cache in (("Result cache", get_result_cache()), ("Figure cache", get_figure_cache())):
+        if cache is None:
+            continue
+        cache_stats = cache.stats()
+        st.caption(f"⚡ {label}: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+                   f"{cache_stats['entries']} entries ({cache_stats['size_mb']} / {cache_stats['budget_mb']} MB)")
+
+def show_requested_snapshot_comparison(db_name):
+    """Show the comparison requested from the sidebar, if any"""
+    comparison = st.session_state.get('snapshot_comparison')
+    if comparison is None:
+        return
+    base, target = comparison
+    with st.expander(f"🔀 Comparison: {base} → {target}", expanded=True):
+        display_snapshot_comparison(load_dataset(db_name, base), load_dataset(db_name, target), base, target)
+        if st.button("Close Comparison"):
+            del st.session_state.snapshot_comparison
+            st.rerun()
+
+def show_sample_management(db_name, viewing_snapshot):
+    """Remove and add individual samples (disabled while viewing a snapshot)"""
+    st.header("🔧 Sample Management")
+    st.markdown("*Add or remove individual samples as the study progresses*")
+    
+    tab1, tab2 = st.tabs(["Remove Sample", "Add Sample"])
+    
+    with tab1:
+        sample_to_remove = id_picker("Select Sample to Remove:", db_name,
+                                     viewing_snapshot or LIVE_DATABASE, key="remove_sample")
+    
+        if sample_to_remove is not None:
+            if st.button("Remove Sample", type="secondary", disabled=bool(viewing_snapshot)):
+                if backend.remove_sample(db_name, 'samples', sample_to_remove):
+                    st.success(f"✅ Sample {sample_to_remove} removed successfully!")
+                    st.rerun()
+                else:
+                    st.error("❌ Error removing sample.")
+    
+    with tab2:
+        st.write("**Add New Sample:**")
+    
+        with st.form("add_sample_form"):
+            col1, col2, col3 = st.columns(3)
+    
+            with col1:
+                new_sample = st.text_input("Sample ID*")
+                new_project = st.text_input("Project*")
+                new_subject = st.text_input("Subject ID*")
+                new_condition = st.text_input("Condition*")
+    
+            with col2:
+                new_age = st.number_input("Age", min_value=0, max_value=120, value=50)
+                new_sex = st.selectbox("Sex", ["M", "F"])
+                new_treatment = st.text_input("Treatment*")
+                new_response = st.selectbox("Response", ["y", "n", ""])
+    
+            with col3:
+                new_sample_type = st.text_input("Sample Type", value="PBMC")
+                new_time = st.number_input("Time from Treatment Start", min_value=0, value=0)
+                new_b_cell = st.number_input("B Cell Count", min_value=0, value=0)
+                new_cd8 = st.number_input("CD8 T Cell Count", min_value=0, value=0)
+    
+            col4, col5 = st.columns(2)
+            with col4:
+                new_cd4 = st.number_input("CD4 T Cell Count", min_value=0, value=0)
+                new_nk = st.number_input("NK Cell Count", min_value=0, value=0)
+            with col5:
+                new_monocyte = st.number_input("Monocyte Count", min_value=0, value=0)
+    
+            submitted = st.form_submit_button("Add Sample", type="primary", disabled=bool(viewing_snapshot))
+    
+            if submitted:
+                if new_sample and new_project and new_subject and new_condition and new_treatment:
+                    sample_data = {
+                        'sample': new_sample,
+                        'project': new_project,
+                        'subject': new_subject,
+                        'condition': new_condition,
+                        'age': new_age,
+                        'sex': new_sex,
+                        'treatment': new_treatment,
+                        'response': new_response,
+                        'sample_type': new_sample_type,
+                        'time_from_treatment_start': new_time,
+                        'b_cell': new_b_cell,
+                        'cd8_t_cell': new_cd8,
+                        'cd4_t_cell': new_cd4,
+                        'nk_cell': new_nk,
+                        'monocyte': new_monocyte
+                    }
+    
+                    if backend.add_sample(db_name, sample_data):
+                        st.success(f"✅ Sample {new_sample} added successfully!")
+                        st.rerun()
+                    else:
+                        st.error("❌ Error adding sample. Check if sample ID already exists.")
+                else:
+                    st.error("Please fill in all required fields (marked with *).")
+
 def main():
     st.title("CSV Database App")
     st.markdown("### Clinical Trial Data Management System")
@@ -20,45 +329,70 @@ def main():
     DB_NAME = 'samples.db'
 
     # Initialize database on startup
-    if not os.path.exists(DB_NAME):
-        initialize_db(DB_NAME, 'src/schema.sql')
+    if not backend.database_exists(DB_NAME):
+        backend.initialize_db(DB_NAME, 'src/schema.sql')
         st.session_state.database_cleared = True  # Mark as cleared state
 
+    # Snapshots: viewing one makes the whole page read-only
+    viewing_snapshot = show_snapshot_controls(DB_NAME)
+    if viewing_snapshot:
+        st.info(f"🗂️ Viewing snapshot **{viewing_snapshot}** (read-only). Switch to 'Live database' in the sidebar to make changes.")
+
     # File upload section
     st.header("📁 Data Loading")
-    uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
+    uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"], disabled=bool(viewing_snapshot))
     
-    if uploaded_file is not None:
+    # An upload identical to the file the data was last loaded from is recognized by its hash, unparsed
+    upload_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest() if uploaded_file is not None else None
+    if upload_hash is not None and upload_hash == backend.get_loaded_hash(DB_NAME):
+        st.info("✅ This file is identical to the data already loaded, so there is nothing to load.")
+    elif uploaded_file is not None:
         # Read the CSV file
         data = pd.read_csv(uploaded_file)
         st.write("**Data Preview:**")
         st.dataframe(data.head())
         st.write(f"Total rows: {len(data)}")
         
-        # Load data button
-        if st.button("Load Data into Database", type="primary"):
-            with st.spinner('Loading data into database...'):
-                if process_and_load_data(DB_NAME, data):
-                    st.session_state.data_loaded = True
-                    st.session_state.database_cleared = False  # Data is loaded
-                    st.success("✅ Data loaded successfully!")
-                    st.rerun()
-                else:
-                    st.error("❌ Error loading data into database.")
+        # Validate before anything touches the database
+        validation_errors, _ = validate_chunks([data])
+        if validation_errors:
+            st.error("❌ The uploaded file failed validation. Fix the rows below and upload again.")
+            st.dataframe(summarize_validation_errors(validation_errors), use_container_width=True, hide_index=True)
+            with st.expander("Show offending rows"):
+                offending = np.unique(np.concatenate(list(validation_errors.values())))
+                st.dataframe(data.loc[data.index.intersection(offending)], use_container_width=True)
+        
+        # Load data button - the load runs in the background so the app stays usable
+        if st.button("Load Data into Database", type="primary", disabled=bool(validation_errors)):
+            try:
+                start_ingest_job(DB_NAME, data, backend.process_and_load_data, upload_hash)
+            except RuntimeError as e:
+                st.warning(str(e))
+    
+    # Progress of a running (or just finished) background load
+    ingest_job = get_ingest_job(DB_NAME)
+    if ingest_job is not None and st.session_state.get('acknowledged_ingest_job') != ingest_job.job_id:
+        show_ingest_progress(DB_NAME)
+    
+    ingest_notice = st.session_state.pop('ingest_notice', None)
+    if ingest_notice is not None:
+        kind, message = ingest_notice
+        getattr(st, kind)(message)
     
     # Data clearing section with improved logic
     st.write("**Database Management:**")
     col1, col2 = st.columns(2)
     
     with col1:
-        if st.button("🗑️ Clear Database", type="secondary"):
+        if st.button("🗑️ Clear Database", type="secondary",
+                     disabled=bool(viewing_snapshot) or (ingest_job is not None and not ingest_job.finished)):
             st.session_state.show_confirm = True
     
     with col2:
         if st.session_state.get('show_confirm', False):
             if st.button("⚠️ CONFIRM DELETE ALL DATA", type="secondary"):
-                if os.path.exists(DB_NAME):
-                    os.remove(DB_NAME)
+                # Rows are deleted in one transaction; the file stays for other sessions' readers
+                if backend.clear_database(DB_NAME):
                     # Reset all session state related to data
                     st.session_state.data_loaded = False
                     st.session_state.database_cleared = True
@@ -67,12 +401,16 @@ def main():
                     st.rerun()
                 else:
                     st.session_state.show_confirm = False
-                    st.info("No database file found to clear.")
-                    st.rerun()
+                    st.error("❌ Error clearing database.")
 
     # Data viewing section - only show if database has data
     try:
-        db_data = load_data(DB_NAME)
+        # Datasets too large for memory are analyzed by streaming them instead of loading them
+        if show_out_of_core_analysis(DB_NAME, viewing_snapshot or LIVE_DATABASE):
+            show_sample_management(DB_NAME, viewing_snapshot)
+            return
+        
+        db_data = load_dataset(DB_NAME, viewing_snapshot or LIVE_DATABASE)
         
         # Check if database is actually empty or cleared
         if db_data.empty or st.session_state.get('database_cleared', False):
@@ -80,7 +418,7 @@ def main():
             st.info("📭 No data in database. Upload a CSV file and click 'Load Data' to get started.")
             
             # Show some helpful info
-            if os.path.exists(DB_NAME):
+            if backend.database_exists(DB_NAME):
                 st.write("💡 Database file exists but contains no data. Upload and load a CSV file to begin analysis.")
             else:
                 st.write("💡 No database file found. Upload a CSV file to create and populate the database.")
@@ -92,23 +430,17 @@ def main():
         st.header("📊 Database Contents")
         st.success(f"Found {len(db_data)} samples in database")
         
-        # Display data with filters
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            projects = ['All'] + sorted(db_data['project'].unique().tolist())
-            selected_project = st.selectbox("Filter by Project:", projects)
+        show_requested_snapshot_comparison(DB_NAME)
         
-        with col2:
-            conditions = ['All'] + sorted(db_data['condition'].unique().tolist())
-            selected_condition = st.selectbox("Filter by Condition:", conditions)
+        # Display data with filters
+        filter_options = load_filter_options(DB_NAME, viewing_snapshot or LIVE_DATABASE, db_data)
+        filters = select_filters(filter_options)
         
-        # Apply filters
-        filtered_data = db_data.copy()
-        if selected_project != 'All':
-            filtered_data = filtered_data[filtered_data['project'] == selected_project]
-        if selected_condition != 'All':
-            filtered_data = filtered_data[filtered_data['condition'] == selected_condition]
+        # Apply filters: the analyses below get the shared dataset plus the selected row positions
+        filter_rows = None
+        if any(values is not None for values in filters.values()):
+            filter_rows = get_bitmap_index(db_data).rows(filters)
+        filtered_data = select_rows(db_data, filter_rows)
         
         st.dataframe(filtered_data, use_container_width=True)
         
@@ -117,11 +449,12 @@ def main():
         st.markdown("*Addressing specific research questions in order of priority*")
         
         # Analysis tabs with numbered Bob's requests
-        analysis_tab1, analysis_tab2, analysis_tab3, analysis_tab4 = st.tabs([
+        analysis_tab1, analysis_tab2, analysis_tab3, analysis_tab4, analysis_tab5 = st.tabs([
             "❶ Cell Type Frequencies", 
             "❷ Treatment Response Prediction", 
             "❸ Baseline Treatment Effects",
-            "❹ Custom Data Exploration"
+            "❹ Custom Data Exploration",
+            "❺ Longitudinal Changes"
         ])
         
         with analysis_tab1:
@@ -137,16 +470,22 @@ def main():
             - Create table with columns: sample, total_count, population, count, percentage
             """)
             
-            display_frequency_analysis(filtered_data)
+            # Statistics tables are aggregated inside the database; only the summary rows come back
+            running = load_summaries(DB_NAME, viewing_snapshot or LIVE_DATABASE, filters)
+            
+            display_frequency_analysis(db_data, running['all'] if running else None, rows=filter_rows)
             
             # Additional comparison analyses
             if len(db_data['treatment'].unique()) > 1:
                 st.markdown("### 📈 Additional Treatment Comparisons")
-                compare_treatments(filtered_data)
+                compare_treatments(db_data, running['treatment'] if running else None, rows=filter_rows)
             
             if len(db_data['condition'].unique()) > 1:
                 st.markdown("### 📈 Additional Condition Comparisons")
-                compare_conditions(filtered_data)
+                compare_conditions(db_data, running['condition'] if running else None, rows=filter_rows)
+            
+            st.markdown("### 📈 Compare Any Grouping")
+            display_custom_group_comparison(db_data, rows=filter_rows)
         
         with analysis_tab2:
             st.markdown("## 🎯 Bob's Request #2: Treatment Response Prediction")
@@ -165,6 +504,12 @@ def main():
             """)
             
             analyze_treatment_response_prediction(db_data)
+
+            with st.expander("🧭 Scan every condition × treatment × sample type cohort"):
+                display_response_biomarker_scan(db_data)
+
+            with st.expander("🤖 Predict response from the full frequency profile"):
+                display_response_classifier(db_data)
         
         with analysis_tab3:
             st.markdown("## 🔬 Bob's Request #3: Baseline Treatment Effects Analysis")
@@ -180,8 +525,27 @@ def main():
             - Count responders vs non-responders by subject
             - Analyze male vs female distribution
             """)
-            
-            analyze_baseline_subset(db_data)
+
+            # Cohort definition (defaults reproduce Bob's melanoma/PBMC/tr1/day-0 question)
+            cohort_cols = st.columns(4)
+            cohort_options = {
+                'condition': ('Condition', 'melanoma'),
+                'sample_type': ('Sample Type', 'PBMC'),
+                'treatment': ('Treatment', 'tr1'),
+                'time_from_treatment_start': ('Time Point', 0)
+            }
+            cohort = {}
+            for col, (column, (label, default)) in zip(cohort_cols, cohort_options.items()):
+                options = sorted(db_data[column].dropna().unique().tolist())
+                with col:
+                    cohort[column] = st.selectbox(
+                        f"{label}:", options,
+                        index=options.index(default) if default in options else 0,
+                        key=f"cohort_{column}"
+                    )
+
+            analyze_baseline_subset(db_data, cohort['condition'], cohort['sample_type'],
+                                    cohort['treatment'], cohort['time_from_treatment_start'])
         
         with analysis_tab4:
             st.markdown("## 🔧 Bob's Request #4: Flexible Data Exploration")
@@ -197,90 +561,25 @@ def main():
             - Downloadable results for collaboration
             """)
             
-            create_custom_filter_interface(db_data)
-        
-        # Sample management section
-        st.header("🔧 Sample Management")
-        st.markdown("*Add or remove individual samples as the study progresses*")
-        
-        tab1, tab2 = st.tabs(["Remove Sample", "Add Sample"])
+            create_custom_filter_interface(db_data, filter_options)
         
-        with tab1:
-            if not filtered_data.empty:
-                sample_to_remove = st.selectbox(
-                    "Select Sample to Remove:", 
-                    options=filtered_data['sample'].tolist()
-                )
-                
-                if st.button("Remove Sample", type="secondary"):
-                    if remove_sample(DB_NAME, 'samples', sample_to_remove):
-                        st.success(f"✅ Sample {sample_to_remove} removed successfully!")
-                        st.rerun()
-                    else:
-                        st.error("❌ Error removing sample.")
-            else:
-                st.info("No samples available for removal with current filters.")
-        
-        with tab2:
-            st.write("**Add New Sample:**")
+        with analysis_tab5:
+            st.markdown("## ⏱️ Longitudinal Change from Baseline")
+            st.markdown("""
+            **Research Question:** *"How do cell populations move per subject over the course of treatment?"*
             
-            with st.form("add_sample_form"):
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    new_sample = st.text_input("Sample ID*")
-                    new_project = st.text_input("Project*")
-                    new_subject = st.text_input("Subject ID*")
-                    new_condition = st.text_input("Condition*")
-                
-                with col2:
-                    new_age = st.number_input("Age", min_value=0, max_value=120, value=50)
-                    new_sex = st.selectbox("Sex", ["M", "F"])
-                    new_treatment = st.text_input("Treatment*")
-                    new_response = st.selectbox("Response", ["y", "n", ""])
-                
-                with col3:
-                    new_sample_type = st.text_input("Sample Type", value="PBMC")
-                    new_time = st.number_input("Time from Treatment Start", min_value=0, value=0)
-                    new_b_cell = st.number_input("B Cell Count", min_value=0, value=0)
-                    new_cd8 = st.number_input("CD8 T Cell Count", min_value=0, value=0)
-                
-                col4, col5 = st.columns(2)
-                with col4:
-                    new_cd4 = st.number_input("CD4 T Cell Count", min_value=0, value=0)
-                    new_nk = st.number_input("NK Cell Count", min_value=0, value=0)
-                with col5:
-                    new_monocyte = st.number_input("Monocyte Count", min_value=0, value=0)
-                
-                submitted = st.form_submit_button("Add Sample", type="primary")
-                
-                if submitted:
-                    if new_sample and new_project and new_subject and new_condition and new_treatment:
-                        sample_data = {
-                            'sample': new_sample,
-                            'project': new_project,
-                            'subject': new_subject,
-                            'condition': new_condition,
-                            'age': new_age,
-                            'sex': new_sex,
-                            'treatment': new_treatment,
-                            'response': new_response,
-                            'sample_type': new_sample_type,
-                            'time_from_treatment_start': new_time,
-                            'b_cell': new_b_cell,
-                            'cd8_t_cell': new_cd8,
-                            'cd4_t_cell': new_cd4,
-                            'nk_cell': new_nk,
-                            'monocyte': new_monocyte
-                        }
-                        
-                        if add_sample(DB_NAME, sample_data):
-                            st.success(f"✅ Sample {new_sample} added successfully!")
-                            st.rerun()
-                        else:
-                            st.error("❌ Error adding sample. Check if sample ID already exists.")
-                    else:
-                        st.error("Please fill in all required fields (marked with *).")
+            **Objective:** Align every follow-up sample to the same subject's day-0 sample and track changes over time.
+            
+            **Features:**
+            - Absolute change (percentage points) and log2 fold change per population
+            - Responder vs non-responder trajectory summaries by time point
+            - Downloadable per-sample changes
+            """)
+            
+            display_longitudinal_analysis(db_data)
+        
+        # Sample management section
+        show_sample_management(DB_NAME, viewing_snapshot)
         
     except Exception as e:
         st.error(f"Error accessing database: {str(e)}")
@@ -0,0 +1,44 @@
+import importlib
+import os
+
+# Storage backends are modules exposing the same functions as db.py, so callers
+# work unchanged whichever one is configured with SAMPLES_DB_BACKEND.
+BACKENDS = {
+    'sqlite': 'db',
+    'sharded': 'shards',
+    'duckdb': 'duckdb_backend'
+}
+DEFAULT_BACKEND = 'sqlite'
+
+BACKEND_FUNCTIONS = (
+    'database_exists',
+    'initialize_db',
+    'get_dataset_version',
+    'load_data',
+    'process_and_load_data',
+    'append_data',
+    'get_loaded_hash',
+    'add_sample',
+    'remove_sample',
+    'clear_database',
+    'get_running_summary',
+    'get_filter_options',
+    'get_percentage_summary',
+    'search_ids'
+)
+
+
+def get_backend(name=None):
+    """Backend module for name (default: the SAMPLES_DB_BACKEND environment variable, else sqlite)
+
+    Raises ValueError for an unknown backend.
+    """
+    name = (name or os.environ.get('SAMPLES_DB_BACKEND') or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+
+    backend = importlib.import_module(BACKENDS[name])
+    missing = [function for function in BACKEND_FUNCTIONS if not hasattr(backend, function)]
+    if missing:
+        raise TypeError(f"Backend '{name}' does not implement: {', '.join(missing)}")
+    return backend
@@ -0,0 +1,190 @@
+"""Bulk ingest: add a directory (or globs) of CSV files to the database
+
+Run from the repository root:
+
+    python src/bulk_ingest.py deliveries/week-12/            # every *.csv in the directory
+    python src/bulk_ingest.py 'deliveries/*/MELANO_*.csv'    # or any mix of globs and files
+    python src/bulk_ingest.py deliveries/ --validate-only    # check the files, write nothing
+
+Files are parsed and validated in parallel worker processes, checked against
+each other and the samples already stored (a sample ID may only appear once;
+a subject keeps one age, sex and condition), then appended one file at a
+time, in order, through the database's writer. Each file is one transaction,
+so a rejected or failed file leaves the database unchanged and the others
+still load. Unlike the app's upload, nothing already stored is replaced.
+Rows identical to a stored sample (same row hash) are skipped, so re-running
+over a directory only writes what is new.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import db
+from backends import get_backend
+from jobs import PARSE_CHUNK_SIZE
+from shards import list_shards
+from utils import SUBJECT_COLUMNS, find_validation_errors, summarize_validation_errors, validate_chunks
+
+DEFAULT_DB = 'samples.db'
+
+
+def find_csv_files(paths):
+    """CSV files named by paths (files, directories or glob patterns), in order and without repeats"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, '*.csv')))
+        else:
+            matches = sorted(glob.glob(path))
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def parse_file(path):
+    """Read and validate one CSV (runs in a worker process)
+
+    Returns a dict with the parsed rows ('data', None if the file could not
+    be read), 'rows', the validation 'errors' ({rule: row indices}), a read
+    'error' message, if any, and 'parse_seconds'.
+    """
+    started = time.perf_counter()
+    result = {'path': path, 'data': None, 'rows': 0, 'errors': {}, 'error': None}
+    try:
+        chunks = list(pd.read_csv(path, chunksize=PARSE_CHUNK_SIZE))
+    except (OSError, ValueError) as e:
+        result['error'] = str(e)
+    else:
+        result['errors'], result['rows'] = validate_chunks(chunks)
+        if not chunks or result['rows'] == 0:
+            result['error'] = "The file is empty."
+        else:
+            result['data'] = pd.concat(chunks, ignore_index=True)
+    result['parse_seconds'] = time.perf_counter() - started
+    return result
+
+
+def _database_files(db_name, backend):
+    return list_shards(db_name) if backend.__name__ == 'shards' else [db_name]
+
+
+def stored_identities(db_files):
+    """Sample IDs and subject attributes already in the databases (all shards when sharded)
+
+    Returns ({sample ID: row hash, None if unknown}, DataFrame of SUBJECT_COLUMNS
+    indexed by subject).
+    """
+    samples = {}
+    subjects = [pd.DataFrame(columns=['subject'] + SUBJECT_COLUMNS)]
+    for path in db_files:
+        if not os.path.exists(path):
+            continue
+        conn = db.connect(path)
+        try:
+            samples.update(conn.execute("""SELECT s.sample, h.row_hash FROM samples s
+                                           LEFT JOIN sample_hashes h ON h.sample = s.sample"""))
+            subjects.append(pd.read_sql_query("SELECT subject, age, sex, condition FROM subjects", conn))
+        except sqlite3.OperationalError:
+            pass  # a database without tables yet holds no identities
+        finally:
+            conn.close()
+    subjects = pd.concat(subjects, ignore_index=True).drop_duplicates('subject')
+    return samples, subjects.set_index('subject')[SUBJECT_COLUMNS]
+
+
+def _describe_errors(errors):
+    return '; '.join(f"{rule} ({len(rows)} rows)" for rule, rows in errors.items())
+
+
+def ingest_files(db_name, files, backend=None, max_workers=None, validate_only=False):
+    """Parse files in parallel and append the valid ones to db_name in order
+
+    Returns one summary row per file: status ('loaded', 'valid' with
+    validate_only, 'unchanged' when every row is already stored, 'invalid'
+    or 'failed'), rows, rows written, parse and write seconds, rows per
+    second and the errors found.
+    """
+    backend = backend or get_backend()
+    seen_samples, seen_subjects = stored_identities(_database_files(db_name, backend))
+    summary = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Results arrive in file order while later files are still being parsed
+        for parsed in executor.map(parse_file, files):
+            data, errors = parsed['data'], parsed['errors']
+            row = {'file': parsed['path'], 'rows': parsed['rows'], 'written': 0, 'status': 'invalid',
+                   'parse_s': parsed['parse_seconds'], 'write_s': 0.0, 'errors': parsed['error'] or ''}
+
+            if data is not None and not errors:
+                # Rows already stored with the same content are dropped
+                hashes = db.row_hashes(data).tolist()
+                stored = np.fromiter((seen_samples.get(sample) == row_hash
+                                      for sample, row_hash in zip(data['sample'].tolist(), hashes)),
+                                     dtype=bool, count=len(data))
+                data = data[~stored]
+                if data.empty:
+                    row['status'] = 'unchanged'
+                    data = None
+            if data is not None and not errors:
+                # Identities are resolved across files here, in order: earlier files win
+                errors = find_validation_errors(data, seen_samples, seen_subjects)
+            if errors:
+                row['errors'] = _describe_errors(errors)
+                print(f"{parsed['path']}: rejected")
+                print(summarize_validation_errors(errors).to_string(index=False))
+            elif data is not None:
+                if validate_only:
+                    row['status'] = 'valid'
+                else:
+                    started = time.perf_counter()
+                    row['written'] = backend.append_data(db_name, data)
+                    row['write_s'] = time.perf_counter() - started
+                    row['status'] = 'loaded' if row['written'] else 'failed'
+                if row['status'] != 'failed':
+                    seen_samples.update(zip(data['sample'].tolist(), db.row_hashes(data).tolist()))
+                    first_seen = data.drop_duplicates('subject').set_index('subject')[SUBJECT_COLUMNS]
+                    seen_subjects = pd.concat([seen_subjects, first_seen[~first_seen.index.isin(seen_subjects.index)]])
+
+            elapsed = row['parse_s'] + row['write_s']
+            row['rows_per_s'] = row['rows'] / elapsed if elapsed > 0 else 0.0
+            summary.append(row)
+
+    return pd.DataFrame(summary, columns=['file', 'status', 'rows', 'written', 'parse_s', 'write_s', 'rows_per_s',
+                                          'errors'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help="CSV files, directories of CSV files or glob patterns")
+    parser.add_argument('--db', default=DEFAULT_DB, help=f"database to add to (default: {DEFAULT_DB})")
+    parser.add_argument('--workers', type=int, help="parser processes (default: one per CPU)")
+    parser.add_argument('--validate-only', action='store_true', help="check every file without writing")
+    args = parser.parse_args()
+
+    files = find_csv_files(args.paths)
+    if not files:
+        print("No CSV files found")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    summary = ingest_files(args.db, files, max_workers=args.workers, validate_only=args.validate_only)
+    elapsed = time.perf_counter() - started
+
+    print(summary.round(2).to_string(index=False))
+    accepted = summary['status'].isin(['loaded', 'valid', 'unchanged'])
+    rows = int(summary.loc[accepted, 'rows'].sum())
+    print(f"{accepted.sum()} of {len(summary)} files {'valid' if args.validate_only else 'loaded'}: "
+          f"{rows:,} samples ({summary['written'].sum():,} written) in {elapsed:.1f}s "
+          f"({rows / elapsed:,.0f} samples/s)")
+    if not accepted.all():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
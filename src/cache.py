@@ -0,0 +1,343 @@
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# On-disk cache shared by every session and process using the same directory.
+# Set ANALYSIS_CACHE_DIR to relocate it or ANALYSIS_CACHE_MB=0 to disable it.
+CACHE_DIR = os.environ.get('ANALYSIS_CACHE_DIR', '.analysis_cache')
+CACHE_SIZE_BUDGET_MB = float(os.environ.get('ANALYSIS_CACHE_MB', 512))
+CACHE_SUFFIX = '.pkl'
+# Part of every analysis key: bump it when cached results change without a
+# change to the modules below (e.g. a new pickled type)
+CACHE_SCHEMA_VERSION = 2
+# Modules whose code the cached analyses run; editing any of them invalidates
+# every cached result, not only those of the edited function
+ANALYSIS_MODULES = ('analysis', 'utils', 'classifier', 'filter_index')
+
+# In-memory cache of built Plotly figures, shared by every session in this
+# process. Set FIGURE_CACHE_MB=0 to disable it.
+FIGURE_CACHE_MB = float(os.environ.get('FIGURE_CACHE_MB', 256))
+# Trace properties that hold the per-point data, and the size counted per
+# element of an object (e.g. string) array, whose nbytes only counts pointers
+FIGURE_DATA_PROPERTIES = ('x', 'y', 'z', 'customdata', 'text', 'hovertext', 'ids')
+OBJECT_ITEM_BYTES = 64
+
+
+def fingerprint_frame(frame):
+    """Identify a DataFrame's contents without serializing it
+
+    Frames loaded by db.load_data carry a dataset version token; for those the
+    version plus a hash of the selected sample IDs identifies the filtered
+    view. Anything else is hashed in full.
+    """
+    version = frame.attrs.get('dataset_version')
+    if version is not None and 'sample' in frame.columns:
+        # Joining the IDs hashes several times faster than pd.util.hash_pandas_object
+        rows = '\0'.join(frame['sample'].astype(str).tolist())
+        return {'dataset_version': version, 'columns': list(frame.columns),
+                'rows': hashlib.sha256(rows.encode()).hexdigest()}
+    content = pd.util.hash_pandas_object(frame, index=True).to_numpy()
+    return {'columns': [str(column) for column in frame.columns],
+            'content': hashlib.sha256(content.tobytes()).hexdigest()}
+
+
+def normalize_param(value):
+    """Canonical JSON-friendly form of a parameter, so equivalent filters share a key"""
+    if isinstance(value, pd.DataFrame):
+        return fingerprint_frame(value)
+    if isinstance(value, pd.Series):
+        return fingerprint_frame(value.to_frame())
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {str(key): normalize_param(item) for key, item in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (set, frozenset)):
+        return sorted((normalize_param(item) for item in value), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [normalize_param(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+class ResultCache:
+    """Content-addressed on-disk cache of analysis results with LRU eviction
+
+    Entries are pickled into one file per key; a file's modification time is
+    its last use, so the least recently used entries are evicted first once
+    the directory exceeds max_bytes. Writes go through a temp file and rename,
+    so concurrent processes never read a partial entry.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_SIZE_BUDGET_MB * 1e6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(function_name, params):
+        payload = json.dumps({'function': function_name, 'params': normalize_param(params)},
+                             sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{CACHE_SUFFIX}")
+
+    def get(self, key):
+        """Return (True, value) on a hit, (False, None) on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False, None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError, TypeError):
+            # Unreadable, or pickled by other code (a class since renamed or removed)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.misses += 1
+            return False, None
+        with self._lock:
+            self.hits += 1
+        return True, value
+
+    def put(self, key, value):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its size budget"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'size_mb': round(sum(size for _, size, _ in entries) / 1e6, 2),
+            'budget_mb': round(self.max_bytes / 1e6, 2)
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide ResultCache, or None when caching is disabled (ANALYSIS_CACHE_MB=0)"""
+    global _result_cache
+    if CACHE_SIZE_BUDGET_MB <= 0:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(modules):
+    """Hash of CACHE_SCHEMA_VERSION, the library versions and the source files of modules"""
+    digest = hashlib.sha256(f"{CACHE_SCHEMA_VERSION}:{pd.__version__}:{np.__version__}".encode())
+    for name in modules:
+        try:
+            with open(importlib.util.find_spec(name).origin, 'rb') as f:
+                digest.update(f.read())
+        except (ImportError, ValueError, AttributeError, TypeError, OSError):
+            digest.update(name.encode())  # no source file to hash (e.g. __main__)
+    return digest.hexdigest()[:16]
+
+
+def cached_analysis(function):
+    """Cache a pure analysis function's result by (dataset version, function, parameters)
+
+    The key includes code_version of the function's module and
+    ANALYSIS_MODULES, so editing the function or any helper it calls there
+    invalidates old entries, including those on disk from earlier runs.
+    """
+    signature = inspect.signature(function)
+    modules = tuple(dict.fromkeys((function.__module__,) + ANALYSIS_MODULES))
+    function_name = f"{function.__module__}.{function.__qualname__}:{code_version(modules)}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        cache = get_result_cache()
+        if cache is None:
+            return function(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache.make_key(function_name, dict(bound.arguments))
+        hit, value = cache.get(key)
+        if hit:
+            return value
+
+        value = function(*args, **kwargs)
+        cache.put(key, value)
+        return value
+
+    return wrapper
+
+
+def estimate_figure_bytes(figure):
+    """Approximate memory held by a figure (or a dict or list of figures): its traces' data arrays"""
+    if isinstance(figure, dict):
+        return sum(estimate_figure_bytes(item) for item in figure.values())
+    if isinstance(figure, (list, tuple)):
+        return sum(estimate_figure_bytes(item) for item in figure)
+    total = 0
+    for trace in getattr(figure, 'data', ()):
+        for name in FIGURE_DATA_PROPERTIES:
+            try:
+                values = trace[name]
+            except (KeyError, ValueError):
+                continue  # trace type without this property
+            if values is None:
+                continue
+            values = np.asarray(values)
+            total += values.size * OBJECT_ITEM_BYTES if values.dtype == object else values.nbytes
+    return total
+
+
+class FigureCache:
+    """In-memory LRU cache of built figures, bounded by their estimated size
+
+    Entries are kept in use order; once the estimated total exceeds max_bytes
+    the least recently used are dropped. A figure larger than the whole budget
+    is not cached.
+    """
+
+    def __init__(self, max_bytes=FIGURE_CACHE_MB * 1e6):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, value) on a hit, (False, None) on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, key, value):
+        size = estimate_figure_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size_mb': round(self._size / 1e6, 2),
+                'budget_mb': round(self.max_bytes / 1e6, 2)
+            }
+
+
+_figure_cache = None
+_figure_cache_lock = threading.Lock()
+
+
+def get_figure_cache():
+    """Process-wide FigureCache, or None when figure caching is disabled (FIGURE_CACHE_MB=0)"""
+    global _figure_cache
+    if FIGURE_CACHE_MB <= 0:
+        return None
+    with _figure_cache_lock:
+        if _figure_cache is None:
+            _figure_cache = FigureCache()
+        return _figure_cache
+
+
+def cached_figure(kind, data, rows, build, **params):
+    """Figure of the given kind drawn from data (the rows selected by rows), built once per key
+
+    The key is the data's fingerprint (dataset version and sample IDs for
+    loaded frames), the row selection, kind and params, so reruns that keep
+    the data, filters and chart options reuse the figure instead of calling
+    build(). Cached figures are shared: callers must not modify them.
+    """
+    cache = get_figure_cache()
+    if cache is None:
+        return build()
+    key = ResultCache.make_key(f"figure:{kind}", {'data': data, 'rows': rows, **params})
+    hit, figure = cache.get(key)
+    if not hit:
+        figure = build()
+        cache.put(key, figure)
+    return figure
@@ -0,0 +1,189 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Below this many (samples x repeats) the process pool costs more than it saves
+PARALLEL_MIN_WORK = 20000
+
+
+def clr_transform(percentages, pseudocount=0.1):
+    """Centered log-ratio transform of compositional rows (sample x population)
+
+    Frequencies of one sample sum to 100%, so they are not independent
+    features; the log-ratio to each sample's geometric mean removes that
+    constraint. The pseudocount avoids log(0) for absent populations.
+    """
+    logs = np.log(np.asarray(percentages, dtype=float) + pseudocount)
+    return logs - logs.mean(axis=1, keepdims=True)
+
+
+def fit_logistic_regression(features, labels, l2=1.0, max_iter=50, tol=1e-8):
+    """L2-regularized logistic regression fitted by Newton's method
+
+    Features are standardized with the training mean and scale, which the
+    returned model keeps so predict_scores applies the same transform. The
+    intercept is not penalized.
+    """
+    features = np.asarray(features, dtype=float)
+    labels = np.asarray(labels, dtype=float)
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0)
+    scale[scale == 0] = 1.0
+    design = np.column_stack([np.ones(len(features)), (features - mean) / scale])
+
+    penalty = np.full(design.shape[1], float(l2))
+    penalty[0] = 0.0
+    weights = np.zeros(design.shape[1])
+    for _ in range(max_iter):
+        probabilities = 1 / (1 + np.exp(-design @ weights))
+        gradient = design.T @ (probabilities - labels) + penalty * weights
+        hessian = (design.T * (probabilities * (1 - probabilities))) @ design + np.diag(penalty)
+        # A tiny ridge keeps the system solvable when a class is perfectly separated
+        step = np.linalg.solve(hessian + 1e-9 * np.eye(len(weights)), gradient)
+        weights -= step
+        if np.abs(step).max() < tol:
+            break
+
+    return {'intercept': weights[0], 'coefficients': weights[1:], 'mean': mean, 'scale': scale}
+
+
+def predict_scores(model, features):
+    """Predicted probability of the positive class"""
+    standardized = (np.asarray(features, dtype=float) - model['mean']) / model['scale']
+    return 1 / (1 + np.exp(-(model['intercept'] + standardized @ model['coefficients'])))
+
+
+def roc_auc(labels, scores):
+    """Area under the ROC curve via the Mann-Whitney rank statistic
+
+    labels and scores may be 2-D (one replicate per row, e.g. repeated
+    cross-validation) to score every replicate at once. Replicates with a
+    single class get NaN.
+    """
+    from scipy.stats import rankdata
+    labels = np.asarray(labels, dtype=bool)
+    ranks = rankdata(scores, axis=-1)
+    n_positive = labels.sum(axis=-1)
+    n_negative = labels.shape[-1] - n_positive
+    rank_sum = np.where(labels, ranks, 0).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc = (rank_sum - n_positive * (n_positive + 1) / 2) / (n_positive * n_negative)
+    return np.where((n_positive > 0) & (n_negative > 0), auc, np.nan)
+
+
+def bootstrap_auc(labels, scores, n_bootstrap=1000, rng=None, batch_size=100):
+    """AUCs of bootstrap resamples without re-ranking each resample
+
+    A resample is a vector of draw counts per row, drawn as Poisson(1) (the
+    usual large-sample stand-in for multinomial resampling, and far cheaper
+    to generate). Scores are ranked once; per resample, weighted class counts
+    at each distinct score and a cumulative sum give the number of
+    (positive, negative) pairs ordered correctly, with ties counted as half.
+    """
+    labels = np.asarray(labels, dtype=bool)
+    rng = np.random.default_rng() if rng is None else rng
+    values, inverse = np.unique(scores, return_inverse=True)
+    n, n_values = len(labels), len(values)
+    aucs = []
+    for start in range(0, n_bootstrap, batch_size):
+        size = min(batch_size, n_bootstrap - start)
+        weights = rng.poisson(1.0, size=(size, n))
+        bins = np.arange(size)[:, None] * n_values + inverse
+
+        def class_counts(mask):
+            return np.bincount(bins[:, mask].ravel(), weights=weights[:, mask].ravel(),
+                               minlength=size * n_values).reshape(size, n_values)
+
+        positive, negative = class_counts(labels), class_counts(~labels)
+        negative_below = np.cumsum(negative, axis=1) - negative
+        correct = (positive * (negative_below + 0.5 * negative)).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aucs.append(correct / (positive.sum(axis=1) * negative.sum(axis=1)))
+    return np.concatenate(aucs)
+
+
+def roc_curve(labels, scores):
+    """False and true positive rates at every score threshold"""
+    labels = np.asarray(labels, dtype=bool)
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    true_positives = np.concatenate([[0], np.cumsum(labels[order])])
+    false_positives = np.concatenate([[0], np.cumsum(~labels[order])])
+    return false_positives / max(false_positives[-1], 1), true_positives / max(true_positives[-1], 1)
+
+
+def stratified_group_folds(labels, groups, n_splits, rng):
+    """Assign a fold to every row, keeping all rows of a group (subject) together
+
+    Groups are shuffled and dealt round-robin within each class (taken from
+    the group's first row), so each fold has a similar class balance and no
+    subject appears in both training and test data.
+    """
+    unique_groups, first_row, group_index = np.unique(groups, return_index=True, return_inverse=True)
+    group_labels = np.asarray(labels, dtype=bool)[first_row]
+    group_folds = np.empty(len(unique_groups), dtype=int)
+    for label in (True, False):
+        members = rng.permutation(np.flatnonzero(group_labels == label))
+        group_folds[members] = np.arange(len(members)) % n_splits
+    return group_folds[group_index]
+
+
+def _cross_validated_scores(features, labels, groups, n_splits, l2, seed):
+    """Out-of-fold predicted probabilities for one repeat of k-fold cross-validation"""
+    folds = stratified_group_folds(labels, groups, n_splits, np.random.default_rng(seed))
+    scores = np.full(len(labels), np.nan)
+    for fold in range(n_splits):
+        test = folds == fold
+        train_labels = labels[~test]
+        if not test.any() or train_labels.all() or not train_labels.any():
+            continue
+        model = fit_logistic_regression(features[~test], train_labels, l2)
+        scores[test] = predict_scores(model, features[test])
+    return scores
+
+
+def _run_repeat(task):
+    return _cross_validated_scores(*task)
+
+
+def cross_validate(features, labels, groups=None, n_splits=5, n_repeats=10, l2=1.0,
+                   seed=0, n_bootstrap=1000, max_workers=None):
+    """Repeated stratified k-fold cross-validation of the logistic classifier
+
+    Repeats run in parallel across a process pool when the problem is large
+    enough to repay the worker start-up. Returns the mean out-of-fold AUC, a
+    95% bootstrap confidence interval on the repeat-averaged scores, the
+    per-repeat AUCs and the ROC curve of the averaged scores.
+    """
+    features = np.asarray(features, dtype=float)
+    labels = np.asarray(labels, dtype=bool)
+    groups = np.arange(len(labels)) if groups is None else np.asarray(groups)
+    tasks = [(features, labels, groups, n_splits, l2, seed + repeat) for repeat in range(n_repeats)]
+
+    if max_workers == 1 or len(labels) * n_repeats < PARALLEL_MIN_WORK:
+        repeat_scores = [_run_repeat(task) for task in tasks]
+    else:
+        # spawn, not fork: the app process runs other threads (Streamlit, database writers)
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            repeat_scores = list(executor.map(_run_repeat, tasks))
+
+    repeat_scores = np.vstack(repeat_scores)
+    scored = ~np.isnan(repeat_scores).any(axis=0)
+    repeat_aucs = roc_auc(np.broadcast_to(labels[scored], repeat_scores[:, scored].shape),
+                          repeat_scores[:, scored])
+    mean_scores = repeat_scores[:, scored].mean(axis=0)
+    scored_labels = labels[scored]
+
+    bootstrap_aucs = bootstrap_auc(scored_labels, mean_scores, n_bootstrap, np.random.default_rng(seed))
+    fpr, tpr = roc_curve(scored_labels, mean_scores)
+
+    return {
+        'auc': float(np.nanmean(repeat_aucs)),
+        'ci_low': float(np.nanpercentile(bootstrap_aucs, 2.5)),
+        'ci_high': float(np.nanpercentile(bootstrap_aucs, 97.5)),
+        'repeat_aucs': repeat_aucs,
+        'n_scored': int(scored.sum()),
+        'fpr': fpr,
+        'tpr': tpr
+    }
@@ -1,209 +1,1229 @@
 import sqlite3
+import numpy as np
 import pandas as pd
+import hashlib
 import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from utils import CELL_COUNT_COLUMNS, REQUIRED_COLUMNS, sample_percentages
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+INSERT_CHUNK_SIZE = 10000
+
+# Concurrency settings: readers use WAL snapshots, writers are serialized per
+# database and retried with exponential backoff if another process holds the lock
+BUSY_TIMEOUT_SECONDS = 5
+WRITE_RETRIES = 6
+WRITE_BACKOFF_SECONDS = 0.05
+
+DATA_TABLES = ('cell_counts', 'samples', 'treatments', 'subjects', 'projects')
+DERIVED_TABLES = ('running_stats', 'dimension_counts', 'sample_hashes', 'loaded_file')
+
+# Groupings kept in running_stats; 'all' is the whole dataset as one group
+RUNNING_STAT_DIMENSIONS = ('all', 'project', 'treatment', 'condition', 'response')
+
+class IngestCancelled(Exception):
+    """Raised when a load is cancelled; the load's transaction is rolled back"""
+
+def _records(frame):
+    """DataFrame rows as tuples of plain Python values (NaN becomes NULL)"""
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+
+def connect(db_name, readonly=False):
+    """Open a connection with WAL journaling, a busy timeout and foreign keys on
+
+    With readonly=True the file is opened read-only and treated as immutable
+    (for snapshots, which are never written after creation).
+    """
+    if readonly:
+        uri = f"file:{os.path.abspath(db_name)}?mode=ro&immutable=1"
+        return sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+    conn = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT_SECONDS)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+def _is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+class _SerializedWriter:
+    """Background thread that applies every write to one database, in order
+
+    Each operation is called as operation(conn, *args, **kwargs) on a fresh
+    connection and committed on success together with a new dataset version
+    token. The schema is applied before the first write to the file, and
+    again only if the file is replaced or its schema changed since. Lock errors caused by other processes
+    roll the operation back and retry it with exponential backoff.
+    """
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"db-writer-{os.path.basename(db_name)}",
+                                        daemon=True)
+        self._thread.start()
+        self._sidecar_requested = threading.Event()
+        self._sidecar_thread = None
+        self._schema_state = None
+
+    @property
+    def on_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, operation, args, kwargs, bump_version=True):
+        future = Future()
+        self._queue.put((operation, args, kwargs, bump_version, future))
+        return future
+
+    def _run(self):
+        while True:
+            operation, args, kwargs, bump_version, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.apply(operation, args, kwargs, bump_version))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def apply(self, operation, args, kwargs, bump_version=True):
+        for attempt in range(WRITE_RETRIES):
+            conn = connect(self.db_name)
+            try:
+                self._ensure_schema(conn)
+                result = operation(conn, *args, **kwargs)
+                if bump_version:
+                    conn.execute("UPDATE dataset_version SET token = lower(hex(randomblob(8)))")
+                conn.commit()
+                if bump_version:
+                    self.request_sidecar_refresh()
+                return result
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if not _is_lock_error(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(WRITE_BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    def _schema_key(self, conn):
+        # The file's identity and SQLite's schema cookie, which every DDL statement bumps
+        stat = os.stat(self.db_name)
+        return stat.st_dev, stat.st_ino, conn.execute("PRAGMA schema_version").fetchone()[0]
+
+    def _ensure_schema(self, conn):
+        """Apply the schema unless this writer already did to this very file, keeping DDL out of writes"""
+        if self._schema_state != self._schema_key(conn):
+            _apply_schema(conn)
+            self._schema_state = self._schema_key(conn)
+
+    def request_sidecar_refresh(self):
+        """Regenerate the count sidecar in the background; bursts of writes coalesce into one rebuild"""
+        self._sidecar_requested.set()
+        if self._sidecar_thread is None:
+            self._sidecar_thread = threading.Thread(target=self._refresh_sidecar, daemon=True,
+                                                    name=f"db-sidecar-{os.path.basename(self.db_name)}")
+            self._sidecar_thread.start()
+
+    def _refresh_sidecar(self):
+        while True:
+            self._sidecar_requested.wait()
+            self._sidecar_requested.clear()
+            try:
+                _refresh_count_sidecar(self.db_name)
+            except (sqlite3.Error, OSError) as e:
+                # Readers fall back to SQLite and write the sidecar themselves
+                print(f"Could not write count sidecar: {e}")
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def _reset_writers_after_fork():
+    # Writer threads don't survive fork(); a child process starts its own
+    global _writers_lock
+    _writers.clear()
+    _writers_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_writers_after_fork)
+
+def _execute_on_writer(db_name, operation, args, kwargs, bump_version):
+    key = os.path.abspath(db_name)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = _SerializedWriter(db_name)
+    if writer.on_writer_thread:
+        return writer.apply(operation, args, kwargs, bump_version)
+    return writer.submit(operation, args, kwargs, bump_version).result()
+
+def execute_write(db_name, operation, *args, **kwargs):
+    """Run a write operation on the database's single writer thread and wait for it"""
+    return _execute_on_writer(db_name, operation, args, kwargs, bump_version=True)
+
+def execute_maintenance(db_name, operation, *args, **kwargs):
+    """Like execute_write, for writes to derived tables that leave the data (and its version) unchanged"""
+    return _execute_on_writer(db_name, operation, args, kwargs, bump_version=False)
+
+# Tables that have a primary key in schema.sql; databases written by the
+# original to_sql loader have the same tables without any keys
+_KEYED_TABLES = ('projects', 'subjects', 'treatments', 'samples')
+_SCHEMA_VIEWS = ('sample_percentages', 'sample_totals')
+
+def _has_legacy_tables(conn):
+    for table in _KEYED_TABLES:
+        columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        if columns and not any(column[5] for column in columns):
+            return True
+    return False
+
+def _upgrade_legacy_tables(conn, schema):
+    """Rebuild keyless tables from an older database with schema's keys, keeping their rows
+
+    Runs as one script in its own transaction: the old tables are renamed
+    aside, the schema creates the new ones and the rows are copied across
+    (treatment IDs are kept, so samples still join to their treatments).
+    """
+    copies = {
+        'projects': "INSERT OR IGNORE INTO projects (project) "
+                    "SELECT project FROM legacy_projects WHERE project IS NOT NULL",
+        'subjects': "INSERT OR IGNORE INTO subjects (subject, age, sex, condition) "
+                    "SELECT subject, age, sex, condition FROM legacy_subjects WHERE subject IS NOT NULL",
+        'treatments': "INSERT OR IGNORE INTO treatments (treatment_id, treatment) "
+                      "SELECT treatment_id, treatment FROM legacy_treatments WHERE treatment IS NOT NULL",
+        'samples': "INSERT OR IGNORE INTO samples (sample, project, subject, treatment_id, sample_type, "
+                   "time_from_treatment_start, response) "
+                   "SELECT sample, project, subject, treatment_id, sample_type, time_from_treatment_start, response "
+                   "FROM legacy_samples WHERE sample IS NOT NULL",
+        'cell_counts': f"INSERT INTO cell_counts (sample, {', '.join(CELL_COUNT_COLUMNS)}) "
+                       f"SELECT sample, {', '.join(CELL_COUNT_COLUMNS)} FROM legacy_cell_counts"
+    }
+    tables = [table for table in DATA_TABLES if conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    script = ["BEGIN;"]
+    # Views are recreated by the schema; renaming their tables would rewrite them to the old ones
+    script += [f"DROP VIEW IF EXISTS {view};" for view in _SCHEMA_VIEWS]
+    script += [f"ALTER TABLE {table} RENAME TO legacy_{table};" for table in tables]
+    script.append(schema)
+    script += [f"{copies[table]};" for table in reversed(DATA_TABLES) if table in tables]
+    script += [f"DROP TABLE legacy_{table};" for table in tables]
+    script.append("COMMIT;")
+    conn.executescript('\n'.join(script))
+    print(f"Upgraded tables {', '.join(tables)} to the current schema")
+
+def _apply_schema(conn, schema_file=SCHEMA_FILE):
+    with open(schema_file, 'r') as f:
+        schema = f.read()
+    if _has_legacy_tables(conn):
+        _upgrade_legacy_tables(conn, schema)
+    # Applied (again) after an upgrade too: indexes left on the old tables were dropped with them
+    conn.executescript(schema)
+
+def ensure_schema(db_name, schema_file=SCHEMA_FILE):
+    """Create any missing tables (the schema script is idempotent)"""
+    execute_write(db_name, _apply_schema, schema_file)
+
+def database_exists(db_name):
+    return os.path.exists(db_name)
 
 def initialize_db(db_name, schema_file):
     """Initialize database with schema"""
-    # Remove existing database to ensure clean start
-    if os.path.exists(db_name):
-        os.remove(db_name)
-    
-    conn = sqlite3.connect(db_name)
-    with open(schema_file, 'r') as f:
-        conn.executescript(f.read())
-    conn.commit()
-    conn.close()
+    # Remove existing database (and its WAL files) to ensure clean start
+    for path in (db_name, f"{db_name}-wal", f"{db_name}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    ensure_schema(db_name, schema_file)
     print(f"Database {db_name} initialized with schema")
 
-def process_and_load_data(db_name, df):
-    """Process and load CSV data into database tables"""
-    conn = sqlite3.connect(db_name)
+_SAMPLE_COUNTS_SQL = """
+    SELECT s.sample, s.project, t.treatment, sub.condition, s.response,
+           c.b_cell, c.cd8_t_cell, c.cd4_t_cell, c.nk_cell, c.monocyte
+    FROM samples s
+    JOIN subjects sub ON s.subject = sub.subject
+    JOIN treatments t ON s.treatment_id = t.treatment_id
+    LEFT JOIN cell_counts c ON s.sample = c.sample
+"""
+
+# Column of _SAMPLE_COUNTS_SQL holding each running_stats dimension
+_DIMENSION_COLUMNS = {
+    'project': 's.project',
+    'treatment': 't.treatment',
+    'condition': 'sub.condition',
+    'response': "COALESCE(s.response, '')"
+}
+
+def _group_keys(frame, dimension):
+    if dimension == 'all':
+        return np.full(len(frame), '', dtype=object)
+    return frame[dimension].fillna('').astype(str).to_numpy()
+
+def _running_stats_rows(frame):
+    """running_stats rows (n, total, mean, m2, min, max per group) of a frame of samples"""
+    percentages = sample_percentages(frame[CELL_COUNT_COLUMNS].to_numpy()).ravel()
+    n_populations = len(CELL_COUNT_COLUMNS)
+    populations = np.tile(CELL_COUNT_COLUMNS, len(frame))
+
+    rows = []
+    for dimension in RUNNING_STAT_DIMENSIONS:
+        long = pd.DataFrame({
+            'group_value': np.repeat(_group_keys(frame, dimension), n_populations),
+            'population': populations,
+            'percentage': percentages
+        })
+        stats = long.groupby(['group_value', 'population'])['percentage'].agg(
+            ['count', 'sum', 'mean', 'var', 'min', 'max']).reset_index()
+        stats['m2'] = (stats['var'] * (stats['count'] - 1)).fillna(0)
+        stats.insert(0, 'dimension', dimension)
+        rows.append(stats[['dimension', 'group_value', 'population', 'count', 'sum', 'mean', 'm2', 'min', 'max']])
+    return pd.concat(rows, ignore_index=True)
+
+def _insert_running_stats(cursor, frame):
+    """Rebuild running_stats from a frame of samples in one vectorized pass per dimension"""
+    cursor.execute("DELETE FROM running_stats")
+    if frame.empty:
+        return
+    cursor.executemany(
+        """INSERT INTO running_stats
+           (dimension, group_value, population, n, total, mean, m2, min, max)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        _records(_running_stats_rows(frame))
+    )
+
+def _merge_running_stats(cursor, frame):
+    """Add a batch of samples to running_stats, one upsert per group
+
+    Merges each group's batch statistics into the stored ones with the
+    parallel (Chan et al.) mean/variance update; in the UPDATE clauses every
+    column reference is the value before the update.
+    """
+    if frame.empty:
+        return
+    cursor.executemany(
+        """INSERT INTO running_stats
+           (dimension, group_value, population, n, total, mean, m2, min, max)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (dimension, group_value, population) DO UPDATE SET
+               n = n + excluded.n,
+               total = total + excluded.total,
+               mean = (total + excluded.total) / (n + excluded.n),
+               m2 = m2 + excluded.m2 + (excluded.mean - mean) * (excluded.mean - mean) * n * excluded.n / (n + excluded.n),
+               min = MIN(min, excluded.min),
+               max = MAX(max, excluded.max)""",
+        _records(_running_stats_rows(frame))
+    )
+
+def _update_running_stats(cursor, groups, counts, removing=False):
+    """Add (or remove) one sample's percentages to the running aggregates in O(1)
+
+    Uses Welford's update; in the UPDATE clauses every column reference is the
+    value before the update. Removing a value that may have been a group's
+    min or max flags the extremes as stale instead of rescanning.
+    """
+    percentages = sample_percentages([counts])[0]
+    for dimension, group_value in groups:
+        for population, x in zip(CELL_COUNT_COLUMNS, percentages.tolist()):
+            key = (dimension, '' if pd.isna(group_value) else str(group_value), population)
+            if not removing:
+                cursor.execute(
+                    """INSERT INTO running_stats
+                       (dimension, group_value, population, n, total, mean, m2, min, max)
+                       VALUES (?, ?, ?, 1, ?, ?, 0, ?, ?)
+                       ON CONFLICT (dimension, group_value, population) DO UPDATE SET
+                           n = n + 1,
+                           total = total + excluded.total,
+                           mean = mean + (excluded.mean - mean) / (n + 1),
+                           m2 = m2 + (excluded.mean - mean) * (excluded.mean - (mean + (excluded.mean - mean) / (n + 1))),
+                           min = MIN(min, excluded.min),
+                           max = MAX(max, excluded.max)""",
+                    key + (x, x, x, x)
+                )
+            else:
+                cursor.execute(
+                    """UPDATE running_stats SET
+                           n = n - 1,
+                           total = total - :x,
+                           mean = CASE WHEN n > 1 THEN (n * mean - :x) / (n - 1) ELSE 0 END,
+                           m2 = CASE WHEN n > 1
+                                     THEN MAX(m2 - (:x - mean) * (:x - (n * mean - :x) / (n - 1)), 0)
+                                     ELSE 0 END,
+                           extremes_stale = extremes_stale OR :x <= min OR :x >= max
+                       WHERE dimension = :dimension AND group_value = :group_value AND population = :population""",
+                    {'x': x, 'dimension': key[0], 'group_value': key[1], 'population': key[2]}
+                )
+    if removing:
+        cursor.execute("DELETE FROM running_stats WHERE n <= 0")
+
+def _sample_groups(project, treatment, condition, response):
+    return [('all', ''), ('project', project), ('treatment', treatment),
+            ('condition', condition), ('response', response)]
+
+def _backfill_running_stats(conn):
+    """Build running_stats for databases with samples but no statistics yet (created before the table)
+
+    Incremental updates must run after this, or the table would only hold
+    the samples written since. Returns whether it rebuilt the table.
+    """
+    cursor = conn.cursor()
+    if (cursor.execute("SELECT 1 FROM samples LIMIT 1").fetchone()
+            and not cursor.execute("SELECT 1 FROM running_stats LIMIT 1").fetchone()):
+        _insert_running_stats(cursor, pd.read_sql_query(_SAMPLE_COUNTS_SQL, conn))
+        return True
+    return False
+
+def _refresh_running_stats(conn):
+    """Rebuild running_stats if missing (older databases) and recompute stale extremes"""
+    cursor = conn.cursor()
+    if _backfill_running_stats(conn):
+        return
+
+    stale_groups = cursor.execute(
+        "SELECT DISTINCT dimension, group_value FROM running_stats WHERE extremes_stale"
+    ).fetchall()
+    for dimension, group_value in stale_groups:
+        # Only this group's samples are scanned
+        query = _SAMPLE_COUNTS_SQL
+        params = ()
+        if dimension != 'all':
+            query += f" WHERE {_DIMENSION_COLUMNS[dimension]} = ?"
+            params = (group_value,)
+        counts = pd.read_sql_query(query, conn, params=params)[CELL_COUNT_COLUMNS].to_numpy()
+        if len(counts) == 0:
+            continue
+        percentages = sample_percentages(counts)
+        cursor.executemany(
+            """UPDATE running_stats SET min = ?, max = ?, extremes_stale = 0
+               WHERE dimension = ? AND group_value = ? AND population = ?""",
+            [(float(low), float(high), dimension, group_value, population)
+             for population, low, high in zip(CELL_COUNT_COLUMNS, percentages.min(axis=0), percentages.max(axis=0))]
+        )
+
+def get_running_summary(db_name, dimension='all', readonly=False):
+    """Summary of sample percentages per group and population, served from running_stats
+
+    Returns columns group_value, population, n, mean, std, min, max without
+    scanning the samples (except to refresh extremes after removals).
+    """
+    if not readonly:
+        conn = connect(db_name)
+        try:
+            needs_refresh = (
+                conn.execute("SELECT 1 FROM running_stats WHERE extremes_stale LIMIT 1").fetchone()
+                or (conn.execute("SELECT 1 FROM samples LIMIT 1").fetchone()
+                    and not conn.execute("SELECT 1 FROM running_stats LIMIT 1").fetchone())
+            )
+        except sqlite3.OperationalError:
+            needs_refresh = True  # running_stats table not created yet
+        finally:
+            conn.close()
+        if needs_refresh:
+            execute_maintenance(db_name, _refresh_running_stats)
+
+    conn = connect(db_name, readonly=readonly)
+    try:
+        summary = pd.read_sql_query(
+            """SELECT group_value, population, n, mean, m2, min, max FROM running_stats
+               WHERE dimension = ? ORDER BY group_value, population""",
+            conn, params=(dimension,)
+        )
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        # e.g. a snapshot taken before running_stats existed; callers fall back to a full scan
+        print(f"Running statistics unavailable: {e}")
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
+    summary['std'] = np.sqrt(summary['m2'] / (summary['n'] - 1)).where(summary['n'] > 1)
+    return summary[['group_value', 'population', 'n', 'mean', 'std', 'min', 'max']]
+
+# Filter dimensions offered by the app, with the SQL expression giving each sample's value
+FILTER_DIMENSIONS = {
+    'project': 's.project',
+    'condition': 'sub.condition',
+    'treatment': 't.treatment',
+    'sample_type': 's.sample_type',
+    'time_from_treatment_start': 's.time_from_treatment_start',
+    'response': 's.response',
+    'sex': 'sub.sex'
+}
+
+_SAMPLE_DIMENSIONS_SQL = f"""
+    SELECT {', '.join(f'{expression} AS {dimension}' for dimension, expression in FILTER_DIMENSIONS.items())}
+    FROM samples s
+    JOIN subjects sub ON s.subject = sub.subject
+    JOIN treatments t ON s.treatment_id = t.treatment_id
+"""
+
+def count_dimension_values(frame):
+    """Distinct values and sample counts of every filter dimension in a samples frame
+
+    Returns {dimension: DataFrame(value, sample_count)} sorted by value;
+    missing values are not options.
+    """
+    options = {}
+    for dimension in FILTER_DIMENSIONS:
+        counts = frame[dimension].dropna().value_counts().sort_index()
+        options[dimension] = pd.DataFrame({'value': counts.index.to_numpy(),
+                                           'sample_count': counts.to_numpy()})
+    return options
+
+def _insert_dimension_counts(cursor, frame):
+    cursor.execute("DELETE FROM dimension_counts")
+    for dimension, counts in count_dimension_values(frame).items():
+        cursor.executemany(
+            "INSERT INTO dimension_counts (dimension, value, sample_count) VALUES (?, ?, ?)",
+            ((dimension,) + row for row in _records(counts))
+        )
+
+def _merge_dimension_counts(cursor, frame):
+    """Add a batch of samples' option counts to dimension_counts"""
+    for dimension, counts in count_dimension_values(frame).items():
+        cursor.executemany(
+            """INSERT INTO dimension_counts (dimension, value, sample_count) VALUES (?, ?, ?)
+               ON CONFLICT (dimension, value) DO UPDATE SET sample_count = sample_count + excluded.sample_count""",
+            ((dimension,) + row for row in _records(counts))
+        )
+
+def _update_dimension_counts(cursor, sample_id, delta):
+    """Add delta to the counts of every option the sample has (call while the sample exists)"""
+    row = cursor.execute(_SAMPLE_DIMENSIONS_SQL + " WHERE s.sample = ?", (sample_id,)).fetchone()
+    if row is None:
+        return
+    cursor.executemany(
+        """INSERT INTO dimension_counts (dimension, value, sample_count) VALUES (?, ?, ?)
+           ON CONFLICT (dimension, value) DO UPDATE SET sample_count = sample_count + excluded.sample_count""",
+        [(dimension, value, delta) for dimension, value in zip(FILTER_DIMENSIONS, row) if value is not None]
+    )
+    cursor.execute("DELETE FROM dimension_counts WHERE sample_count <= 0")
+
+def _refresh_dimension_counts(conn):
+    """Build dimension_counts for databases created before the table existed
+
+    Incremental updates (_update_dimension_counts) must run after this, or
+    the table would only count the samples written since.
+    """
+    cursor = conn.cursor()
+    if (cursor.execute("SELECT 1 FROM samples LIMIT 1").fetchone()
+            and not cursor.execute("SELECT 1 FROM dimension_counts LIMIT 1").fetchone()):
+        _insert_dimension_counts(cursor, pd.read_sql_query(_SAMPLE_DIMENSIONS_SQL, conn))
+
+# Filter options of the latest version read per database; they only change on write
+_filter_options_cache = {}
+_filter_options_lock = threading.Lock()
+
+def get_filter_options(db_name, readonly=False):
+    """Filter option values with per-option sample counts, from the dimension_counts table
+
+    Returns {dimension: DataFrame(value, sample_count)} (see FILTER_DIMENSIONS),
+    served from memory while the dataset version is unchanged, or None if the
+    database has no such table (e.g. an older snapshot).
+    """
+    if not os.path.exists(db_name):
+        return None
+    if not readonly:
+        conn = connect(db_name)
+        try:
+            needs_refresh = (conn.execute("SELECT 1 FROM samples LIMIT 1").fetchone()
+                             and not conn.execute("SELECT 1 FROM dimension_counts LIMIT 1").fetchone())
+        except sqlite3.OperationalError:
+            needs_refresh = True  # dimension_counts table not created yet
+        finally:
+            conn.close()
+        if needs_refresh:
+            execute_maintenance(db_name, _refresh_dimension_counts)
+
+    key = os.path.abspath(db_name)
+    conn = connect(db_name, readonly=readonly)
+    try:
+        conn.execute("BEGIN")
+        version = _read_dataset_version(conn)
+        with _filter_options_lock:
+            cached = _filter_options_cache.get(key)
+        if cached is not None and version is not None and cached[0] == version:
+            return cached[1]
+        rows = pd.read_sql_query(
+            "SELECT dimension, value, sample_count FROM dimension_counts ORDER BY dimension, value", conn)
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        print(f"Filter options unavailable: {e}")
+        return None
+    finally:
+        conn.close()
+
+    grouped = {dimension: frame for dimension, frame in rows.groupby('dimension')}
+    options = {dimension: grouped[dimension][['value', 'sample_count']].reset_index(drop=True)
+               if dimension in grouped else pd.DataFrame({'value': [], 'sample_count': []})
+               for dimension in FILTER_DIMENSIONS}
+    with _filter_options_lock:
+        _filter_options_cache[key] = (version, options)
+    return options
+
+# Percentage summaries of the most recently requested (group, filter) combinations
+SUMMARY_CACHE_SIZE = 32
+_summary_cache = OrderedDict()
+_summary_lock = threading.Lock()
+
+def _summary_arguments(group_by, filters):
+    """group_by as a list and filters without unrestricted columns; raises ValueError for unknown columns"""
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    filters = {column: list(values) for column, values in (filters or {}).items() if values is not None}
+    unknown = [column for column in group_by + list(filters) if column not in FILTER_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown summary columns: {', '.join(unknown)}")
+    return group_by, filters
+
+def _percentage_summary_query(group_by, filters):
+    """SQL over the sample_percentages view (and its ? parameters) behind get_percentage_summary
+
+    Plain SQL that SQLite and DuckDB both run. Gives columns group_by +
+    [population, n, mean, m2, min, max, median]; _finish_percentage_summary
+    turns m2 into the standard deviation.
+    """
+    partition = ', '.join(group_by + ['population'])
+    conditions = [f"{column} IS NOT NULL" for column in group_by]
+    conditions += [f"{column} IN ({', '.join('?' * len(values))})" for column, values in filters.items()]
+    args = [value for values in filters.values() for value in values]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Two passes inside the database: window functions rank each value and give its
+    # group's size and mean; the grouped pass then sums squared deviations and
+    # averages the middle one or two ranked values for the median (those with
+    # n <= 2 * position <= n + 2, which needs no integer division)
+    query = f"""
+        WITH selected AS (
+            SELECT {partition}, percentage,
+                   ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY percentage) AS position,
+                   COUNT(*) OVER (PARTITION BY {partition}) AS group_size,
+                   AVG(percentage) OVER (PARTITION BY {partition}) AS group_mean
+            FROM sample_percentages
+            {where}
+        )
+        SELECT {partition},
+               COUNT(*) AS n,
+               AVG(percentage) AS mean,
+               SUM((percentage - group_mean) * (percentage - group_mean)) AS m2,
+               MIN(percentage) AS min,
+               MAX(percentage) AS max,
+               AVG(CASE WHEN 2 * position BETWEEN group_size AND group_size + 2
+                        THEN percentage END) AS median
+        FROM selected
+        GROUP BY {partition}
+        ORDER BY {partition}
+    """
+    return query, args
+
+def _finish_percentage_summary(summary, group_by):
+    """get_percentage_summary's columns from a _percentage_summary_query result"""
+    summary['std'] = np.sqrt(summary['m2'] / (summary['n'] - 1)).where(summary['n'] > 1)
+    return summary[group_by + ['population', 'n', 'mean', 'std', 'min', 'max', 'median']]
+
+def get_percentage_summary(db_name, group_by=(), filters=None, readonly=False):
+    """Per-population count, mean, std, min, max and median of sample percentages, computed in SQLite
+
+    group_by and the keys of filters ({column: allowed values}, None for no
+    restriction) are filter dimensions (FILTER_DIMENSIONS). The aggregation
+    runs over the sample_percentages view, so only one row per group and
+    population leaves the database: columns group_by + [population, n, mean,
+    std, min, max, median], ordered by group then population. Samples
+    missing a grouping value are left out. Results are memoized per dataset
+    version. Returns None if the database has no such view (e.g. an older
+    snapshot).
+    """
+    group_by, filters = _summary_arguments(group_by, filters)
+    if not os.path.exists(db_name):
+        return None
+    if not readonly:
+        conn = connect(db_name)
+        try:
+            has_view = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sample_percentages'").fetchone()
+        finally:
+            conn.close()
+        if not has_view:
+            execute_maintenance(db_name, _apply_schema)
+
+    query, args = _percentage_summary_query(group_by, filters)
+    conn = connect(db_name, readonly=readonly)
+    try:
+        conn.execute("BEGIN")
+        version = _read_dataset_version(conn)
+        key = (os.path.abspath(db_name), version, tuple(group_by), repr(sorted(filters.items())))
+        with _summary_lock:
+            cached = _summary_cache.get(key)
+            if cached is not None:
+                _summary_cache.move_to_end(key)
+        if cached is not None and version is not None:
+            return cached
+        summary = pd.read_sql_query(query, conn, params=args)
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        print(f"Percentage summary unavailable: {e}")
+        return None
+    finally:
+        conn.close()
+
+    summary = _finish_percentage_summary(summary, group_by)
+    if version is not None:
+        with _summary_lock:
+            _summary_cache[key] = summary
+            while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+                _summary_cache.popitem(last=False)
+    return summary
+
+# ID columns the pickers search, as (table, primary key column)
+SEARCHABLE_IDS = {
+    'sample': ('samples', 'sample'),
+    'subject': ('subjects', 'subject')
+}
+SEARCH_LIMIT = 20
+
+def _prefix_upper_bound(prefix):
+    """Smallest string greater than every string starting with prefix (None if unbounded)"""
+    for position in range(len(prefix) - 1, -1, -1):
+        if ord(prefix[position]) < 0x10FFFF:
+            return prefix[:position] + chr(ord(prefix[position]) + 1)
+    return None
+
+def search_ids(db_name, kind, query, limit=SEARCH_LIMIT, readonly=False):
+    """Sample or subject IDs matching query, prefix matches first, for type-ahead pickers
+
+    Prefix matches are a range scan of the ID's case-insensitive index
+    (id >= query AND id < next string, compared with NOCASE), so they stay
+    fast at any size; the remaining slots are filled with IDs containing
+    query elsewhere, walking the same index in order and stopping once limit
+    is reached. Returns at most limit IDs.
+    """
+    table, column = SEARCHABLE_IDS[kind]
+    if not os.path.exists(db_name):
+        return []
+    query = query.lower()
+    order = f"ORDER BY {column} COLLATE NOCASE LIMIT ?"
+    conn = connect(db_name, readonly=readonly)
+    try:
+        if not query:
+            return [row[0] for row in conn.execute(f"SELECT {column} FROM {table} {order}", (limit,))]
+
+        upper = _prefix_upper_bound(query)
+        if upper is None:
+            prefix_sql, prefix_args = f"{column} >= ? COLLATE NOCASE", (query,)
+        else:
+            prefix_sql = f"{column} >= ? COLLATE NOCASE AND {column} < ? COLLATE NOCASE"
+            prefix_args = (query, upper)
+        matches = [row[0] for row in conn.execute(
+            f"SELECT {column} FROM {table} WHERE {prefix_sql} {order}", prefix_args + (limit,))]
+        if len(matches) < limit:
+            matches += [row[0] for row in conn.execute(
+                f"SELECT {column} FROM {table} WHERE instr(lower({column}), ?) > 1 {order}",
+                (query, limit - len(matches)))]
+        return matches
+    except sqlite3.Error as e:
+        print(f"Error searching {kind} IDs: {e}")
+        return []
+    finally:
+        conn.close()
+
+def _treatment_ids(cursor, treatments):
+    """{treatment: treatment_id} for treatments, adding the missing ones with the next free IDs
+
+    IDs are written explicitly rather than taken from lastrowid, so they are
+    never NULL whatever key the treatments table was created with.
+    """
+    treatment_ids = dict(cursor.execute("SELECT treatment, treatment_id FROM treatments").fetchall())
+    for treatment in treatments:
+        if treatment not in treatment_ids:
+            next_id = cursor.execute("SELECT COALESCE(MAX(treatment_id), 0) + 1 FROM treatments").fetchone()[0]
+            cursor.execute("INSERT INTO treatments (treatment_id, treatment) VALUES (?, ?)", (next_id, treatment))
+            treatment_ids[treatment] = next_id
+    return treatment_ids
+
+def _insert_samples(cursor, df, treatment_ids, progress=None, cancel_event=None):
+    """Insert df's samples (treatment names mapped through treatment_ids) and cell counts in chunks"""
+    total_rows = len(df)
+    for start in range(0, total_rows, INSERT_CHUNK_SIZE):
+        if cancel_event is not None and cancel_event.is_set():
+            raise IngestCancelled()
+
+        chunk = df.iloc[start:start + INSERT_CHUNK_SIZE]
+        samples = chunk[['sample', 'project', 'subject', 'treatment',
+                         'sample_type', 'time_from_treatment_start', 'response']].copy()
+        samples['treatment'] = samples['treatment'].map(treatment_ids)
+        cursor.executemany("""INSERT INTO samples
+                             (sample, project, subject, treatment_id, sample_type,
+                              time_from_treatment_start, response)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)""", _records(samples))
+
+        cell_counts = chunk[['sample', 'b_cell', 'cd8_t_cell', 'cd4_t_cell',
+                             'nk_cell', 'monocyte']]
+        cursor.executemany("""INSERT INTO cell_counts
+                             (sample, b_cell, cd8_t_cell, cd4_t_cell, nk_cell, monocyte)
+                             VALUES (?, ?, ?, ?, ?, ?)""", _records(cell_counts))
+
+        if progress is not None:
+            progress(min(start + INSERT_CHUNK_SIZE, total_rows), total_rows)
+
+    if cancel_event is not None and cancel_event.is_set():
+        raise IngestCancelled()
+
+# Ingest columns hashed as numbers, so 45 and 45.0 hash alike whatever dtype a file parses to
+_NUMERIC_HASH_COLUMNS = ['age', 'time_from_treatment_start'] + CELL_COUNT_COLUMNS
+
+def row_hashes(df):
+    """64-bit hash of every row's ingest columns (REQUIRED_COLUMNS), as int64"""
+    values = pd.DataFrame({
+        column: (pd.to_numeric(df[column], errors='coerce').astype(float) if column in _NUMERIC_HASH_COLUMNS
+                 else df[column].fillna('').astype(str))
+        for column in REQUIRED_COLUMNS
+    })
+    return pd.util.hash_pandas_object(values, index=False).to_numpy().view(np.int64)
+
+def frame_hash(df):
+    """Content hash of a whole frame of ingest rows (for loads that don't come from a file)"""
+    return hashlib.sha256(row_hashes(df).tobytes()).hexdigest()
+
+def _replace_all_data(conn, df, progress=None, cancel_event=None, content_hash=None, before_commit=None):
+    """Make the database hold exactly df's samples, writing only what changed
+
+    Samples whose stored row hash equals their row in df are left alone;
+    changed and removed samples are deleted and changed and new ones
+    inserted. The derived tables are rebuilt from df in memory. Returns
+    (samples stored, samples written).
+    """
     cursor = conn.cursor()
+    hashes = row_hashes(df)
+    stored_hashes = dict(cursor.execute(
+        "SELECT h.sample, h.row_hash FROM sample_hashes h JOIN samples s ON s.sample = h.sample").fetchall())
+    unchanged = np.fromiter((stored_hashes.get(sample) == row_hash
+                             for sample, row_hash in zip(df['sample'].tolist(), hashes.tolist())),
+                            dtype=bool, count=len(df))
+    changed = df[~unchanged]
+
+    # Delete every stored sample that is not kept unchanged, children first
+    kept = set(df['sample'][unchanged].tolist())
+    stale = [(sample,) for (sample,) in cursor.execute("SELECT sample FROM samples") if sample not in kept]
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS stale_samples (sample TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM stale_samples")
+    cursor.executemany("INSERT INTO stale_samples (sample) VALUES (?)", stale)
+    for table in ('cell_counts', 'sample_hashes', 'samples'):
+        cursor.execute(f"DELETE FROM {table} WHERE sample IN (SELECT sample FROM stale_samples)")
+
+    # Projects, subjects and treatments of the written rows; subjects take the file's attributes
+    cursor.executemany("INSERT OR IGNORE INTO projects (project) VALUES (?)",
+                       ((project,) for project in changed['project'].unique()))
+    subjects = changed[['subject', 'age', 'sex', 'condition']].drop_duplicates(subset=['subject'])
+    cursor.executemany("""INSERT INTO subjects (subject, age, sex, condition) VALUES (?, ?, ?, ?)
+                          ON CONFLICT (subject) DO UPDATE SET
+                              age = excluded.age, sex = excluded.sex, condition = excluded.condition""",
+                       _records(subjects))
+    treatment_ids = _treatment_ids(cursor, changed['treatment'].unique())
+
+    # Load samples (with treatment_id mapping) and cell counts in chunks
+    _insert_samples(cursor, changed, treatment_ids, progress, cancel_event)
+    cursor.executemany("INSERT INTO sample_hashes (sample, row_hash) VALUES (?, ?)",
+                       zip(changed['sample'].tolist(), hashes[~unchanged].tolist()))
+
+    # Drop projects, subjects and treatments no sample refers to any more
+    cursor.execute("DELETE FROM projects WHERE project NOT IN (SELECT project FROM samples)")
+    cursor.execute("DELETE FROM subjects WHERE subject NOT IN (SELECT subject FROM samples)")
+    cursor.execute("DELETE FROM treatments WHERE treatment_id NOT IN (SELECT treatment_id FROM samples)")
+
+    _insert_running_stats(cursor, df)
+    _insert_dimension_counts(cursor, df)
+    cursor.execute("DELETE FROM loaded_file")
+    if content_hash is not None:
+        cursor.execute("INSERT INTO loaded_file (id, content_hash) VALUES (1, ?)", (content_hash,))
+
+    # Verify data was loaded
+    cursor.execute("SELECT COUNT(*) FROM samples")
+    count = cursor.fetchone()[0]
+    if before_commit is not None:
+        before_commit()
+    return count, len(changed)
+
+def process_and_load_data(db_name, df, progress=None, cancel_event=None, content_hash=None,
+                          before_commit=None):
+    """Process and load CSV data into database tables
 
+    Existing rows are replaced inside a single transaction on the database's
+    writer thread, so a failed or cancelled load leaves the previous data
+    intact. If given, progress is called as progress(rows_written, total_rows)
+    after each chunk of samples, and setting cancel_event (a threading.Event)
+    rolls the load back and raises IngestCancelled.
+
+    content_hash identifies the file df was parsed from (default: a hash of
+    df's rows). Loading the content the data was last loaded from is skipped,
+    and otherwise only samples whose row changed are written.
+
+    before_commit, if given, is called once the rows are written and before
+    the transaction commits; if it raises, the load is rolled back.
+    """
     try:
-        # Enable foreign keys
-        cursor.execute("PRAGMA foreign_keys = ON")
-        
-        # Load projects
-        projects = pd.DataFrame({'project': df['project'].unique()})
-        projects.to_sql('projects', conn, if_exists='replace', index=False)
-        
-        # Load subjects
-        subjects = df[['subject', 'age', 'sex', 'condition']].drop_duplicates().copy()
-        subjects.to_sql('subjects', conn, if_exists='replace', index=False)
-        
-        # Load treatments
-        treatments = pd.DataFrame({'treatment': df['treatment'].unique()})
-        treatments.reset_index(drop=True, inplace=True)
-        treatments.index += 1  # Start treatment_id from 1
-        treatments.to_sql('treatments', conn, if_exists='replace', index=True, index_label='treatment_id')
-        
-        # Load samples with treatment_id mapping
-        samples = df[['sample', 'project', 'subject', 'treatment', 
-                     'sample_type', 'time_from_treatment_start', 'response']].copy()
-        
-        # Get treatment mapping
-        treatment_map = pd.read_sql("SELECT treatment_id, treatment FROM treatments", conn)
-        treatment_dict = dict(zip(treatment_map['treatment'], treatment_map['treatment_id']))
-        
-        # Map treatments to IDs
-        samples['treatment_id'] = samples['treatment'].map(treatment_dict)
-        samples = samples.drop('treatment', axis=1)
-        samples.to_sql('samples', conn, if_exists='replace', index=False)
-        
-        # Load cell counts
-        cell_counts = df[['sample', 'b_cell', 'cd8_t_cell', 'cd4_t_cell', 
-                         'nk_cell', 'monocyte']].copy()
-        cell_counts.to_sql('cell_counts', conn, if_exists='replace', index=False)
-        
-        conn.commit()
-        
-        # Verify data was loaded
-        cursor.execute("SELECT COUNT(*) FROM samples")
-        count = cursor.fetchone()[0]
-        print(f"Successfully loaded {count} samples")
-        
+        if content_hash is None:
+            content_hash = frame_hash(df)
+        if content_hash == get_loaded_hash(db_name):
+            print("Data unchanged since the last load, skipped")
+            return True
+        count, written = execute_write(db_name, _replace_all_data, df, progress, cancel_event, content_hash,
+                                       before_commit)
+        print(f"Successfully loaded {count} samples ({written} new or changed)")
         return count > 0
 
+    except IngestCancelled:
+        print("Data load cancelled, rolled back")
+        raise
     except Exception as e:
         print(f"Error loading data: {str(e)}")
-        conn.rollback()
         return False
+
+def get_loaded_hash(db_name, readonly=False):
+    """Content hash of the file the data was last loaded from, or None if written since"""
+    if not os.path.exists(db_name):
+        return None
+    conn = connect(db_name, readonly=readonly)
+    try:
+        row = conn.execute("SELECT content_hash FROM loaded_file WHERE id = 1").fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        # Databases created before content hashing have no loaded_file table
+        return None
+    finally:
+        conn.close()
+
+def _append_data(conn, df, progress=None, cancel_event=None, before_commit=None):
+    cursor = conn.cursor()
+    had_samples = cursor.execute("SELECT 1 FROM samples LIMIT 1").fetchone() is not None
+
+    # Projects and subjects already in the database keep their rows
+    cursor.executemany("INSERT OR IGNORE INTO projects (project) VALUES (?)",
+                       ((project,) for project in df['project'].unique()))
+    subjects = df[['subject', 'age', 'sex', 'condition']].drop_duplicates(subset=['subject'])
+    cursor.executemany("INSERT OR IGNORE INTO subjects (subject, age, sex, condition) VALUES (?, ?, ?, ?)",
+                       _records(subjects))
+
+    # Treatments are matched by name; new ones get the next treatment_id
+    treatment_ids = _treatment_ids(cursor, df['treatment'].unique())
+
+    _insert_samples(cursor, df, treatment_ids, progress, cancel_event)
+    cursor.executemany("INSERT INTO sample_hashes (sample, row_hash) VALUES (?, ?)",
+                       zip(df['sample'].tolist(), row_hashes(df).tolist()))
+    cursor.execute("DELETE FROM loaded_file")
+
+    # Derived tables absorb the batch instead of being rebuilt, grouped by the
+    # stored subject attributes. Databases with samples but no derived rows yet
+    # (created before those tables) are filled by their refresh on next read.
+    stored = pd.read_sql_query("SELECT subject, sex, condition FROM subjects", conn).set_index('subject')
+    batch = df.assign(sex=df['subject'].map(stored['sex']), condition=df['subject'].map(stored['condition']))
+    if not had_samples or cursor.execute("SELECT 1 FROM running_stats LIMIT 1").fetchone():
+        _merge_running_stats(cursor, batch)
+    if not had_samples or cursor.execute("SELECT 1 FROM dimension_counts LIMIT 1").fetchone():
+        _merge_dimension_counts(cursor, batch)
+    if before_commit is not None:
+        before_commit()
+    return len(df)
+
+def append_data(db_name, df, progress=None, cancel_event=None, before_commit=None):
+    """Add df's samples to the existing data in one transaction
+
+    Unlike process_and_load_data nothing is replaced: subjects, projects and
+    treatments already in the database are reused (matched by name). A
+    sample ID that already exists fails the whole batch, leaving the database
+    unchanged. progress, cancel_event and before_commit work as for
+    process_and_load_data.
+    Returns the number of samples added (0 on error).
+    """
+    try:
+        count = execute_write(db_name, _append_data, df, progress, cancel_event, before_commit)
+        print(f"Successfully appended {count} samples")
+        return count
+
+    except IngestCancelled:
+        print("Data load cancelled, rolled back")
+        raise
+    except Exception as e:
+        print(f"Error appending data: {str(e)}")
+        return 0
+
+def _clear_all_data(conn):
+    for table in DATA_TABLES + DERIVED_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    # Restart AUTOINCREMENT numbering (sqlite_sequence only exists once used)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+        conn.execute("DELETE FROM sqlite_sequence")
+
+def clear_database(db_name):
+    """Delete all data in one transaction, leaving the file in place for other readers"""
+    try:
+        execute_write(db_name, _clear_all_data)
+        return True
+    except sqlite3.Error as e:
+        print(f"Error clearing database: {e}")
+        return False
+
+def _read_dataset_version(conn):
+    try:
+        row = conn.execute("SELECT token FROM dataset_version WHERE id = 1").fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        # Databases created before versioning have no version table
+        return None
+
+def get_dataset_version(db_name, readonly=False):
+    """Token identifying the current contents of the database (changes on every write)"""
+    if not os.path.exists(db_name):
+        return None
+    conn = connect(db_name, readonly=readonly)
+    try:
+        return _read_dataset_version(conn)
     finally:
         conn.close()
 
-def load_data(db_name):
-    """Load all data from database with proper table joins"""
+# Joins every table back into one row per sample (the layout of the ingest CSV)
+_SAMPLE_COLUMNS = """
+        s.sample,
+        p.project,
+        sub.subject,
+        sub.age,
+        sub.sex,
+        sub.condition,
+        t.treatment,
+        s.sample_type,
+        s.time_from_treatment_start,
+        s.response"""
+_SAMPLE_JOINS = """
+    FROM samples s
+    JOIN projects p ON s.project = p.project
+    JOIN subjects sub ON s.subject = sub.subject
+    JOIN treatments t ON s.treatment_id = t.treatment_id"""
+LOAD_QUERY = f"""
+    SELECT{_SAMPLE_COLUMNS},
+        c.b_cell,
+        c.cd8_t_cell,
+        c.cd4_t_cell,
+        c.nk_cell,
+        c.monocyte{_SAMPLE_JOINS}
+    LEFT JOIN cell_counts c ON s.sample = c.sample
+    ORDER BY s.sample
+"""
+# Everything but the counts, for loads that take the counts from the sidecar
+METADATA_QUERY = f"""
+    SELECT{_SAMPLE_COLUMNS}{_SAMPLE_JOINS}
+    ORDER BY s.sample
+"""
+_COUNTS_QUERY = """
+    SELECT s.sample, c.b_cell, c.cd8_t_cell, c.cd4_t_cell, c.nk_cell, c.monocyte
+    FROM samples s
+    LEFT JOIN cell_counts c ON s.sample = c.sample
+    ORDER BY s.sample
+"""
+
+def count_sidecar_dir(db_name):
+    """Directory of the count matrix sidecar (e.g. samples_counts/ next to samples.db)"""
+    stem = os.path.splitext(os.path.abspath(db_name))[0]
+    return f"{stem}_counts"
+
+def _sidecar_paths(db_name, version):
+    directory = count_sidecar_dir(db_name)
+    return (os.path.join(directory, f"samples-{version}.npy"),
+            os.path.join(directory, f"counts-{version}.npy"))
+
+def _save_array(path, array):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(temp_path, path)
+
+def save_count_sidecar(db_name, version, samples, counts):
+    """Write the sample x population count matrix of one dataset version
+
+    Files are named by version and never modified, so readers can map them
+    while a newer version is written; the sample file is written last and
+    marks the pair complete. Counts are stored column-major, so every
+    population is a contiguous slice. Files of older versions are removed
+    (processes that still map them keep a valid mapping).
+    """
+    samples_path, counts_path = _sidecar_paths(db_name, version)
+    if os.path.exists(samples_path):
+        return
+    os.makedirs(count_sidecar_dir(db_name), exist_ok=True)
+    counts = np.asarray(counts)
+    # Integer counts stay int64; missing counts (NULL) need float64 for NaN
+    _save_array(counts_path, np.asfortranarray(counts if counts.dtype.kind in 'iuf' else counts.astype(float)))
+    _save_array(samples_path, np.asarray(samples, dtype=str))
+
+    current = {os.path.basename(samples_path), os.path.basename(counts_path)}
+    for entry in os.scandir(count_sidecar_dir(db_name)):
+        if entry.name.endswith('.npy') and entry.name not in current:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+def load_count_matrix(db_name, version=None):
+    """Memory-mapped (sample IDs, counts) for the current dataset version, or None if not written
+
+    The arrays are read-only views of the sidecar files, shared by every
+    process through the page cache. Count columns follow CELL_COUNT_COLUMNS.
+    """
+    version = version or get_dataset_version(db_name)
+    if version is None:
+        return None
+    samples_path, counts_path = _sidecar_paths(db_name, version)
+    try:
+        # np.asarray drops the memmap subclass but keeps the mapping (no copy)
+        return (np.asarray(np.load(samples_path, mmap_mode='r')),
+                np.asarray(np.load(counts_path, mmap_mode='r')))
+    except (OSError, ValueError):
+        return None
+
+def _refresh_count_sidecar(db_name):
+    """Regenerate the sidecar from the committed data, unless a reader already wrote it"""
+    conn = connect(db_name)
+    try:
+        conn.execute("BEGIN")
+        version = _read_dataset_version(conn)
+        if version is None or load_count_matrix(db_name, version) is not None:
+            return
+        rows = pd.read_sql_query(_COUNTS_QUERY, conn)
+    finally:
+        conn.close()
+    save_count_sidecar(db_name, version, rows['sample'].to_numpy(), rows[CELL_COUNT_COLUMNS].to_numpy())
+
+def load_data(db_name, readonly=False):
+    """Load all data from database with proper table joins (readonly=True for snapshots)
+
+    The dataset version token is attached as df.attrs['dataset_version'].
+    Cell counts are taken from the memory-mapped count sidecar when it holds
+    this version (the columns are then read-only views of the file), and the
+    sidecar is written from the loaded rows when it is missing.
+    """
     if not os.path.exists(db_name):
         print(f"Database {db_name} does not exist")
         return pd.DataFrame()
-    
-    conn = sqlite3.connect(db_name)
-    
+
+    # One read transaction: the version token and the rows come from the same WAL snapshot
+    conn = connect(db_name, readonly=readonly)
+
     try:
-        query = """
-        SELECT 
-            s.sample,
-            p.project,
-            sub.subject,
-            sub.age,
-            sub.sex,
-            sub.condition,
-            t.treatment,
-            s.sample_type,
-            s.time_from_treatment_start,
-            s.response,
-            c.b_cell,
-            c.cd8_t_cell,
-            c.cd4_t_cell,
-            c.nk_cell,
-            c.monocyte
-        FROM samples s
-        JOIN projects p ON s.project = p.project
-        JOIN subjects sub ON s.subject = sub.subject
-        JOIN treatments t ON s.treatment_id = t.treatment_id
-        LEFT JOIN cell_counts c ON s.sample = c.sample
-        ORDER BY s.sample
-        """
-        
-        df = pd.read_sql_query(query, conn)
+        conn.execute("BEGIN")
+        version = _read_dataset_version(conn)
+
+        # Counts come from the memory-mapped sidecar when it matches this version
+        sidecar = None if readonly else load_count_matrix(db_name, version)
+        df = None
+        if sidecar is not None:
+            samples, counts = sidecar
+            df = pd.read_sql_query(METADATA_QUERY, conn)
+            if np.array_equal(df['sample'].to_numpy(dtype=str), samples):
+                # Columns are views of the mapped file, not copies
+                df = df.assign(**{column: pd.Series(counts[:, i], copy=False)
+                                  for i, column in enumerate(CELL_COUNT_COLUMNS)})
+            else:
+                df = None
+        if df is None:
+            df = pd.read_sql_query(LOAD_QUERY, conn)
+            if not readonly and version is not None:
+                save_count_sidecar(db_name, version, df['sample'].to_numpy(), df[CELL_COUNT_COLUMNS].to_numpy())
+        df.attrs['dataset_version'] = version
         print(f"Retrieved {len(df)} rows from database")
         return df
-        
+
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return pd.DataFrame()
     finally:
         conn.close()
 
+def _remove_sample(conn, sample_id):
+    cursor = conn.cursor()
+    _backfill_running_stats(conn)
+    _refresh_dimension_counts(conn)
+
+    # Read the sample's groups and counts so its running statistics can be backed out
+    removed = cursor.execute(_SAMPLE_COUNTS_SQL + " WHERE s.sample = ?", (sample_id,)).fetchone()
+    _update_dimension_counts(cursor, sample_id, -1)
+
+    # Remove cell counts first (child table)
+    cursor.execute("DELETE FROM cell_counts WHERE sample = ?", (sample_id,))
+    cursor.execute("DELETE FROM sample_hashes WHERE sample = ?", (sample_id,))
+    cursor.execute("DELETE FROM loaded_file")
+
+    # Remove sample (parent table)
+    cursor.execute("DELETE FROM samples WHERE sample = ?", (sample_id,))
+
+    if removed is not None:
+        _update_running_stats(cursor, _sample_groups(*removed[1:5]), removed[5:], removing=True)
+
+    # Check if removal was successful
+    cursor.execute("SELECT COUNT(*) FROM samples WHERE sample = ?", (sample_id,))
+    return cursor.fetchone()[0] == 0
+
 def remove_sample(db_name, table_name, sample_id):
     """Remove a sample and its related data"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("PRAGMA foreign_keys = ON")
-        
-        # Remove cell counts first (child table)
-        cursor.execute("DELETE FROM cell_counts WHERE sample = ?", (sample_id,))
-        
-        # Remove sample (parent table)
-        cursor.execute("DELETE FROM samples WHERE sample = ?", (sample_id,))
-        
-        conn.commit()
-        
-        # Check if removal was successful
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE sample = ?", (sample_id,))
-        count = cursor.fetchone()[0]
-        
-        return count == 0
-        
+        return execute_write(db_name, _remove_sample, sample_id)
     except sqlite3.Error as e:
         print(f"Error removing sample: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
+
+def _add_sample(conn, sample_data):
+    cursor = conn.cursor()
+
+    # Check if sample already exists
+    cursor.execute("SELECT COUNT(*) FROM samples WHERE sample = ?", (sample_data['sample'],))
+    if cursor.fetchone()[0] > 0:
+        print(f"Sample {sample_data['sample']} already exists")
+        return False
+    _backfill_running_stats(conn)
+    _refresh_dimension_counts(conn)
+
+    # Get treatment_id (adding the treatment if it doesn't exist)
+    treatment_id = _treatment_ids(cursor, [sample_data['treatment']])[sample_data['treatment']]
+
+    # Add project if it doesn't exist
+    cursor.execute("INSERT OR IGNORE INTO projects (project) VALUES (?)",
+                  (sample_data['project'],))
+
+    # Add subject if it doesn't exist
+    cursor.execute("""INSERT OR IGNORE INTO subjects
+                     (subject, age, sex, condition) VALUES (?, ?, ?, ?)""",
+                  (sample_data['subject'], sample_data['age'],
+                   sample_data['sex'], sample_data['condition']))
+
+    # Add sample
+    cursor.execute("""INSERT INTO samples
+                     (sample, project, subject, treatment_id, sample_type,
+                      time_from_treatment_start, response)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                  (sample_data['sample'], sample_data['project'],
+                   sample_data['subject'], treatment_id, sample_data['sample_type'],
+                   sample_data['time_from_treatment_start'], sample_data['response']))
+
+    # Add cell counts
+    cursor.execute("""INSERT INTO cell_counts
+                     (sample, b_cell, cd8_t_cell, cd4_t_cell, nk_cell, monocyte)
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  (sample_data['sample'], sample_data['b_cell'],
+                   sample_data['cd8_t_cell'], sample_data['cd4_t_cell'],
+                   sample_data['nk_cell'], sample_data['monocyte']))
+
+    # Update running statistics, grouping by the subject's stored condition
+    cursor.execute("SELECT condition FROM subjects WHERE subject = ?", (sample_data['subject'],))
+    condition = cursor.fetchone()[0]
+    _update_running_stats(
+        cursor,
+        _sample_groups(sample_data['project'], sample_data['treatment'], condition, sample_data['response']),
+        [sample_data[column] for column in CELL_COUNT_COLUMNS]
+    )
+    _update_dimension_counts(cursor, sample_data['sample'], 1)
+    cursor.execute("DELETE FROM loaded_file")
+
+    return True
 
 def add_sample(db_name, sample_data):
     """Add a new sample to the database"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("PRAGMA foreign_keys = ON")
-        
-        # Check if sample already exists
-        cursor.execute("SELECT COUNT(*) FROM samples WHERE sample = ?", (sample_data['sample'],))
-        if cursor.fetchone()[0] > 0:
-            print(f"Sample {sample_data['sample']} already exists")
-            return False
-        
-        # Get treatment_id
-        cursor.execute("SELECT treatment_id FROM treatments WHERE treatment = ?", 
-                      (sample_data['treatment'],))
-        result = cursor.fetchone()
-        if not result:
-            # Add new treatment if it doesn't exist
-            cursor.execute("INSERT INTO treatments (treatment) VALUES (?)", 
-                          (sample_data['treatment'],))
-            treatment_id = cursor.lastrowid
-        else:
-            treatment_id = result[0]
-        
-        # Add project if it doesn't exist
-        cursor.execute("INSERT OR IGNORE INTO projects (project) VALUES (?)", 
-                      (sample_data['project'],))
-        
-        # Add subject if it doesn't exist
-        cursor.execute("""INSERT OR IGNORE INTO subjects 
-                         (subject, age, sex, condition) VALUES (?, ?, ?, ?)""", 
-                      (sample_data['subject'], sample_data['age'], 
-                       sample_data['sex'], sample_data['condition']))
-        
-        # Add sample
-        cursor.execute("""INSERT INTO samples 
-                         (sample, project, subject, treatment_id, sample_type, 
-                          time_from_treatment_start, response) 
-                         VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                      (sample_data['sample'], sample_data['project'], 
-                       sample_data['subject'], treatment_id, sample_data['sample_type'],
-                       sample_data['time_from_treatment_start'], sample_data['response']))
-        
-        # Add cell counts
-        cursor.execute("""INSERT INTO cell_counts 
-                         (sample, b_cell, cd8_t_cell, cd4_t_cell, nk_cell, monocyte) 
-                         VALUES (?, ?, ?, ?, ?, ?)""",
-                      (sample_data['sample'], sample_data['b_cell'], 
-                       sample_data['cd8_t_cell'], sample_data['cd4_t_cell'],
-                       sample_data['nk_cell'], sample_data['monocyte']))
-        
-        conn.commit()
-        return True
-        
+        return execute_write(db_name, _add_sample, sample_data)
     except sqlite3.Error as e:
         print(f"Error adding sample: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
\ No newline at end of file
@@ -0,0 +1,363 @@
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import db
+
+try:
+    import duckdb
+except ImportError:  # optional: only needed when SAMPLES_DB_BACKEND=duckdb
+    duckdb = None
+
+# DuckDB backend: SQLite stays the transactional store (writes, running
+# statistics, snapshots) and a Parquet mirror of its tables, rebuilt whenever
+# the dataset version changes, serves the scans through DuckDB's vectorized,
+# multi-threaded engine. Mirrors live in samples_parquet/ next to samples.db.
+VERSION_FILE = 'VERSION'
+# Reads retried when another process swaps the mirror while they run
+MIRROR_READ_ATTEMPTS = 3
+
+# Whether DuckDB's sqlite extension loads (None until first tried)
+_sqlite_extension = None
+
+# Held while a mirror is rebuilt or read, so no read sees a half-swapped directory
+_mirror_lock = threading.Lock()
+
+# Aggregation results of the most recent mirror versions, like db's summary cache
+_result_cache = OrderedDict()
+_result_lock = threading.Lock()
+
+
+def _require_duckdb():
+    if duckdb is None:
+        raise ImportError("The duckdb backend needs the duckdb package: pip install duckdb")
+
+
+def mirror_dir(db_name):
+    """Directory holding the Parquet mirror of db_name (e.g. samples_parquet/ next to samples.db)"""
+    stem = os.path.splitext(os.path.abspath(db_name))[0]
+    return f"{stem}_parquet"
+
+
+def _mirror_version(db_name):
+    try:
+        with open(os.path.join(mirror_dir(db_name), VERSION_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _load_sqlite_extension(duck):
+    """Load DuckDB's sqlite extension into duck, installing it if needed; False when it is unavailable"""
+    global _sqlite_extension
+    if _sqlite_extension is False:
+        return False
+    try:
+        try:
+            duck.execute("LOAD sqlite")
+        except duckdb.Error:
+            duck.execute("INSTALL sqlite")
+            duck.execute("LOAD sqlite")
+    except duckdb.Error as e:
+        print(f"DuckDB sqlite extension unavailable, exporting through pandas: {e}")
+        _sqlite_extension = False
+        return False
+    _sqlite_extension = True
+    return True
+
+
+def _copy_tables_attached(duck, db_name, temp_directory):
+    """COPY every table straight from the attached SQLite file to Parquet; returns the version copied
+
+    DuckDB reads SQLite through its own connections, so the version is read
+    before and after the copy and the copy repeated if a write landed between.
+    """
+    path = os.path.abspath(db_name).replace("'", "''")
+    duck.execute(f"ATTACH '{path}' AS source (TYPE SQLITE, READ_ONLY)")
+    try:
+        for attempt in range(MIRROR_READ_ATTEMPTS):
+            version = db.get_dataset_version(db_name)
+            for table in db.DATA_TABLES:
+                duck.execute(f"COPY (SELECT * FROM source.{table}) "
+                             f"TO '{os.path.join(temp_directory, table)}.parquet' (FORMAT PARQUET)")
+            if db.get_dataset_version(db_name) == version:
+                return version
+    finally:
+        duck.execute("DETACH source")
+    raise RuntimeError(f"{db_name} kept changing while its Parquet mirror was exported")
+
+
+def _copy_tables_pandas(duck, db_name, temp_directory):
+    """Read every table through pandas in one SQLite read transaction and COPY it to Parquet"""
+    conn = db.connect(db_name)
+    try:
+        conn.execute("BEGIN")
+        version = db._read_dataset_version(conn)
+        for table in db.DATA_TABLES:
+            frame = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+            duck.register('frame', frame)
+            duck.execute(f"COPY frame TO '{os.path.join(temp_directory, table)}.parquet' (FORMAT PARQUET)")
+            duck.unregister('frame')
+    finally:
+        conn.close()
+    return version
+
+
+def _export_mirror(db_name):
+    """Copy every table out of SQLite into Parquet files, swapped in atomically
+
+    DuckDB scans the SQLite file itself through its sqlite extension; where
+    the extension cannot be loaded (e.g. offline) the tables go through
+    pandas instead. Either way the mirror matches a single dataset version.
+    """
+    directory = mirror_dir(db_name)
+    temp_directory = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(temp_directory)
+
+    try:
+        duck = duckdb.connect()
+        try:
+            if _load_sqlite_extension(duck):
+                version = _copy_tables_attached(duck, db_name, temp_directory)
+            else:
+                version = _copy_tables_pandas(duck, db_name, temp_directory)
+        finally:
+            duck.close()
+        with open(os.path.join(temp_directory, VERSION_FILE), 'w') as f:
+            f.write(version or '')
+    except BaseException:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+    # Move the old mirror aside first: a directory can only be replaced by rename when empty
+    old_directory = f"{temp_directory}.old"
+    if os.path.isdir(directory):
+        os.replace(directory, old_directory)
+    os.replace(temp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    return version
+
+
+def _refresh_mirror_locked(db_name):
+    version = db.get_dataset_version(db_name)
+    if _mirror_version(db_name) != (version or ''):
+        version = _export_mirror(db_name)
+    return version
+
+
+def refresh_mirror(db_name):
+    """Rebuild the Parquet mirror if the SQLite data changed since it was written
+
+    Returns the dataset version the mirror now holds.
+    """
+    with _mirror_lock:
+        return _refresh_mirror_locked(db_name)
+
+
+def _schema_views():
+    """CREATE VIEW statements of the SQLite schema (sample_totals, sample_percentages), for DuckDB
+
+    DuckDB's ROUND works on the binary double and rounds some ties down
+    (0.575 to 0.57), so the percentages are rewritten as integer division,
+    which gives SQLite's result (utils.percentage_hundredths) exactly.
+    """
+    with open(db.SCHEMA_FILE) as f:
+        views = re.findall(r"CREATE VIEW IF NOT EXISTS .*?;", f.read(), re.DOTALL)
+    return [re.sub(r"ROUND\(100\.0 \* (\w+) / total_count, 2\)",
+                   r"(20000 * \1 + total_count) // (2 * total_count) / 100.0", view) for view in views]
+
+
+def _query_mirror(db_name, query, key=None):
+    """Return query(duck) run on a DuckDB connection whose tables are views over the Parquet mirror
+
+    The mirror is refreshed and read under _mirror_lock, so this process
+    never swaps it mid-read, and the VERSION file is checked again afterwards
+    in case another process did; the read is then retried. The connection
+    also has the schema's sample_totals and sample_percentages views.
+    Returns (result, dataset version read); results with a key are memoized
+    per dataset version.
+    """
+    for attempt in range(MIRROR_READ_ATTEMPTS):
+        with _mirror_lock:
+            version = _refresh_mirror_locked(db_name)
+            cache_key = (os.path.abspath(db_name), version, key)
+            if key is not None and version is not None:
+                with _result_lock:
+                    if cache_key in _result_cache:
+                        _result_cache.move_to_end(cache_key)
+                        return _result_cache[cache_key], version
+            directory = mirror_dir(db_name)
+            duck = duckdb.connect()
+            try:
+                for table in db.DATA_TABLES:
+                    duck.execute(f"CREATE VIEW {table} AS "
+                                 f"SELECT * FROM read_parquet('{os.path.join(directory, table)}.parquet')")
+                for view in _schema_views():
+                    duck.execute(view)
+                result = query(duck)
+            except duckdb.IOException:
+                if attempt == MIRROR_READ_ATTEMPTS - 1:
+                    raise
+                continue
+            finally:
+                duck.close()
+        if _mirror_version(db_name) == (version or ''):
+            break
+    else:
+        raise RuntimeError(f"The Parquet mirror of {db_name} kept changing while it was read")
+    if key is not None and version is not None:
+        with _result_lock:
+            _result_cache[cache_key] = result
+            while len(_result_cache) > db.SUMMARY_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+    return result, version
+
+
+def database_exists(db_name):
+    return db.database_exists(db_name)
+
+
+def initialize_db(db_name, schema_file=db.SCHEMA_FILE):
+    if os.path.isdir(mirror_dir(db_name)):
+        shutil.rmtree(mirror_dir(db_name))
+    db.initialize_db(db_name, schema_file)
+
+
+def get_dataset_version(db_name, readonly=False):
+    return db.get_dataset_version(db_name, readonly)
+
+
+def load_data(db_name, readonly=False):
+    """Load all samples by running the joins in DuckDB over the Parquet mirror"""
+    _require_duckdb()
+    if readonly or not db.database_exists(db_name):
+        # Snapshots are immutable SQLite files and have no mirror
+        return db.load_data(db_name, readonly)
+
+    df, version = _query_mirror(db_name, lambda duck: duck.execute(db.LOAD_QUERY).df())
+    df.attrs['dataset_version'] = version
+    print(f"Retrieved {len(df)} rows from database")
+    return df
+
+
+def process_and_load_data(db_name, df, progress=None, cancel_event=None, content_hash=None):
+    """Load into SQLite, then build the mirror so the first read is fast"""
+    _require_duckdb()
+    loaded = db.process_and_load_data(db_name, df, progress=progress, cancel_event=cancel_event,
+                                      content_hash=content_hash)
+    if loaded:
+        refresh_mirror(db_name)
+    return loaded
+
+
+def append_data(db_name, df, progress=None, cancel_event=None):
+    """Append into SQLite, then refresh the mirror"""
+    _require_duckdb()
+    appended = db.append_data(db_name, df, progress=progress, cancel_event=cancel_event)
+    if appended:
+        refresh_mirror(db_name)
+    return appended
+
+
+def add_sample(db_name, sample_data):
+    return db.add_sample(db_name, sample_data)
+
+
+def remove_sample(db_name, table_name, sample_id):
+    return db.remove_sample(db_name, table_name, sample_id)
+
+
+def clear_database(db_name):
+    return db.clear_database(db_name)
+
+
+def get_loaded_hash(db_name, readonly=False):
+    return db.get_loaded_hash(db_name, readonly)
+
+
+def get_running_summary(db_name, dimension='all', readonly=False):
+    """Summary of sample percentages per group of dimension, aggregated by DuckDB over the mirror
+
+    Same columns as db.get_running_summary (group_value, population, n,
+    mean, std, min, max), with groups keyed the same way: '' for 'all' and
+    for missing values, other values as text.
+    """
+    _require_duckdb()
+    if readonly or not db.database_exists(db_name):
+        return db.get_running_summary(db_name, dimension, readonly)
+    if dimension not in db.RUNNING_STAT_DIMENSIONS:
+        return pd.DataFrame(columns=['group_value', 'population', 'n', 'mean', 'std', 'min', 'max'])
+
+    group_value = "''" if dimension == 'all' else f"COALESCE(CAST({dimension} AS VARCHAR), '')"
+    query = f"""
+        SELECT {group_value} AS group_value, population, COUNT(*) AS n, AVG(percentage) AS mean,
+               STDDEV_SAMP(percentage) AS std, MIN(percentage) AS min, MAX(percentage) AS max
+        FROM sample_percentages
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """
+    summary, _ = _query_mirror(db_name, lambda duck: duck.execute(query).df(), ('running_summary', dimension))
+    return summary
+
+
+def get_filter_options(db_name, readonly=False):
+    """Filter option values with per-option sample counts, counted by DuckDB over the mirror
+
+    Returns {dimension: DataFrame(value, sample_count)} like db.get_filter_options.
+    """
+    _require_duckdb()
+    if readonly or not db.database_exists(db_name):
+        return db.get_filter_options(db_name, readonly)
+
+    def count_options(duck):
+        duck.execute(f"CREATE TEMP TABLE sample_dimensions AS {db._SAMPLE_DIMENSIONS_SQL}")
+        return {dimension: duck.execute(
+                    f"""SELECT {dimension} AS value, COUNT(*) AS sample_count FROM sample_dimensions
+                        WHERE {dimension} IS NOT NULL GROUP BY 1 ORDER BY 1""").df()
+                for dimension in db.FILTER_DIMENSIONS}
+
+    options, _ = _query_mirror(db_name, count_options, ('filter_options',))
+    return options
+
+
+def get_percentage_summary(db_name, group_by=(), filters=None, readonly=False):
+    """Per-population percentage summary (see db.get_percentage_summary), aggregated by DuckDB over the mirror"""
+    _require_duckdb()
+    if readonly or not db.database_exists(db_name):
+        return db.get_percentage_summary(db_name, group_by, filters, readonly)
+
+    group_by, filters = db._summary_arguments(group_by, filters)
+    query, args = db._percentage_summary_query(group_by, filters)
+    key = ('percentage_summary', tuple(group_by), repr(sorted(filters.items())))
+    summary, _ = _query_mirror(
+        db_name, lambda duck: db._finish_percentage_summary(duck.execute(query, args).df(), group_by), key)
+    return summary
+
+
+def search_ids(db_name, kind, query, limit=db.SEARCH_LIMIT, readonly=False):
+    """Sample or subject IDs matching query, prefix matches first (see db.search_ids), searched by DuckDB"""
+    _require_duckdb()
+    if readonly or not db.database_exists(db_name):
+        return db.search_ids(db_name, kind, query, limit, readonly)
+
+    table, column = db.SEARCHABLE_IDS[kind]
+    query = query.lower()
+    order = f"ORDER BY lower({column}), {column} LIMIT ?"
+
+    def search(duck):
+        if not query:
+            return [row[0] for row in duck.execute(f"SELECT {column} FROM {table} {order}", [limit]).fetchall()]
+        matches = [row[0] for row in duck.execute(
+            f"SELECT {column} FROM {table} WHERE starts_with(lower({column}), ?) {order}", [query, limit]).fetchall()]
+        if len(matches) < limit:
+            matches += [row[0] for row in duck.execute(
+                f"SELECT {column} FROM {table} WHERE instr(lower({column}), ?) > 1 {order}",
+                [query, limit - len(matches)]).fetchall()]
+        return matches
+
+    matches, _ = _query_mirror(db_name, search)
+    return matches
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Columns the filter widgets select on; each gets one bitset per distinct value
+INDEXED_COLUMNS = ('condition', 'treatment', 'sample_type', 'time_from_treatment_start', 'response', 'project')
+
+
+class BitmapIndex:
+    """Packed bitsets (one bit per row) for every value of the filter columns
+
+    Built once per dataset version, after which any combination of filters
+    resolves with bitwise OR within a column and AND across columns, without
+    touching the frame. Rows with a missing value are in no bitset.
+    """
+
+    def __init__(self, frame, columns=INDEXED_COLUMNS):
+        self.n_rows = len(frame)
+        self.bitsets = {}
+        for column in columns:
+            if column not in frame.columns:
+                continue
+            codes, values = pd.factorize(frame[column], sort=True)
+            # One value at a time, so only a single row-length mask exists at once
+            self.bitsets[column] = {value: np.packbits(codes == code) for code, value in enumerate(values.tolist())}
+
+    def _empty(self):
+        return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def select(self, criteria):
+        """Bitset of the rows matching criteria, {column: allowed values}
+
+        A criterion of None means no restriction; values absent from the
+        data match nothing. Raises ValueError for a column that is not indexed.
+        """
+        selected = np.packbits(np.ones(self.n_rows, dtype=bool))
+        for column, values in criteria.items():
+            if values is None:
+                continue
+            if column not in self.bitsets:
+                raise ValueError(f"Column {column!r} is not in the bitmap index "
+                                 f"(indexed: {', '.join(self.bitsets) or 'none'})")
+            allowed = self._empty()
+            for value in values:
+                bitset = self.bitsets[column].get(value)
+                if bitset is not None:
+                    allowed |= bitset
+            selected &= allowed
+        return selected
+
+    def rows(self, criteria):
+        """Positions (for iloc/take) of the rows matching criteria, in frame order"""
+        return np.flatnonzero(np.unpackbits(self.select(criteria), count=self.n_rows))
+
+    def count(self, criteria):
+        return int(np.unpackbits(self.select(criteria), count=self.n_rows).sum())
+
+
+def select_rows(frame, rows=None):
+    """The rows of frame chosen by rows: None (every row), a boolean mask or positions
+
+    Keeping every row returns frame itself rather than a copy. Under
+    copy-on-write (always on from pandas 3, enabled by the app on pandas 2)
+    the shared frame stays read-only: a caller that modifies the result
+    copies it at that point. Subsets are marked as derived (see
+    get_bitmap_index).
+    """
+    if rows is None:
+        return frame
+    rows = np.asarray(rows)
+    if rows.dtype == bool:
+        return frame if rows.all() else mark_derived(frame[rows])
+    return frame if len(rows) == len(frame) else mark_derived(frame.iloc[rows])
+
+
+def mark_derived(frame):
+    """Flag frame as a subset or rearrangement of a loaded frame, whose attrs it inherits; returns frame"""
+    frame.attrs['derived'] = True
+    return frame
+
+
+# Indexes of the most recently used dataset versions (live data and a few
+# snapshots); frames without a version are indexed every time
+INDEX_CACHE_SIZE = 4
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_bitmap_index(frame):
+    """BitmapIndex of frame, reused while its dataset version and rows are unchanged
+
+    A frame as loaded is keyed by its dataset version and row count. Frames
+    marked as derived (mark_derived) inherit the version, so they are also
+    keyed by a hash of their sample IDs.
+    """
+    version = frame.attrs.get('dataset_version')
+    if version is None or 'sample' not in frame.columns:
+        return BitmapIndex(frame)
+    key = (version, len(frame))
+    if frame.attrs.get('derived'):
+        # Joining the IDs hashes several times faster than pd.util.hash_pandas_object
+        key += (hashlib.sha256('\0'.join(frame['sample'].astype(str).tolist()).encode()).hexdigest(),)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+    if index is None:
+        index = BitmapIndex(frame)
+        with _index_lock:
+            _index_cache[key] = index
+            while len(_index_cache) > INDEX_CACHE_SIZE:
+                _index_cache.popitem(last=False)
+    return index
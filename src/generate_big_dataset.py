@@ -3,9 +3,59 @@ import numpy as np
 import random
 from datetime import datetime
 
-# Set random seed for reproducibility
-np.random.seed(42)
-random.seed(42)
+# Response rate of tr1 in melanoma; other responding treatments by treatment alone
+MELANOMA_TR1_RESPONSE_RATE = 0.35
+RESPONSE_RATES = {'tr1': 0.25, 'tr2': 0.20, 'tr3': 0.15}
+DEFAULT_RESPONSE_RATE = 0.10
+
+# Baseline cell counts per profile: normal (mean, standard deviation) per
+# population, drawn in this order
+CELL_COUNT_DISTRIBUTIONS = {
+    # Responders might have different immune profiles
+    'melanoma_tr1_responder': {
+        'cd8_t_cell': (2800, 600),
+        'cd4_t_cell': (3200, 700),
+        'b_cell': (800, 200),
+        'nk_cell': (1200, 300),
+        'monocyte': (1800, 400)
+    },
+    # General melanoma population
+    'melanoma': {
+        'cd8_t_cell': (2200, 500),
+        'cd4_t_cell': (2800, 600),
+        'b_cell': (600, 150),
+        'nk_cell': (1000, 250),
+        'monocyte': (1500, 350)
+    },
+    # Healthy controls
+    'healthy': {
+        'cd8_t_cell': (1800, 400),
+        'cd4_t_cell': (2500, 500),
+        'b_cell': (700, 180),
+        'nk_cell': (800, 200),
+        'monocyte': (1200, 300)
+    },
+    # Other cancer types
+    'other_cancer': {
+        'cd8_t_cell': (2000, 450),
+        'cd4_t_cell': (2600, 550),
+        'b_cell': (650, 160),
+        'nk_cell': (900, 220),
+        'monocyte': (1400, 320)
+    }
+}
+# Counts are clamped to at least these after the time effect
+MIN_CELL_COUNTS = {'cd8_t_cell': 50, 'cd4_t_cell': 100, 'b_cell': 20, 'nk_cell': 30, 'monocyte': 40}
+
+
+def cell_count_profile(condition, treatment, response):
+    """Key of CELL_COUNT_DISTRIBUTIONS a sample's counts are drawn from"""
+    if condition == 'melanoma' and treatment == 'tr1' and response == 'y':
+        return 'melanoma_tr1_responder'
+    if condition in ('melanoma', 'healthy'):
+        return condition
+    return 'other_cancer'
+
 
 def generate_big_cell_counts_dataset(n_samples=500):
     """Generate a realistic fake dataset with multiple projects, conditions, and treatments"""
@@ -67,15 +117,9 @@ def generate_big_cell_counts_dataset(n_samples=500):
             if condition != 'healthy' and treatment not in ['placebo', 'standard_care']:
                 # Response rates vary by treatment and condition
                 if treatment == 'tr1' and condition == 'melanoma':
-                    response_prob = 0.35  # 35% response rate for tr1 in melanoma
-                elif treatment == 'tr1':
-                    response_prob = 0.25
-                elif treatment == 'tr2':
-                    response_prob = 0.20
-                elif treatment == 'tr3':
-                    response_prob = 0.15
+                    response_prob = MELANOMA_TR1_RESPONSE_RATE
                 else:
-                    response_prob = 0.10
+                    response_prob = RESPONSE_RATES.get(treatment, DEFAULT_RESPONSE_RATE)
                 
                 response = 'y' if random.random() < response_prob else 'n'
             else:
@@ -104,34 +148,8 @@ def generate_big_cell_counts_dataset(n_samples=500):
                 
                 # Generate realistic cell counts
                 # Base counts vary by condition and treatment
-                if condition == 'melanoma' and treatment == 'tr1' and response == 'y':
-                    # Responders might have different immune profiles
-                    base_cd8 = np.random.normal(2800, 600)
-                    base_cd4 = np.random.normal(3200, 700)
-                    base_b = np.random.normal(800, 200)
-                    base_nk = np.random.normal(1200, 300)
-                    base_mono = np.random.normal(1800, 400)
-                elif condition == 'melanoma':
-                    # General melanoma population
-                    base_cd8 = np.random.normal(2200, 500)
-                    base_cd4 = np.random.normal(2800, 600)
-                    base_b = np.random.normal(600, 150)
-                    base_nk = np.random.normal(1000, 250)
-                    base_mono = np.random.normal(1500, 350)
-                elif condition == 'healthy':
-                    # Healthy controls
-                    base_cd8 = np.random.normal(1800, 400)
-                    base_cd4 = np.random.normal(2500, 500)
-                    base_b = np.random.normal(700, 180)
-                    base_nk = np.random.normal(800, 200)
-                    base_mono = np.random.normal(1200, 300)
-                else:
-                    # Other cancer types
-                    base_cd8 = np.random.normal(2000, 450)
-                    base_cd4 = np.random.normal(2600, 550)
-                    base_b = np.random.normal(650, 160)
-                    base_nk = np.random.normal(900, 220)
-                    base_mono = np.random.normal(1400, 320)
+                distributions = CELL_COUNT_DISTRIBUTIONS[cell_count_profile(condition, treatment, response)]
+                base = {population: np.random.normal(mean, sd) for population, (mean, sd) in distributions.items()}
                 
                 # Add time-dependent effects
                 time_factor = 1.0
@@ -144,11 +162,9 @@ def generate_big_cell_counts_dataset(n_samples=500):
                         time_factor = 1.0 + (time_point / 168) * random.uniform(-0.2, 0.1)
                 
                 # Apply time factor and ensure positive counts
-                cd8_count = max(50, int(base_cd8 * time_factor))
-                cd4_count = max(100, int(base_cd4 * time_factor))
-                b_count = max(20, int(base_b * time_factor))
-                nk_count = max(30, int(base_nk * time_factor))
-                mono_count = max(40, int(base_mono * time_factor))
+                cd8_count, cd4_count, b_count, nk_count, mono_count = (
+                    max(MIN_CELL_COUNTS[population], int(base[population] * time_factor))
+                    for population in ['cd8_t_cell', 'cd4_t_cell', 'b_cell', 'nk_cell', 'monocyte'])
                 
                 # Add some sample-type specific variations
                 if sample_type == 'tumor':
@@ -191,67 +207,70 @@ def generate_big_cell_counts_dataset(n_samples=500):
     
     return df
 
-# Generate the dataset
-print("Generating big cell counts dataset...")
-big_dataset = generate_big_cell_counts_dataset(n_samples=500)
+if __name__ == '__main__':
+    # Set random seed for reproducibility
+    np.random.seed(42)
+    random.seed(42)
+    
+    # Generate the dataset
+    print("Generating big cell counts dataset...")
+    big_dataset = generate_big_cell_counts_dataset(n_samples=500)
 
-# Display summary statistics
-print(f"\nDataset Summary:")
-print(f"Total samples: {len(big_dataset)}")
-print(f"Unique subjects: {big_dataset['subject'].nunique()}")
-print(f"Projects: {big_dataset['project'].nunique()}")
-print(f"Conditions: {', '.join(big_dataset['condition'].unique())}")
-print(f"Treatments: {', '.join(big_dataset['treatment'].unique())}")
-print(f"Sample types: {', '.join(big_dataset['sample_type'].unique())}")
-print(f"Time points: {sorted(big_dataset['time_from_treatment_start'].unique())}")
+    # Display summary statistics
+    print(f"\nDataset Summary:")
+    print(f"Total samples: {len(big_dataset)}")
+    print(f"Unique subjects: {big_dataset['subject'].nunique()}")
+    print(f"Projects: {big_dataset['project'].nunique()}")
+    print(f"Conditions: {', '.join(big_dataset['condition'].unique())}")
+    print(f"Treatments: {', '.join(big_dataset['treatment'].unique())}")
+    print(f"Sample types: {', '.join(big_dataset['sample_type'].unique())}")
+    print(f"Time points: {sorted(big_dataset['time_from_treatment_start'].unique())}")
 
-# Show breakdown by key categories
-print(f"\nBreakdown by project:")
-print(big_dataset['project'].value_counts())
+    # Show breakdown by key categories
+    print(f"\nBreakdown by project:")
+    print(big_dataset['project'].value_counts())
 
-print(f"\nBreakdown by condition:")
-print(big_dataset['condition'].value_counts())
+    print(f"\nBreakdown by condition:")
+    print(big_dataset['condition'].value_counts())
 
-print(f"\nBreakdown by treatment:")
-print(big_dataset['treatment'].value_counts())
+    print(f"\nBreakdown by treatment:")
+    print(big_dataset['treatment'].value_counts())
 
-print(f"\nResponse rates (excluding empty responses):")
-response_data = big_dataset[big_dataset['response'].isin(['y', 'n'])]
-if len(response_data) > 0:
-    response_rate = (response_data['response'] == 'y').sum() / len(response_data) * 100
-    print(f"Overall response rate: {response_rate:.1f}%")
-    
-    # Response by treatment
-    print("\nResponse rates by treatment:")
-    for treatment in response_data['treatment'].unique():
-        treat_data = response_data[response_data['treatment'] == treatment]
-        if len(treat_data) > 0:
-            treat_response_rate = (treat_data['response'] == 'y').sum() / len(treat_data) * 100
-            print(f"  {treatment}: {treat_response_rate:.1f}% ({(treat_data['response'] == 'y').sum()}/{len(treat_data)})")
+    print(f"\nResponse rates (excluding empty responses):")
+    response_data = big_dataset[big_dataset['response'].isin(['y', 'n'])]
+    if len(response_data) > 0:
+        response_rate = (response_data['response'] == 'y').sum() / len(response_data) * 100
+        print(f"Overall response rate: {response_rate:.1f}%")
 
-# Save to CSV
-output_file = 'big-cell-counts.csv'
-big_dataset.to_csv(output_file, index=False)
-print(f"\nDataset saved to '{output_file}'")
+        # Response by treatment
+        print("\nResponse rates by treatment:")
+        for treatment in response_data['treatment'].unique():
+            treat_data = response_data[response_data['treatment'] == treatment]
+            if len(treat_data) > 0:
+                treat_response_rate = (treat_data['response'] == 'y').sum() / len(treat_data) * 100
+                print(f"  {treatment}: {treat_response_rate:.1f}% ({(treat_data['response'] == 'y').sum()}/{len(treat_data)})")
 
-# Display first few rows
-print(f"\nFirst 5 rows:")
-print(big_dataset.head())
+    # Save to CSV
+    output_file = 'big-cell-counts.csv'
+    big_dataset.to_csv(output_file, index=False)
+    print(f"\nDataset saved to '{output_file}'")
 
-# Show some statistics about the melanoma tr1 subset (for testing your response analysis)
-melanoma_tr1 = big_dataset[
-    (big_dataset['condition'] == 'melanoma') & 
-    (big_dataset['treatment'] == 'tr1') & 
-    (big_dataset['sample_type'] == 'PBMC')
-]
-print(f"\nMelanoma TR1 PBMC samples: {len(melanoma_tr1)}")
-if len(melanoma_tr1) > 0:
-    baseline_melanoma_tr1 = melanoma_tr1[melanoma_tr1['time_from_treatment_start'] == 0]
-    print(f"Baseline melanoma TR1 PBMC samples: {len(baseline_melanoma_tr1)}")
-    
-    melanoma_tr1_with_response = melanoma_tr1[melanoma_tr1['response'].isin(['y', 'n'])]
-    if len(melanoma_tr1_with_response) > 0:
-        responders = (melanoma_tr1_with_response['response'] == 'y').sum()
-        print(f"TR1 melanoma responders: {responders}/{len(melanoma_tr1_with_response)}")
+    # Display first few rows
+    print(f"\nFirst 5 rows:")
+    print(big_dataset.head())
+
+    # Show some statistics about the melanoma tr1 subset (for testing your response analysis)
+    melanoma_tr1 = big_dataset[
+        (big_dataset['condition'] == 'melanoma') & 
+        (big_dataset['treatment'] == 'tr1') & 
+        (big_dataset['sample_type'] == 'PBMC')
+    ]
+    print(f"\nMelanoma TR1 PBMC samples: {len(melanoma_tr1)}")
+    if len(melanoma_tr1) > 0:
+        baseline_melanoma_tr1 = melanoma_tr1[melanoma_tr1['time_from_treatment_start'] == 0]
+        print(f"Baseline melanoma TR1 PBMC samples: {len(baseline_melanoma_tr1)}")
 
-        
\ No newline at end of file
+        melanoma_tr1_with_response = melanoma_tr1[melanoma_tr1['response'].isin(['y', 'n'])]
+        if len(melanoma_tr1_with_response) > 0:
+            responders = (melanoma_tr1_with_response['response'] == 'y').sum()
+            print(f"TR1 melanoma responders: {responders}/{len(melanoma_tr1_with_response)}")
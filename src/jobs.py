@@ -0,0 +1,131 @@
+import io
+import itertools
+import threading
+import time
+
+import pandas as pd
+
+from db import process_and_load_data, IngestCancelled
+
+PARSE_CHUNK_SIZE = 50000
+
+# Latest ingest job per database, shared by every session in this process so a
+# browser refresh can pick up a load that is still running
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_ids = itertools.count(1)
+
+
+class IngestJob:
+    """Handle for a database load running on a background thread
+
+    source is a DataFrame, a CSV path or the raw bytes of an uploaded CSV;
+    loader is the function that writes it (db.process_and_load_data, or the
+    sharded layout's equivalent). Progress is exposed through rows_parsed/rows_written/total_rows and
+    status ('pending', 'running', 'done', 'failed' or 'cancelled'). content_hash, if
+    given, identifies the uploaded file so the loader can skip or diff it.
+    """
+
+    def __init__(self, db_name, source, loader=process_and_load_data, content_hash=None):
+        self.job_id = next(_job_ids)
+        self.db_name = db_name
+        self.source = source
+        self.loader = loader
+        self.content_hash = content_hash
+        self.status = 'pending'
+        self.rows_parsed = 0
+        self.rows_written = 0
+        self.total_rows = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-{self.job_id}", daemon=True)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    @property
+    def fraction_complete(self):
+        if self.status == 'done':
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return self.rows_written / self.total_rows
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Request cancellation; the load is rolled back at the next chunk boundary"""
+        self._cancel_event.set()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        return self.finished
+
+    def _parse(self):
+        if isinstance(self.source, pd.DataFrame):
+            self.rows_parsed = len(self.source)
+            return self.source
+
+        source = io.BytesIO(self.source) if isinstance(self.source, bytes) else self.source
+        chunks = []
+        for chunk in pd.read_csv(source, chunksize=PARSE_CHUNK_SIZE):
+            if self._cancel_event.is_set():
+                raise IngestCancelled()
+            chunks.append(chunk)
+            self.rows_parsed += len(chunk)
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    def _on_progress(self, rows_written, total_rows):
+        self.rows_written = rows_written
+        self.total_rows = total_rows
+
+    def _run(self):
+        self.status = 'running'
+        self.started_at = time.time()
+        try:
+            data = self._parse()
+            self.total_rows = len(data)
+            if self.loader(self.db_name, data, progress=self._on_progress,
+                           cancel_event=self._cancel_event, content_hash=self.content_hash):
+                self.status = 'done'
+            else:
+                self.error = "Error loading data into database."
+                self.status = 'failed'
+        except IngestCancelled:
+            self.status = 'cancelled'
+        except Exception as e:
+            self.error = str(e)
+            self.status = 'failed'
+        finally:
+            self.finished_at = time.time()
+
+
+def start_ingest_job(db_name, source, loader=process_and_load_data, content_hash=None):
+    """Start loading source into db_name in the background and return the job
+
+    Raises RuntimeError if a load into the same database is still running.
+    """
+    with _jobs_lock:
+        current = _jobs.get(db_name)
+        if current is not None and not current.finished:
+            raise RuntimeError("A data load is already running for this database.")
+        job = IngestJob(db_name, source, loader, content_hash)
+        _jobs[db_name] = job
+    return job.start()
+
+
+def get_ingest_job(db_name):
+    """Most recent ingest job for db_name (running or finished), or None"""
+    with _jobs_lock:
+        return _jobs.get(db_name)
@@ -0,0 +1,298 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import db
+from utils import CELL_COUNT_COLUMNS, percentage_hundredths
+
+# Out-of-core mode: when the joined frame would not fit in the memory budget,
+# samples are streamed from SQLite in chunks and folded into mergeable partial
+# aggregates instead of being loaded. Set ANALYSIS_MEMORY_BUDGET_MB to change
+# the budget.
+MEMORY_BUDGET_MB = float(os.environ.get('ANALYSIS_MEMORY_BUDGET_MB', 2048))
+CHUNK_SIZE = 50000
+ESTIMATE_SAMPLE_ROWS = 1000
+
+# Columns the aggregates are kept by; any grouping or filter over them can be
+# answered by summing the matching combinations
+AGGREGATE_COLUMNS = ('project', 'condition', 'treatment', 'sample_type', 'time_from_treatment_start',
+                     'response', 'sex')
+# Groupings that also keep a full histogram of percentages, for exact medians
+MEDIAN_GROUPINGS = ((), ('project',), ('treatment',), ('condition',))
+
+# Percentages are rounded to 2 decimals in [0, 100], so integer hundredths
+# give exact sums and one histogram bin per possible value
+HUNDREDTHS = 100
+PERCENTAGE_BINS = 100 * HUNDREDTHS + 1
+
+
+def estimate_frame_bytes(db_name, readonly=False):
+    """Estimated memory of load_data's frame: rows times the size per row of a small sample"""
+    if not os.path.exists(db_name):
+        return 0
+    conn = db.connect(db_name, readonly=readonly)
+    try:
+        n_samples = conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+        if n_samples == 0:
+            return 0
+        sample = pd.read_sql_query(f"{db.LOAD_QUERY} LIMIT {ESTIMATE_SAMPLE_ROWS}", conn)
+    except (sqlite3.Error, pd.errors.DatabaseError):
+        return 0
+    finally:
+        conn.close()
+    return int(sample.memory_usage(deep=True).sum() / len(sample) * n_samples)
+
+
+def exceeds_memory_budget(db_names, budget_mb=MEMORY_BUDGET_MB, readonly=False):
+    """Whether loading every database in db_names (e.g. all shards) would exceed the budget"""
+    return sum(estimate_frame_bytes(name, readonly) for name in db_names) > budget_mb * 1e6
+
+
+def iter_sample_chunks(db_name, chunk_size=CHUNK_SIZE, readonly=False):
+    """Yield load_data's rows in chunks of chunk_size, all read from one snapshot of the database"""
+    conn = db.connect(db_name, readonly=readonly)
+    try:
+        conn.execute("BEGIN")  # one read transaction, so every chunk sees the same version
+        yield from pd.read_sql_query(db.LOAD_QUERY, conn, chunksize=chunk_size)
+    finally:
+        conn.close()
+
+
+def _percentage_hundredths(chunk):
+    """Per-sample population percentages of a chunk, as integer hundredths of a percent"""
+    return percentage_hundredths(chunk[CELL_COUNT_COLUMNS].to_numpy(dtype=float))
+
+
+def _columns(statistic):
+    return [f"{statistic}_{population}" for population in CELL_COUNT_COLUMNS]
+
+
+ADDITIVE_COLUMNS = ['n'] + _columns('sum') + _columns('sumsq')
+
+
+class PartialAggregates:
+    """Mergeable aggregates of population percentages, built chunk by chunk
+
+    For every combination of AGGREGATE_COLUMNS values it keeps the sample
+    count and, per population, the sum, sum of squares, minimum and maximum
+    of the percentages in integer hundredths, so means, variances, cross-tabs
+    and two-sample test statistics for any grouping or filter are exact.
+    Groupings in MEDIAN_GROUPINGS also keep a histogram per group and
+    population for exact medians. Two aggregates (e.g. of different shards
+    or chunks) merge by addition.
+    """
+
+    def __init__(self):
+        self.cells = None
+        self.histograms = {grouping: {} for grouping in MEDIAN_GROUPINGS}
+
+    def update(self, chunk):
+        """Fold one chunk of load_data rows into the aggregates"""
+        if chunk.empty:
+            return self
+        hundredths = _percentage_hundredths(chunk)
+        values = pd.DataFrame(hundredths, columns=CELL_COUNT_COLUMNS, index=chunk.index)
+        keys = [chunk[column] for column in AGGREGATE_COLUMNS]
+
+        grouped = values.groupby(keys, dropna=False, sort=False)
+        cells = pd.concat([
+            grouped.size().rename('n'),
+            grouped.sum().add_prefix('sum_'),
+            (values ** 2).groupby(keys, dropna=False, sort=False).sum().add_prefix('sumsq_'),
+            grouped.min().add_prefix('min_'),
+            grouped.max().add_prefix('max_')
+        ], axis=1)
+        self._merge_cells(cells)
+
+        for grouping in MEDIAN_GROUPINGS:
+            self._update_histograms(grouping, chunk, hundredths)
+        return self
+
+    def _update_histograms(self, grouping, chunk, hundredths):
+        if grouping:
+            present = chunk[list(grouping)].notna().all(axis=1).to_numpy()
+            group_index, group_keys = pd.MultiIndex.from_frame(chunk.loc[present, list(grouping)]).factorize()
+            hundredths = hundredths[present]
+        else:
+            group_index, group_keys = np.zeros(len(chunk), dtype=np.int64), [()]
+        n_populations = len(CELL_COUNT_COLUMNS)
+        bins = ((group_index[:, None] * n_populations + np.arange(n_populations)) * PERCENTAGE_BINS
+                + hundredths)
+        counts = np.bincount(bins.ravel(), minlength=len(group_keys) * n_populations * PERCENTAGE_BINS)
+        counts = counts.reshape(len(group_keys), n_populations, PERCENTAGE_BINS)
+        histograms = self.histograms[grouping]
+        for key, histogram in zip(group_keys, counts):
+            if key in histograms:
+                histograms[key] += histogram
+            else:
+                histograms[key] = histogram
+
+    def _merge_cells(self, cells):
+        if self.cells is None:
+            self.cells = cells
+            return
+        grouped = pd.concat([self.cells, cells]).groupby(
+            level=list(range(len(AGGREGATE_COLUMNS))), dropna=False, sort=False)
+        self.cells = pd.concat([
+            grouped[ADDITIVE_COLUMNS].sum(),
+            grouped[_columns('min')].min(),
+            grouped[_columns('max')].max()
+        ], axis=1)
+
+    def merge(self, other):
+        """Add another PartialAggregates (e.g. of another shard) into this one"""
+        if other.cells is not None:
+            self._merge_cells(other.cells)
+        for grouping, histograms in other.histograms.items():
+            for key, histogram in histograms.items():
+                if key in self.histograms[grouping]:
+                    self.histograms[grouping][key] = self.histograms[grouping][key] + histogram
+                else:
+                    self.histograms[grouping][key] = histogram.copy()
+        return self
+
+    def _select(self, filters):
+        cells = self.cells.reset_index(names=list(AGGREGATE_COLUMNS))
+        for column, values in (filters or {}).items():
+            if values is not None:
+                cells = cells[cells[column].isin(values)]
+        return cells
+
+    @property
+    def n_samples(self):
+        return self.count()
+
+    def count(self, filters=None):
+        """Number of samples matching filters ({column: allowed values})"""
+        return 0 if self.cells is None else int(self._select(filters)['n'].sum())
+
+    def moments(self, group_by=(), filters=None):
+        """n, mean, var (ddof=1), min and max of each population's percentage per group
+
+        Indexed by group_by + [population], sorted; samples missing a
+        grouping value are left out. filters is {column: allowed values}.
+        """
+        group_by = list(group_by)
+        columns = ['n', 'mean', 'var', 'min', 'max']
+        cells = pd.DataFrame(columns=list(AGGREGATE_COLUMNS) + ADDITIVE_COLUMNS + _columns('min') + _columns('max'))
+        if self.cells is not None:
+            cells = self._select(filters).dropna(subset=group_by)
+        if group_by:
+            grouped = cells.groupby(group_by, sort=True)
+            totals = grouped[ADDITIVE_COLUMNS].sum()
+            lowest, highest = grouped[_columns('min')].min(), grouped[_columns('max')].max()
+            keys = totals.index.to_frame(index=False)
+        else:
+            totals = cells[ADDITIVE_COLUMNS].sum().to_frame().T
+            lowest, highest = cells[_columns('min')].min().to_frame().T, cells[_columns('max')].max().to_frame().T
+            keys = pd.DataFrame(index=range(1))
+
+        n = totals['n'].to_numpy(dtype=float)[:, None]
+        sums, squares = totals[_columns('sum')].to_numpy(dtype=float), totals[_columns('sumsq')].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / n
+            var = np.where(n > 1, (squares - sums * mean) / np.maximum(n - 1, 1), np.nan)
+
+        n_populations = len(CELL_COUNT_COLUMNS)
+        index = keys.loc[keys.index.repeat(n_populations)].reset_index(drop=True)
+        index['population'] = np.tile(CELL_COUNT_COLUMNS, len(keys))
+        frame = pd.DataFrame({
+            'n': np.repeat(n[:, 0], n_populations),
+            'mean': (mean / HUNDREDTHS).ravel(),
+            'var': (np.maximum(var, 0) / HUNDREDTHS ** 2).ravel(),
+            'min': (lowest.to_numpy(dtype=float) / HUNDREDTHS).ravel(),
+            'max': (highest.to_numpy(dtype=float) / HUNDREDTHS).ravel()
+        }, index=pd.MultiIndex.from_frame(index) if group_by else pd.Index(index['population']))
+        frame = frame[frame['n'] > 0][columns]
+        frame['n'] = frame['n'].astype(np.int64)
+        return frame.sort_index()
+
+    def summary(self, group_by=(), filters=None):
+        """Per-group n, mean, std, min, max and median, shaped like db.get_percentage_summary
+
+        filters is {column: allowed values}, as for moments. The median is
+        exact for MEDIAN_GROUPINGS as long as every filtered column is also
+        grouped by (histograms are kept per group, not per filter), and NaN
+        otherwise.
+        """
+        group_by = list(group_by)
+        summary = self.moments(group_by, filters)
+        summary['std'] = np.sqrt(summary['var'])
+        histograms = self.histograms.get(tuple(group_by))
+        if any(values is not None and column not in group_by for column, values in (filters or {}).items()):
+            histograms = None
+        medians = []
+        for key in summary.index:
+            key = key if isinstance(key, tuple) else (key,)
+            group_key, population = key[:-1], key[-1]
+            if histograms is None or group_key not in histograms:
+                medians.append(np.nan)
+            else:
+                medians.append(_histogram_median(histograms[group_key][CELL_COUNT_COLUMNS.index(population)]))
+        summary['median'] = medians
+        return summary.reset_index()[group_by + ['population', 'n', 'mean', 'std', 'min', 'max', 'median']]
+
+    def filter_options(self):
+        """Values of every aggregate column with their sample counts, like db.count_dimension_values
+
+        Returns {column: DataFrame(value, sample_count)} sorted by value;
+        missing values are not options.
+        """
+        options = {}
+        for column in AGGREGATE_COLUMNS:
+            counts = (self.cells.groupby(level=column)['n'].sum() if self.cells is not None
+                      else pd.Series(dtype=np.int64))
+            options[column] = pd.DataFrame({'value': counts.index.to_numpy(), 'sample_count': counts.to_numpy()})
+        return options
+
+    def crosstab(self, index, columns, filters=None):
+        """Sample counts by the values of two aggregate columns (missing values included)"""
+        cells = self._select(filters)
+        return cells.groupby([index, columns], dropna=False)['n'].sum().unstack(fill_value=0)
+
+
+def _histogram_median(histogram):
+    """Median percentage from a histogram of hundredths (mean of the two middle values when even)"""
+    n = histogram.sum()
+    if n == 0:
+        return np.nan
+    cumulative = np.cumsum(histogram)
+    lower = np.searchsorted(cumulative, (n + 1) // 2)
+    upper = np.searchsorted(cumulative, n // 2 + 1)
+    return (lower + upper) / 2 / HUNDREDTHS
+
+
+# Aggregates of the latest versions streamed, keyed by (path, version) of every database
+_aggregate_cache = {}
+_aggregate_lock = threading.Lock()
+
+
+def aggregate_databases(db_names, chunk_size=CHUNK_SIZE, readonly=False, progress=None):
+    """Stream every database in db_names (one file, or all shards) into one PartialAggregates
+
+    Never holds more than one chunk of rows. Results are memoized while the
+    databases' versions are unchanged. progress, if given, is called with the
+    number of samples read so far.
+    """
+    key = tuple((os.path.abspath(name), db.get_dataset_version(name, readonly)) for name in db_names)
+    with _aggregate_lock:
+        cached = _aggregate_cache.get(key)
+    if cached is not None and all(version is not None for _, version in key):
+        return cached
+
+    aggregates = PartialAggregates()
+    samples_read = 0
+    for name in db_names:
+        for chunk in iter_sample_chunks(name, chunk_size, readonly):
+            aggregates.update(chunk)
+            samples_read += len(chunk)
+            if progress is not None:
+                progress(samples_read)
+
+    with _aggregate_lock:
+        _aggregate_cache.clear()
+        _aggregate_cache[key] = aggregates
+    return aggregates
@@ -0,0 +1,189 @@
+"""Performance checks for the app's startup path
+
+Run from the repository root:
+
+    python src/perf_checks.py            # import-time report for every startup module
+    python src/perf_checks.py --check    # also fail if a lazily imported library loads at startup
+    python src/perf_checks.py --memory samples.db [--check]   # peak memory of one analysis rerun
+
+--check without --memory also measures a rerun on a generated database of
+CHECK_SAMPLES samples and fails if it exceeds the memory budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules loaded when the app or a headless script starts
+STARTUP_MODULES = ['app', 'analysis', 'db', 'jobs', 'backends', 'filter_index', 'out_of_core']
+
+# Libraries that must only be imported once a chart or statistical test needs them
+# (Streamlit itself loads plotly.graph_objects, so only plotly.express is ours to defer)
+LAZY_LIBRARIES = ['plotly.express', 'scipy', 'duckdb']
+
+# Peak memory one rerun's analyses may allocate, in copies of the loaded dataset:
+# the long-format frequency table (one row per sample and population, labels
+# stored as categorical codes) is about 0.9 copies, plus the wide percentage
+# matrix and the transients of building both
+RERUN_MEMORY_BUDGET = 2.0
+# Size of the generated database --check measures
+CHECK_SAMPLES = 20000
+
+# Arrow memory pools created to measure reruns. Buffers do not keep their pool
+# alive, so the pools must outlive every buffer allocated from them.
+_arrow_pools = []
+
+
+def measure_imports(module):
+    """Import module in a fresh interpreter with -X importtime
+
+    Returns one (name, self_ms, cumulative_ms) tuple per imported module, in
+    import order.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return imports
+
+
+def startup_report(module, top=5):
+    """Total import time, slowest modules (by self time) and lazy libraries loaded eagerly"""
+    imports = measure_imports(module)
+    total_ms = next(cumulative for name, _, cumulative in imports if name == module)
+    slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:top]
+    eager = [library for library in LAZY_LIBRARIES
+             if any(name == library or name.startswith(f"{library}.") for name, _, _ in imports)]
+    return {'module': module, 'total_ms': total_ms, 'slowest': slowest, 'eager_libraries': eager}
+
+
+def build_check_database(db_name, n_samples=CHECK_SAMPLES):
+    """Write a database of n_samples generated samples (generate_big_dataset's cohort, repeated under new IDs)"""
+    import pandas as pd
+    import db
+    from generate_big_dataset import generate_big_cell_counts_dataset
+
+    cohort = generate_big_cell_counts_dataset(n_samples)
+    copies = -(-n_samples // len(cohort))
+    data = pd.concat([cohort.assign(sample=cohort['sample'] + f"_{copy}", subject=cohort['subject'] + f"_{copy}")
+                      for copy in range(copies)], ignore_index=True).head(n_samples)
+    db.initialize_db(db_name, db.SCHEMA_FILE)
+    if not db.process_and_load_data(db_name, data):
+        raise RuntimeError(f"Could not load the generated samples into {db_name}")
+
+
+def rerun_memory(db_name, project=None, condition=None, readonly=False):
+    """Peak memory allocated by the analyses of one app rerun
+
+    Loads db_name, then runs the computations behind the analysis tabs for
+    the given filters (frequencies, group comparisons, the responder
+    comparison and the baseline cohort breakdown) with the result cache off,
+    so every step really runs. readonly=True opens snapshots (immutable
+    files); live databases must be read normally to see their WAL. Returns
+    the dataset's size and the peak allocation during the rerun, in bytes.
+
+    The peak is tracemalloc's (NumPy and Python objects) plus the peak of
+    Arrow buffers (pandas' pyarrow-backed string columns), which tracemalloc
+    does not see; adding the two peaks never undercounts.
+    """
+    import tracemalloc
+    os.environ['ANALYSIS_CACHE_MB'] = '0'
+    import analysis
+    from db import load_data
+    from filter_index import get_bitmap_index, select_rows
+    try:
+        import pyarrow
+    except ImportError:  # without pyarrow pandas keeps strings as Python objects, which tracemalloc sees
+        pyarrow = None
+
+    data = load_data(db_name, readonly=readonly)
+    data_bytes = int(data.memory_usage(deep=True).sum())
+    import scipy.stats  # noqa: F401  (lazy imports happen once per process, not per rerun)
+
+    if pyarrow is not None:
+        previous_pool = pyarrow.default_memory_pool()
+        arrow_pool = pyarrow.proxy_memory_pool(previous_pool)  # counts only the rerun's Arrow allocations
+        _arrow_pools.append(arrow_pool)
+        pyarrow.set_memory_pool(arrow_pool)
+    tracemalloc.start()
+    rows = None
+    if project is not None or condition is not None:
+        rows = get_bitmap_index(data).rows({
+            'project': None if project is None else [project],
+            'condition': None if condition is None else [condition]
+        })
+    select_rows(data, rows)
+    analysis.calculate_cell_frequencies(data, rows)
+    for column in ('treatment', 'condition', 'project'):
+        analysis.compare_groups(data, [column], rows)
+    cohort = analysis.response_cohort_rows(data, rows)
+    analysis.calculate_cell_frequencies(data, cohort)
+    analysis.compare_responders(analysis.calculate_frequency_matrix(data, cohort),
+                                data['response'].iloc[cohort].eq('y').to_numpy())
+    analysis.compute_cohort_breakdown(analysis.select_cohort(data, 'melanoma', 'PBMC', 'tr1', 0))
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if pyarrow is not None:
+        pyarrow.set_memory_pool(previous_pool)
+        peak_bytes += arrow_pool.max_memory()
+    return data_bytes, peak_bytes
+
+
+def report_memory(db_name, project=None, condition=None, readonly=False):
+    """Print one rerun's peak memory on db_name; returns whether it is within RERUN_MEMORY_BUDGET"""
+    data_bytes, peak_bytes = rerun_memory(db_name, project, condition, readonly)
+    copies = peak_bytes / data_bytes
+    print(f"dataset: {data_bytes / 1e6:.1f} MB  rerun peak: {peak_bytes / 1e6:.1f} MB "
+          f"({copies:.2f} copies, budget {RERUN_MEMORY_BUDGET})")
+    return copies <= RERUN_MEMORY_BUDGET
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=STARTUP_MODULES, help="modules to measure")
+    parser.add_argument('--top', type=int, default=5, help="slowest imports to list per module")
+    parser.add_argument('--check', action='store_true',
+                        help="exit with status 1 if a lazy library is imported at startup "
+                             "(with --memory: if a rerun exceeds the memory budget)")
+    parser.add_argument('--memory', metavar='DB',
+                        help="measure the peak memory of one analysis rerun on database DB instead")
+    parser.add_argument('--project', help="project filter for --memory")
+    parser.add_argument('--condition', help="condition filter for --memory")
+    parser.add_argument('--snapshot', action='store_true', help="with --memory: DB is a snapshot file")
+    args = parser.parse_args()
+
+    if args.memory:
+        if not report_memory(args.memory, args.project, args.condition, args.snapshot) and args.check:
+            sys.exit(1)
+        return
+
+    failed = False
+    for module in args.modules:
+        report = startup_report(module, args.top)
+        print(f"{module}: {report['total_ms']:.0f} ms")
+        for name, self_ms, cumulative_ms in report['slowest']:
+            print(f"    {self_ms:8.1f} ms self  {cumulative_ms:8.1f} ms total  {name}")
+        if report['eager_libraries']:
+            failed = True
+            print(f"    imported at startup: {', '.join(report['eager_libraries'])}")
+
+    if args.check:
+        with tempfile.TemporaryDirectory() as directory:
+            check_db = os.path.join(directory, 'check.db')
+            build_check_database(check_db)
+            failed = not report_memory(check_db) or failed
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Power simulator: how many tr1 melanoma PBMC subjects a new cohort needs
+
+Run from the repository root:
+
+    python src/power.py                                    # the dataset generator's distributions
+    python src/power.py --subjects 10 20 40 80 --response-rate 0.25 0.35
+    python src/power.py --db samples.db --trials 5000      # distributions fitted from the database
+
+Every design point (number of subjects, responder rate) is simulated as
+n_trials cohorts at once: one baseline PBMC sample per subject, with cell
+counts drawn as NumPy arrays, turned into population percentages and tested
+with the Response Prediction tab's t-test (utils.responder_t_test) in one
+vectorized call. Design points run in parallel worker processes. Power is
+the share of cohorts in which a population's p-value is below alpha.
+"""
+import argparse
+import itertools
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from generate_big_dataset import CELL_COUNT_DISTRIBUTIONS, MELANOMA_TR1_RESPONSE_RATE, MIN_CELL_COUNTS
+from utils import CELL_COUNT_COLUMNS, responder_t_test, sample_percentages
+
+# The samples the Response Prediction tab compares
+RESPONSE_COHORT = {'condition': 'melanoma', 'treatment': 'tr1', 'sample_type': 'PBMC'}
+
+DEFAULT_SUBJECT_COUNTS = [10, 20, 40, 80, 160]
+DEFAULT_TRIALS = 2000
+DEFAULT_ALPHA = 0.05
+DEFAULT_TARGET_POWER = 0.8
+# Simulated counts held at once per design point (trials are run in batches of this many values)
+BATCH_VALUES = 5_000_000
+
+
+def generator_distributions():
+    """Responder and non-responder cell count distributions of generate_big_dataset.py
+
+    Returns {'responder'/'non_responder': {population: (mean, sd)},
+    'min_count': {population: floor}, 'response_rate': rate}.
+    """
+    return {
+        'responder': CELL_COUNT_DISTRIBUTIONS['melanoma_tr1_responder'],
+        'non_responder': CELL_COUNT_DISTRIBUTIONS['melanoma'],
+        'min_count': MIN_CELL_COUNTS,
+        'response_rate': MELANOMA_TR1_RESPONSE_RATE
+    }
+
+
+def fit_distributions(data):
+    """Normal cell count distributions fitted to the RESPONSE_COHORT samples of a loaded frame
+
+    Same shape as generator_distributions(); counts are floored at 0 and the
+    response rate is the observed share of responders. Raises ValueError
+    unless both groups have at least two samples.
+    """
+    cohort = data[data['response'].isin(['y', 'n'])]
+    for column, value in RESPONSE_COHORT.items():
+        cohort = cohort[cohort[column] == value]
+    groups = cohort.groupby('response')[CELL_COUNT_COLUMNS]
+    sizes = groups.size()
+    if sizes.get('y', 0) < 2 or sizes.get('n', 0) < 2:
+        raise ValueError("Fitting needs at least two responders and two non-responders "
+                         "among the melanoma tr1 PBMC samples")
+    means, sds = groups.mean(), groups.std()
+    return {
+        'responder': {population: (means.loc['y', population], sds.loc['y', population])
+                      for population in CELL_COUNT_COLUMNS},
+        'non_responder': {population: (means.loc['n', population], sds.loc['n', population])
+                          for population in CELL_COUNT_COLUMNS},
+        'min_count': {population: 0 for population in CELL_COUNT_COLUMNS},
+        'response_rate': sizes['y'] / sizes.sum()
+    }
+
+
+def simulate_design(n_subjects, response_rate, distributions, n_trials=DEFAULT_TRIALS, alpha=DEFAULT_ALPHA,
+                    seed=None):
+    """Power of the responder comparison for one design point (runs in a worker process)
+
+    Simulates n_trials cohorts of n_subjects, each a responder with
+    probability response_rate, and returns one row per population with the
+    power, its standard error and the mean Cohen's d. Cohorts with fewer
+    than two subjects in either group cannot be tested and count as misses.
+    """
+    rng = np.random.default_rng(seed)
+    groups = ['non_responder', 'responder']
+    means = np.array([[distributions[group][population][0] for population in CELL_COUNT_COLUMNS]
+                      for group in groups])
+    sds = np.array([[distributions[group][population][1] for population in CELL_COUNT_COLUMNS]
+                    for group in groups])
+    floors = np.array([distributions['min_count'][population] for population in CELL_COUNT_COLUMNS])
+    n_populations = len(CELL_COUNT_COLUMNS)
+
+    detected = np.zeros(n_populations)
+    effect_sum, effect_n = np.zeros(n_populations), np.zeros(n_populations)
+    batch_size = max(1, BATCH_VALUES // (n_subjects * n_populations))
+    for start in range(0, n_trials, batch_size):
+        size = min(batch_size, n_trials - start)
+        # (trials, subjects) responder flags and (trials, subjects, populations) counts
+        is_responder = rng.random((size, n_subjects)) < response_rate
+        group = is_responder.astype(np.intp)
+        counts = np.maximum(floors, np.trunc(rng.normal(means[group], sds[group])))
+        percentages = sample_percentages(counts.reshape(-1, n_populations)).reshape(counts.shape)
+
+        # Per-cohort moments of each group, from sums and sums of squares
+        responder = is_responder[:, :, None]
+        n_r = is_responder.sum(axis=1, keepdims=True).astype(float)
+        n_n = n_subjects - n_r
+        sum_r = np.where(responder, percentages, 0).sum(axis=1)
+        sum_n = percentages.sum(axis=1) - sum_r
+        squares = percentages ** 2
+        sumsq_r = np.where(responder, squares, 0).sum(axis=1)
+        sumsq_n = squares.sum(axis=1) - sumsq_r
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_r, mean_n = sum_r / n_r, sum_n / n_n
+            var_r = np.maximum(sumsq_r - sum_r * mean_r, 0) / (n_r - 1)
+            var_n = np.maximum(sumsq_n - sum_n * mean_n, 0) / (n_n - 1)
+
+        _, p_value, cohens_d = responder_t_test(n_r, mean_r, var_r, n_n, mean_n, var_n)
+        testable = (n_r >= 2) & (n_n >= 2)
+        detected += ((p_value < alpha) & testable).sum(axis=0)
+        effect_sum += np.where(testable, cohens_d, 0).sum(axis=0)
+        effect_n += np.broadcast_to(testable, cohens_d.shape).sum(axis=0)
+
+    power = detected / n_trials
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_d = np.where(effect_n > 0, effect_sum / effect_n, np.nan)
+    return pd.DataFrame({
+        'n_subjects': n_subjects,
+        'response_rate': response_rate,
+        'population': CELL_COUNT_COLUMNS,
+        'power': power,
+        'power_se': np.sqrt(power * (1 - power) / n_trials),
+        'mean_cohens_d': mean_d
+    })
+
+
+def power_curve(subject_counts=DEFAULT_SUBJECT_COUNTS, response_rates=None, distributions=None,
+                n_trials=DEFAULT_TRIALS, alpha=DEFAULT_ALPHA, seed=None, max_workers=None):
+    """Power per population for every (subject count, response rate) design point
+
+    distributions defaults to generator_distributions() and response_rates
+    to its response rate. Design points are simulated in parallel processes,
+    each with its own random stream derived from seed, so results are
+    reproducible for a given seed whatever the number of workers.
+    """
+    distributions = distributions or generator_distributions()
+    if response_rates is None:
+        response_rates = [distributions['response_rate']]
+    points = list(itertools.product(subject_counts, response_rates))
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    arguments = ([n for n, _ in points], [rate for _, rate in points], [distributions] * len(points),
+                 [n_trials] * len(points), [alpha] * len(points), seeds)
+
+    if len(points) <= 1 or max_workers == 1:
+        results = list(map(simulate_design, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(simulate_design, *arguments))
+    if not results:
+        return pd.DataFrame(columns=['n_subjects', 'response_rate', 'population', 'power', 'power_se',
+                                     'mean_cohens_d'])
+    return pd.concat(results, ignore_index=True)
+
+
+def required_subjects(curve, target_power=DEFAULT_TARGET_POWER):
+    """Smallest simulated subject count reaching target_power, per response rate and population (NaN if none)"""
+    reached = curve[curve['power'] >= target_power]
+    smallest = reached.groupby(['response_rate', 'population'])['n_subjects'].min()
+    index = pd.MultiIndex.from_product([sorted(curve['response_rate'].unique()), CELL_COUNT_COLUMNS],
+                                       names=['response_rate', 'population'])
+    return smallest.reindex(index).unstack('population')[CELL_COUNT_COLUMNS].astype('Int64')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subjects', type=int, nargs='+', default=DEFAULT_SUBJECT_COUNTS,
+                        help=f"cohort sizes to simulate (default: {' '.join(map(str, DEFAULT_SUBJECT_COUNTS))})")
+    parser.add_argument('--response-rate', type=float, nargs='+',
+                        help="responder rates to simulate (default: the distributions' rate)")
+    parser.add_argument('--db', help="fit the distributions to this database instead of the generator's")
+    parser.add_argument('--trials', type=int, default=DEFAULT_TRIALS,
+                        help=f"simulated cohorts per design point (default: {DEFAULT_TRIALS})")
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA,
+                        help=f"significance level (default: {DEFAULT_ALPHA})")
+    parser.add_argument('--target-power', type=float, default=DEFAULT_TARGET_POWER,
+                        help=f"power the required cohort size must reach (default: {DEFAULT_TARGET_POWER})")
+    parser.add_argument('--seed', type=int, help="random seed, for reproducible curves")
+    parser.add_argument('--workers', type=int, help="simulation processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    distributions = generator_distributions()
+    if args.db:
+        from backends import get_backend
+        try:
+            distributions = fit_distributions(get_backend().load_data(args.db))
+        except (KeyError, ValueError) as e:
+            print(f"Cannot fit distributions to {args.db}: {e}")
+            sys.exit(1)
+
+    started = time.perf_counter()
+    curve = power_curve(args.subjects, args.response_rate, distributions, args.trials, args.alpha, args.seed,
+                        args.workers)
+    elapsed = time.perf_counter() - started
+
+    print(curve.pivot_table(index=['response_rate', 'n_subjects'], columns='population', values='power')
+          [CELL_COUNT_COLUMNS].round(3).to_string())
+    print(f"\nSubjects needed for {args.target_power:.0%} power (blank: more than simulated):")
+    print(required_subjects(curve, args.target_power).to_string(na_rep=''))
+    n_points = len(curve) // len(CELL_COUNT_COLUMNS)
+    print(f"\n{n_points} design points x {args.trials:,} trials in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
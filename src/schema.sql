@@ -1,30 +1,24 @@
 PRAGMA foreign_keys = ON;
 
--- Drop existing tables in reverse order of dependencies
-DROP TABLE IF EXISTS cell_counts;
-DROP TABLE IF EXISTS samples;
-DROP TABLE IF EXISTS treatments;
-DROP TABLE IF EXISTS subjects;
-DROP TABLE IF EXISTS projects;
-
--- Create tables in order of dependencies
-CREATE TABLE projects (
+-- Create tables in order of dependencies (idempotent, so it can be
+-- re-applied to an existing database before a load)
+CREATE TABLE IF NOT EXISTS projects (
     project TEXT PRIMARY KEY
 );
 
-CREATE TABLE subjects (
+CREATE TABLE IF NOT EXISTS subjects (
     subject TEXT PRIMARY KEY,
     age INTEGER,
     sex TEXT CHECK (sex IN ('M', 'F')),
     condition TEXT
 );
 
-CREATE TABLE treatments (
+CREATE TABLE IF NOT EXISTS treatments (
     treatment_id INTEGER PRIMARY KEY AUTOINCREMENT,
     treatment TEXT UNIQUE NOT NULL
 );
 
-CREATE TABLE samples (
+CREATE TABLE IF NOT EXISTS samples (
     sample TEXT PRIMARY KEY,
     project TEXT,
     subject TEXT,
@@ -37,7 +31,7 @@ CREATE TABLE samples (
     FOREIGN KEY (treatment_id) REFERENCES treatments(treatment_id)
 );
 
-CREATE TABLE cell_counts (
+CREATE TABLE IF NOT EXISTS cell_counts (
     sample TEXT,
     b_cell INTEGER,
     cd8_t_cell INTEGER,
@@ -45,4 +39,104 @@ CREATE TABLE cell_counts (
     nk_cell INTEGER,
     monocyte INTEGER,
     FOREIGN KEY (sample) REFERENCES samples(sample)
-);
\ No newline at end of file
+);
+
+-- Deleting a sample checks cell_counts for rows still referring to it; without
+-- this index every deleted sample scans the whole table
+CREATE INDEX IF NOT EXISTS idx_cell_counts_sample ON cell_counts (sample);
+
+-- Case-insensitive indexes for the type-ahead ID search (prefix range scans)
+CREATE INDEX IF NOT EXISTS idx_samples_sample_nocase ON samples (sample COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_subjects_subject_nocase ON subjects (subject COLLATE NOCASE);
+
+-- Random token replaced on every write, so caches can tell dataset versions apart
+CREATE TABLE IF NOT EXISTS dataset_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    token TEXT NOT NULL
+);
+
+INSERT OR IGNORE INTO dataset_version (id, token) VALUES (1, lower(hex(randomblob(8))));
+
+-- Content hashes for incremental reloads: the file the data was last loaded
+-- from (cleared by any other write, so an identical re-upload is only skipped
+-- while the data still matches it) and every sample's row, so a changed file
+-- only rewrites the samples whose row hash differs
+CREATE TABLE IF NOT EXISTS loaded_file (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    content_hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sample_hashes (
+    sample TEXT PRIMARY KEY,
+    row_hash INTEGER NOT NULL
+);
+
+-- Running aggregates of per-sample population percentages, per group
+-- (dimension 'all' has a single group ''), updated in O(1) on every add/remove.
+-- m2 is Welford's sum of squared deviations; min/max are flagged stale when a
+-- removal may have taken away an extreme and are recomputed on next read.
+CREATE TABLE IF NOT EXISTS running_stats (
+    dimension TEXT NOT NULL,
+    group_value TEXT NOT NULL,
+    population TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    total REAL NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    min REAL,
+    max REAL,
+    extremes_stale INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, group_value, population)
+);
+
+-- Filter options (distinct values of each filter dimension) with the number of
+-- samples having each value, maintained with the data. value has no declared
+-- type so numbers (time points) keep their type.
+CREATE TABLE IF NOT EXISTS dimension_counts (
+    dimension TEXT NOT NULL,
+    value NOT NULL,
+    sample_count INTEGER NOT NULL,
+    PRIMARY KEY (dimension, value)
+);
+
+-- Per-sample cell totals and, in long format (one row per sample and
+-- population), percentages rounded like the app's frequency table; group
+-- summaries are aggregated from these in SQL (db.get_percentage_summary)
+CREATE VIEW IF NOT EXISTS sample_totals AS
+SELECT s.sample, s.project, s.subject, sub.sex, sub.condition, t.treatment, s.sample_type,
+       s.time_from_treatment_start, s.response,
+       COALESCE(c.b_cell, 0) AS b_cell, COALESCE(c.cd8_t_cell, 0) AS cd8_t_cell,
+       COALESCE(c.cd4_t_cell, 0) AS cd4_t_cell, COALESCE(c.nk_cell, 0) AS nk_cell,
+       COALESCE(c.monocyte, 0) AS monocyte,
+       COALESCE(c.b_cell, 0) + COALESCE(c.cd8_t_cell, 0) + COALESCE(c.cd4_t_cell, 0)
+           + COALESCE(c.nk_cell, 0) + COALESCE(c.monocyte, 0) AS total_count
+FROM samples s
+JOIN subjects sub ON s.subject = sub.subject
+JOIN treatments t ON s.treatment_id = t.treatment_id
+LEFT JOIN cell_counts c ON s.sample = c.sample;
+
+CREATE VIEW IF NOT EXISTS sample_percentages AS
+SELECT sample, project, subject, sex, condition, treatment, sample_type,
+       time_from_treatment_start, response, total_count, 'b_cell' AS population, b_cell AS count,
+       CASE WHEN total_count > 0 THEN ROUND(100.0 * b_cell / total_count, 2) ELSE 0 END AS percentage
+FROM sample_totals
+UNION ALL
+SELECT sample, project, subject, sex, condition, treatment, sample_type,
+       time_from_treatment_start, response, total_count, 'cd8_t_cell' AS population, cd8_t_cell AS count,
+       CASE WHEN total_count > 0 THEN ROUND(100.0 * cd8_t_cell / total_count, 2) ELSE 0 END AS percentage
+FROM sample_totals
+UNION ALL
+SELECT sample, project, subject, sex, condition, treatment, sample_type,
+       time_from_treatment_start, response, total_count, 'cd4_t_cell' AS population, cd4_t_cell AS count,
+       CASE WHEN total_count > 0 THEN ROUND(100.0 * cd4_t_cell / total_count, 2) ELSE 0 END AS percentage
+FROM sample_totals
+UNION ALL
+SELECT sample, project, subject, sex, condition, treatment, sample_type,
+       time_from_treatment_start, response, total_count, 'nk_cell' AS population, nk_cell AS count,
+       CASE WHEN total_count > 0 THEN ROUND(100.0 * nk_cell / total_count, 2) ELSE 0 END AS percentage
+FROM sample_totals
+UNION ALL
+SELECT sample, project, subject, sex, condition, treatment, sample_type,
+       time_from_treatment_start, response, total_count, 'monocyte' AS population, monocyte AS count,
+       CASE WHEN total_count > 0 THEN ROUND(100.0 * monocyte / total_count, 2) ELSE 0 END AS percentage
+FROM sample_totals;
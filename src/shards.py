@@ -0,0 +1,322 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import db
+
+# Optional layout with one SQLite file per project (samples_shards/<project>.db
+# next to samples.db). Every function mirrors the db function of the same name,
+# so callers can switch layouts by switching modules. Each shard has its own
+# writer thread, so loads into different projects run concurrently.
+SHARD_SUFFIX = '.db'
+SHARD_WORKERS = None  # thread pool size for fan-out (None: Python's default)
+
+
+def shard_dir(db_name):
+    """Directory holding the shards of db_name (e.g. samples_shards/ next to samples.db)"""
+    stem = os.path.splitext(os.path.abspath(db_name))[0]
+    return f"{stem}_shards"
+
+
+def shard_path(db_name, project):
+    r"""Path of a project's shard, one distinct file per project name
+
+    Names made only of [\w.-] are used as they are. Other characters are
+    replaced by '_' and a short hash of the original name is appended, so
+    e.g. "A B" and "A_B" get different files.
+    """
+    project = str(project)
+    name = re.sub(r'[^\w.-]', '_', project)
+    if name != project:
+        name = f"{name}-{hashlib.sha256(project.encode()).hexdigest()[:8]}"
+    return os.path.join(shard_dir(db_name), f"{name}{SHARD_SUFFIX}")
+
+
+def list_shards(db_name):
+    """Paths of every shard of db_name, sorted by name"""
+    directory = shard_dir(db_name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry.path for entry in os.scandir(directory) if entry.name.endswith(SHARD_SUFFIX))
+
+
+def _fan_out(function, shards, max_workers=SHARD_WORKERS):
+    """Call function(shard) for every shard in a thread pool; results in shard order"""
+    if len(shards) <= 1:
+        return [function(shard) for shard in shards]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, shards))
+
+
+def _commit_together(load, projects):
+    """Call load(project, before_commit) for every project so their shards commit all or none
+
+    Each shard's load holds its transaction open in before_commit until every
+    other shard's rows are written too. A load that fails or is cancelled
+    breaks the barrier, and the others then roll back instead of committing.
+    Results in project order.
+    """
+    barrier = threading.Barrier(max(len(projects), 1))
+
+    def run(project):
+        prepared = []
+
+        def before_commit():
+            prepared.append(project)
+            barrier.wait()
+
+        try:
+            result = load(project, before_commit)
+        except BaseException:
+            barrier.abort()
+            raise
+        if not result:
+            barrier.abort()
+        elif not prepared:
+            # The shard was already up to date; the others still wait for it
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+        return result
+
+    # Every load must be running at once to reach the barrier
+    return _fan_out(run, list(projects), max_workers=len(projects))
+
+
+def _remove_shard(path):
+    for file in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def database_exists(db_name):
+    return os.path.isdir(shard_dir(db_name))
+
+
+def initialize_db(db_name, schema_file=db.SCHEMA_FILE):
+    """Remove every shard and start an empty sharded layout"""
+    for path in list_shards(db_name):
+        _remove_shard(path)
+    os.makedirs(shard_dir(db_name), exist_ok=True)
+    print(f"Sharded database {shard_dir(db_name)} initialized")
+
+
+def get_dataset_version(db_name, readonly=False):
+    """Combined version token of all shards (changes when any shard is written)"""
+    shards = list_shards(db_name)
+    if not shards:
+        return None
+    tokens = _fan_out(lambda shard: db.get_dataset_version(shard, readonly), shards)
+    payload = '|'.join(f"{os.path.basename(shard)}:{token}" for shard, token in zip(shards, tokens))
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def load_data(db_name, readonly=False, projects=None):
+    """Load every shard (or only the given projects) in parallel and merge the rows"""
+    shards = list_shards(db_name)
+    if projects is not None:
+        wanted = {shard_path(db_name, project) for project in projects}
+        shards = [shard for shard in shards if shard in wanted]
+    if not shards:
+        print(f"Sharded database {shard_dir(db_name)} has no shards")
+        return pd.DataFrame()
+
+    frames = dict(zip(shards, _fan_out(lambda shard: db.load_data(shard, readonly), shards)))
+    frames = {shard: frame for shard, frame in frames.items() if not frame.empty}
+    if not frames:
+        return pd.DataFrame()
+
+    data = pd.concat(frames.values(), ignore_index=True).sort_values('sample', ignore_index=True)
+    payload = '|'.join(f"{os.path.basename(shard)}:{frame.attrs.get('dataset_version')}"
+                       for shard, frame in frames.items())
+    data.attrs['dataset_version'] = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    return data
+
+
+def get_loaded_hash(db_name, readonly=False):
+    """Content hash of the file every shard was last loaded from, or None if they differ or were written since"""
+    hashes = set(_fan_out(lambda shard: db.get_loaded_hash(shard, readonly), list_shards(db_name)))
+    return hashes.pop() if len(hashes) == 1 else None
+
+
+def load_project(db_name, project, df, progress=None, cancel_event=None, content_hash=None,
+                 before_commit=None):
+    """Replace one project's shard with df (rows of that project only)"""
+    path = shard_path(db_name, project)
+    os.makedirs(shard_dir(db_name), exist_ok=True)
+    return db.process_and_load_data(path, df, progress=progress, cancel_event=cancel_event,
+                                    content_hash=content_hash, before_commit=before_commit)
+
+
+def process_and_load_data(db_name, df, progress=None, cancel_event=None, content_hash=None):
+    """Split df by project and load every shard concurrently
+
+    Each shard's load is one transaction and the shards commit only once
+    every load has written its rows, so a failed or cancelled load leaves
+    every project's previous data intact. Shards of projects no longer in df
+    are removed once every load has succeeded. Every shard records the whole
+    file's content_hash, so re-loading an unchanged file is skipped and a
+    changed one only rewrites the changed samples of each shard.
+    """
+    if content_hash is None:
+        content_hash = db.frame_hash(df)
+    if content_hash == get_loaded_hash(db_name):
+        print("Data unchanged since the last load, skipped")
+        return True
+    projects = {project: rows for project, rows in df.groupby('project', sort=True)}
+    written = {project: 0 for project in projects}
+    progress_lock = threading.Lock()
+
+    def load(project, before_commit):
+        def shard_progress(rows_written, _):
+            with progress_lock:
+                written[project] = rows_written
+                if progress is not None:
+                    progress(sum(written.values()), len(df))
+        return load_project(db_name, project, projects[project], shard_progress, cancel_event, content_hash,
+                            before_commit)
+
+    results = _commit_together(load, projects)
+    if not all(results):
+        return False
+
+    keep = {shard_path(db_name, project) for project in projects}
+    for path in list_shards(db_name):
+        if path not in keep:
+            _remove_shard(path)
+    print(f"Loaded {len(df)} samples into {len(projects)} shards")
+    return True
+
+
+def append_data(db_name, df, progress=None, cancel_event=None):
+    """Split df by project and append to every shard concurrently
+
+    Like process_and_load_data the shards commit all or none, so a failed
+    append leaves every shard unchanged. Returns the number of samples added
+    (0 on error).
+    """
+    projects = {project: rows for project, rows in df.groupby('project', sort=True)}
+    written = {project: 0 for project in projects}
+    progress_lock = threading.Lock()
+    os.makedirs(shard_dir(db_name), exist_ok=True)
+
+    def append(project, before_commit):
+        def shard_progress(rows_written, _):
+            with progress_lock:
+                written[project] = rows_written
+                if progress is not None:
+                    progress(sum(written.values()), len(df))
+        return db.append_data(shard_path(db_name, project), projects[project], shard_progress, cancel_event,
+                              before_commit)
+
+    counts = _commit_together(append, projects)
+    return sum(counts) if all(counts) else 0
+
+
+def clear_shard(db_name, project):
+    """Delete one project's data, leaving the other shards untouched"""
+    return db.clear_database(shard_path(db_name, project))
+
+
+def clear_database(db_name):
+    return all(_fan_out(db.clear_database, list_shards(db_name)))
+
+
+def add_sample(db_name, sample_data):
+    """Add a sample to its project's shard, creating the shard if needed"""
+    if any(_fan_out(lambda shard: _has_sample(shard, sample_data['sample']), list_shards(db_name))):
+        print(f"Sample {sample_data['sample']} already exists")
+        return False
+    os.makedirs(shard_dir(db_name), exist_ok=True)
+    return db.add_sample(shard_path(db_name, sample_data['project']), sample_data)
+
+
+def _has_sample(shard, sample_id):
+    conn = db.connect(shard)
+    try:
+        return conn.execute("SELECT 1 FROM samples WHERE sample = ?", (sample_id,)).fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def remove_sample(db_name, table_name, sample_id):
+    """Remove a sample from whichever shard holds it"""
+    shards = list_shards(db_name)
+    found = _fan_out(lambda shard: _has_sample(shard, sample_id), shards)
+    holders = [shard for shard, has_sample in zip(shards, found) if has_sample]
+    return bool(holders) and all(db.remove_sample(shard, table_name, sample_id) for shard in holders)
+
+
+def get_filter_options(db_name, readonly=False):
+    """Merge every shard's filter options, summing the per-option sample counts"""
+    shard_options = [options for options in _fan_out(lambda shard: db.get_filter_options(shard, readonly),
+                                                     list_shards(db_name)) if options is not None]
+    if not shard_options:
+        return None
+    return {dimension: pd.concat([options[dimension] for options in shard_options])
+                .groupby('value', as_index=False, sort=True)['sample_count'].sum()
+            for dimension in db.FILTER_DIMENSIONS}
+
+
+def search_ids(db_name, kind, query, limit=db.SEARCH_LIMIT, readonly=False):
+    """Search every shard and keep the best limit matches (prefix matches first, then by ID)"""
+    found = _fan_out(lambda shard: db.search_ids(shard, kind, query, limit, readonly), list_shards(db_name))
+    matches = sorted({match for shard_matches in found for match in shard_matches},
+                     key=lambda match: (not match.lower().startswith(query.lower()), match.lower()))
+    return matches[:limit]
+
+
+def get_percentage_summary(db_name, group_by=(), filters=None, readonly=False):
+    """Percentage summary from the shards, when it does not need merging medians
+
+    Every shard holds one project, so summaries grouped by project, or
+    restricted to a single project, are exact concatenations of shard
+    summaries. Other combinations return None (callers then aggregate the
+    loaded samples).
+    """
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    shards = list_shards(db_name)
+    projects = (filters or {}).get('project')
+    if projects is not None:
+        wanted = {shard_path(db_name, project) for project in projects}
+        shards = [shard for shard in shards if shard in wanted]
+    if len(shards) > 1 and 'project' not in group_by:
+        return None
+
+    summaries = _fan_out(lambda shard: db.get_percentage_summary(shard, group_by, filters, readonly), shards)
+    if any(summary is None for summary in summaries):
+        return None
+    if not summaries:
+        return pd.DataFrame(columns=group_by + ['population', 'n', 'mean', 'std', 'min', 'max', 'median'])
+    return pd.concat(summaries, ignore_index=True).sort_values(group_by + ['population'], ignore_index=True)
+
+
+def get_running_summary(db_name, dimension='all', readonly=False):
+    """Merge every shard's running statistics (Chan et al. parallel mean/variance)"""
+    summaries = _fan_out(lambda shard: db.get_running_summary(shard, dimension, readonly), list_shards(db_name))
+    summaries = [summary for summary in summaries if not summary.empty]
+    if not summaries:
+        return pd.DataFrame()
+
+    combined = pd.concat(summaries, ignore_index=True)
+    combined['m2'] = (combined['std'] ** 2 * (combined['n'] - 1)).fillna(0)
+    combined['total'] = combined['mean'] * combined['n']
+    grouped = combined.groupby(['group_value', 'population'], sort=True)
+    merged = grouped.agg(n=('n', 'sum'), total=('total', 'sum'), min=('min', 'min'), max=('max', 'max'))
+    merged['mean'] = merged['total'] / merged['n']
+
+    # Pooled sum of squares: within-shard m2 plus each shard mean's spread around the merged mean
+    spread = combined['n'] * (combined['mean'] - merged['mean'].reindex(
+        pd.MultiIndex.from_frame(combined[['group_value', 'population']])).to_numpy()) ** 2
+    m2 = (combined['m2'] + spread).groupby([combined['group_value'], combined['population']]).sum()
+    merged['std'] = np.sqrt(m2 / (merged['n'] - 1)).where(merged['n'] > 1)
+    return merged.reset_index()[['group_value', 'population', 'n', 'mean', 'std', 'min', 'max']]
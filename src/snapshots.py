@@ -0,0 +1,80 @@
+import os
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+from db import connect
+
+SNAPSHOT_SUFFIX = '.db'
+
+
+def snapshot_dir(db_name):
+    """Directory holding the snapshots of db_name (e.g. samples_snapshots/ next to samples.db)"""
+    stem = os.path.splitext(os.path.abspath(db_name))[0]
+    return f"{stem}_snapshots"
+
+
+def snapshot_path(db_name, name):
+    return os.path.join(snapshot_dir(db_name), f"{name}{SNAPSHOT_SUFFIX}")
+
+
+def create_snapshot(db_name, name=None):
+    """Copy the current database into a named, read-only snapshot
+
+    Uses the SQLite online backup API, so the copy is consistent even while
+    other sessions are writing. Returns the snapshot name.
+    """
+    if not os.path.exists(db_name):
+        raise FileNotFoundError(f"Database {db_name} does not exist")
+
+    name = name.strip() if name else time.strftime('%Y%m%d-%H%M%S')
+    if not re.fullmatch(r'[\w.-]+', name):
+        raise ValueError("Snapshot names may only contain letters, digits, '.', '-' and '_'.")
+
+    path = snapshot_path(db_name, name)
+    if os.path.exists(path):
+        raise FileExistsError(f"Snapshot '{name}' already exists.")
+    os.makedirs(snapshot_dir(db_name), exist_ok=True)
+
+    # Back up into a temporary file and rename, so a half-written snapshot is never visible
+    temp_path = f"{path}.tmp"
+    source = connect(db_name)
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target)
+        # Snapshots are single self-contained files, opened later as immutable
+        target.execute("PRAGMA journal_mode = DELETE")
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+    os.replace(temp_path, path)
+
+    print(f"Snapshot {name} created at {path}")
+    return name
+
+
+def list_snapshots(db_name):
+    """Snapshots of db_name, newest first, with creation time and size"""
+    directory = snapshot_dir(db_name)
+    if not os.path.isdir(directory):
+        return pd.DataFrame(columns=['name', 'created', 'size_mb'])
+
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith(SNAPSHOT_SUFFIX)]
+    snapshots = pd.DataFrame({
+        'name': [entry.name[:-len(SNAPSHOT_SUFFIX)] for entry in entries],
+        'created': pd.to_datetime([entry.stat().st_mtime for entry in entries], unit='s'),
+        'size_mb': [round(entry.stat().st_size / 1e6, 2) for entry in entries]
+    })
+    return snapshots.sort_values('created', ascending=False).reset_index(drop=True)
+
+
+def delete_snapshot(db_name, name):
+    """Delete a snapshot; returns False if it did not exist"""
+    path = snapshot_path(db_name, name)
+    if not os.path.exists(path):
+        return False
+    os.remove(path)
+    return True
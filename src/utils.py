@@ -1,17 +1,149 @@
+import numpy as np
+import pandas as pd
+
+CELL_COUNT_COLUMNS = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
+ID_COLUMNS = ['sample', 'project', 'subject', 'condition', 'treatment']
+REQUIRED_COLUMNS = ID_COLUMNS + ['age', 'sex', 'sample_type', 'time_from_treatment_start',
+                                 'response'] + CELL_COUNT_COLUMNS
+SUBJECT_COLUMNS = ['age', 'sex', 'condition']
+VALID_SEXES = ['M', 'F']
+VALID_RESPONSES = ['y', 'n']
+
+def percentage_hundredths(counts):
+    """Per-row population percentages of a 2-D array of cell counts, as integer hundredths of a percent
+
+    Rounded half away from zero on the exact count ratio, which is what
+    SQLite's ROUND(100.0 * count / total, 2) in the schema views gives, so
+    percentages computed in NumPy and in SQL agree to the last digit.
+    Missing counts count as 0, and samples without cells get 0.
+    """
+    counts = np.nan_to_num(np.asarray(counts, dtype=float)).astype(np.int64)
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.where(totals > 0, (20000 * counts + totals) // np.maximum(2 * totals, 1), 0)
+
+def sample_percentages(counts):
+    """Per-row population percentages of a 2-D array of cell counts (rounded like calculate_cell_frequencies)"""
+    return percentage_hundredths(counts) / 100
+
+def responder_t_test(n_r, mean_r, var_r, n_n, mean_n, var_n):
+    """t statistics, p-values and Cohen's d from group moments, for arrays of any (broadcastable) shape
+
+    The test behind analysis.compare_responder_moments; power.py runs it on
+    thousands of simulated trials at once.
+    """
+    from scipy import stats
+    
+    # Student's t-test with the pooled variance, as scipy.stats.ttest_ind
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled_var = ((n_r - 1) * var_r + (n_n - 1) * var_n) / (n_r + n_n - 2)
+        t_stat = (mean_r - mean_n) / np.sqrt(pooled_var * (1 / n_r + 1 / n_n))
+        p_value = 2 * stats.t.sf(np.abs(t_stat), n_r + n_n - 2)
+    
+    # Effect size (Cohen's d) from the pooled standard deviation
+    pooled_std = np.sqrt(pooled_var)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cohens_d = np.where(pooled_std > 0, (mean_r - mean_n) / pooled_std, 0.0)
+    return t_stat, p_value, cohens_d
+
 def read_csv(file):
-    import pandas as pd
     try:
         data = pd.read_csv(file)
         return data
     except Exception as e:
         return str(e)
 
+def find_validation_errors(data, seen_samples=None, seen_subjects=None):
+    """Check one chunk of ingest data against every rule using vectorized masks
+
+    Returns a dict mapping rule name to the offending row indices (index labels
+    of data). Only failing rules are included. seen_samples (set of sample IDs)
+    and seen_subjects (DataFrame of subject attributes indexed by subject) carry
+    state from earlier chunks so uniqueness and subject consistency hold across
+    a whole file; pass them to validate_chunks rather than managing them by hand.
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in data.columns]
+    if missing:
+        return {f"missing column: {column}": np.array([], dtype=int) for column in missing}
+
+    masks = {}
+
+    for column in ID_COLUMNS:
+        masks[f"missing {column}"] = data[column].isna() | (data[column].astype(str).str.strip() == '')
+
+    # Numeric columns: anything present that does not parse as a number is a dtype error
+    numeric = {}
+    for column in ['age', 'time_from_treatment_start'] + CELL_COUNT_COLUMNS:
+        numeric[column] = pd.to_numeric(data[column], errors='coerce')
+        masks[f"non-numeric {column}"] = numeric[column].isna() & data[column].notna()
+
+    counts = pd.DataFrame({column: numeric[column] for column in CELL_COUNT_COLUMNS})
+    masks['missing cell count'] = counts.isna().any(axis=1) & ~pd.concat(
+        [masks[f"non-numeric {column}"] for column in CELL_COUNT_COLUMNS], axis=1).any(axis=1)
+    masks['negative cell count'] = (counts < 0).any(axis=1)
+    masks['non-integer cell count'] = (counts.notna() & (counts % 1 != 0)).any(axis=1)
+    masks['age out of range'] = (numeric['age'] < 0) | (numeric['age'] > 120)
+    masks['negative time_from_treatment_start'] = numeric['time_from_treatment_start'] < 0
+
+    masks['invalid sex (expected M/F)'] = data['sex'].notna() & ~data['sex'].isin(VALID_SEXES)
+    masks['invalid response (expected y/n/empty)'] = (
+        data['response'].notna() & ~data['response'].isin(VALID_RESPONSES + [''])
+    )
+
+    # Uniqueness: duplicate sample IDs within this chunk or against earlier chunks
+    masks['duplicate sample ID'] = data['sample'].duplicated(keep=False)
+    if seen_samples:
+        masks['duplicate sample ID'] |= data['sample'].isin(seen_samples)
+
+    # Subject-level consistency: one age/sex/condition per subject
+    for column in SUBJECT_COLUMNS:
+        conflict = data.groupby('subject')[column].transform('nunique') > 1
+        if seen_subjects is not None and not seen_subjects.empty:
+            previous = data['subject'].map(seen_subjects[column])
+            conflict |= previous.notna() & data[column].notna() & (previous != data[column])
+        masks[f"conflicting {column} for subject"] = conflict
+
+    return {rule: data.index[mask.to_numpy()].to_numpy() for rule, mask in masks.items() if mask.any()}
+
+def validate_chunks(chunks):
+    """Validate an iterable of DataFrame chunks (e.g. pd.read_csv(..., chunksize=...))
+
+    Returns (errors, n_rows) where errors maps each failing rule to all
+    offending row indices across chunks.
+    """
+    errors = {}
+    seen_samples = set()
+    seen_subjects = pd.DataFrame(columns=SUBJECT_COLUMNS)
+    n_rows = 0
+
+    for chunk in chunks:
+        n_rows += len(chunk)
+        for rule, rows in find_validation_errors(chunk, seen_samples, seen_subjects).items():
+            errors[rule] = np.concatenate([errors[rule], rows]) if rule in errors else rows
+        if any(rule.startswith('missing column') for rule in errors):
+            break
+
+        seen_samples.update(chunk['sample'].dropna().tolist())
+        first_seen = chunk.drop_duplicates('subject').set_index('subject')[SUBJECT_COLUMNS]
+        seen_subjects = pd.concat([seen_subjects, first_seen[~first_seen.index.isin(seen_subjects.index)]])
+
+    return errors, n_rows
+
+def summarize_validation_errors(errors, max_examples=10):
+    """Compact per-rule summary: rule, number of offending rows and example row indices"""
+    return pd.DataFrame({
+        'rule': list(errors),
+        'rows_affected': [len(rows) for rows in errors.values()],
+        'example_rows': [', '.join(str(row) for row in rows[:max_examples]) for rows in errors.values()]
+    })
+
 def validate_data(data):
     if data.empty:
         return False, "The uploaded CSV file is empty."
-    # Add more validation rules as needed
+    errors, _ = validate_chunks([data])
+    if errors:
+        details = '; '.join(f"{rule} ({len(rows)} rows)" for rule, rows in errors.items())
+        return False, f"The uploaded CSV file failed validation: {details}"
     return True, ""
 
 def convert_to_dict(data):
     return data.to_dict(orient='records')
-
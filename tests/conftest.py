@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app's modules live in src/ and import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+# Every analysis step must really run, not come from an earlier run's on-disk cache
+os.environ['ANALYSIS_CACHE_MB'] = '0'
@@ -0,0 +1,45 @@
+"""SQLite store: summary cache"""
+import os
+from collections import OrderedDict
+
+import pytest
+
+import db
+import perf_checks
+
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = str(tmp_path / 'samples.db')
+    perf_checks.build_check_database(db_name, 200)
+    return db_name
+
+
+def test_summary_cache_evicts_least_recently_used(database, monkeypatch):
+    monkeypatch.setattr(db, 'SUMMARY_CACHE_SIZE', 2)
+    monkeypatch.setattr(db, '_summary_cache', OrderedDict())
+    first = db.get_percentage_summary(database, ('project',))
+    db.get_percentage_summary(database, ('treatment',))
+    assert db.get_percentage_summary(database, ('project',)) is first
+    db.get_percentage_summary(database, ('condition',))
+    assert db.get_percentage_summary(database, ('project',)) is first
+    assert [key[2] for key in db._summary_cache] == [('condition',), ('project',)]
+
+
+def test_writes_apply_the_schema_once_per_file(database, monkeypatch):
+    applied = []
+    original = db._apply_schema
+    monkeypatch.setattr(db, '_apply_schema', lambda conn, *args: applied.append(1) or original(conn, *args))
+    sample = db.load_data(database).iloc[0].to_dict()
+    for copy in range(3):
+        assert db.add_sample(database, dict(sample, sample=f"{sample['sample']}_copy{copy}"))
+    assert not applied
+
+    # A file replaced under the writer gets the schema again
+    applied.clear()
+    for path in (database, f"{database}-wal", f"{database}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    assert db.add_sample(database, sample)
+    assert applied
+    assert len(db.load_data(database)) == 1
@@ -0,0 +1,36 @@
+"""Parquet mirror of the DuckDB backend"""
+import os
+
+import pytest
+
+duckdb = pytest.importorskip('duckdb')
+
+import db
+import duckdb_backend
+import perf_checks
+
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = str(tmp_path / 'samples.db')
+    perf_checks.build_check_database(db_name, 200)
+    return db_name
+
+
+def test_mirror_matches_sqlite(database):
+    loaded = duckdb_backend.load_data(database)
+    expected = db.load_data(database)
+    assert loaded.attrs['dataset_version'] == expected.attrs['dataset_version']
+    assert sorted(loaded['sample']) == sorted(expected['sample'])
+
+
+def test_failed_export_leaves_no_temp_directory(database, monkeypatch):
+    def fail(*args):
+        raise duckdb.IOException('disk full')
+
+    monkeypatch.setattr(duckdb_backend, '_copy_tables_attached', fail)
+    monkeypatch.setattr(duckdb_backend, '_copy_tables_pandas', fail)
+    with pytest.raises(duckdb.IOException):
+        duckdb_backend.refresh_mirror(database)
+    assert not any(name.endswith('.tmp') for name in os.listdir(os.path.dirname(database)))
+    assert not os.path.exists(duckdb_backend.mirror_dir(database))
@@ -0,0 +1,34 @@
+"""Bitmap index over the filter columns"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from filter_index import BitmapIndex
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'condition': rng.choice(['melanoma', 'carcinoma', 'healthy'], size=1003),
+        'response': rng.choice(['y', 'n', None], size=1003),
+        'project': [f"P{i % 97:03d}" for i in range(1003)]
+    })
+
+
+def test_rows_match_boolean_masks(frame):
+    index = BitmapIndex(frame)
+    criteria = {'condition': ['melanoma', 'healthy'], 'response': ['y'], 'project': ['P001', 'P050', 'nope']}
+    mask = np.ones(len(frame), dtype=bool)
+    for column, values in criteria.items():
+        mask &= frame[column].isin(values).to_numpy()
+    assert index.rows(criteria).tolist() == np.flatnonzero(mask).tolist()
+    assert index.count({'response': ['y', 'n']}) == frame['response'].notna().sum()
+
+
+def test_unindexed_column_raises_value_error(frame):
+    index = BitmapIndex(frame)
+    with pytest.raises(ValueError, match='sex'):
+        index.select({'sex': ['M']})
+    # Unrestricted criteria never need the column
+    assert index.count({'sex': None}) == len(frame)
@@ -0,0 +1,38 @@
+"""Memory accounting of one analysis rerun
+
+rerun_memory counts tracemalloc's peak plus the peak of Arrow buffers
+(pandas' pyarrow-backed strings), against the loaded frame's deep size.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import perf_checks
+
+# Large enough that per-row costs dominate fixed ones (about 38 MB loaded)
+MEMORY_TEST_SAMPLES = 200000
+
+
+@pytest.fixture(scope='module')
+def large_database(tmp_path_factory):
+    db_name = str(tmp_path_factory.mktemp('memory') / 'samples.db')
+    perf_checks.build_check_database(db_name, MEMORY_TEST_SAMPLES)
+    return db_name
+
+
+@pytest.mark.parametrize('project', [None, 'MELANO_001'])
+def test_rerun_stays_within_memory_budget(large_database, project):
+    data_bytes, peak_bytes = perf_checks.rerun_memory(large_database, project=project)
+    assert data_bytes > 30e6
+    assert peak_bytes / data_bytes <= perf_checks.RERUN_MEMORY_BUDGET
+
+
+def test_sorted_sample_ids_skip_factorizing():
+    import analysis
+    samples = pd.Series(['s1', 's10', 's2', 's3'], dtype='string[pyarrow]')
+    fast = analysis._repeat_categorical(samples, 2)
+    codes, categories = pd.factorize(samples, sort=True)
+    expected = pd.Categorical.from_codes(np.repeat(codes, 2), categories)
+    assert list(fast) == list(expected)
+    assert list(fast.categories) == list(expected.categories)
+    assert not analysis._strictly_increasing(samples[::-1])
@@ -0,0 +1,33 @@
+"""Power simulator workers stay light"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import analysis
+import power
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def test_power_does_not_import_the_app_stack():
+    loaded = subprocess.run(
+        [sys.executable, '-c', "import sys, power; print(' '.join(sorted(sys.modules)))"],
+        cwd=SRC, capture_output=True, text=True, check=True).stdout.split()
+    assert 'streamlit' not in loaded
+    assert 'analysis' not in loaded
+
+
+def test_simulated_trials_match_compare_responders():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(100, 2000, size=(40, 5))
+    is_responder = np.arange(40) % 3 == 0
+    percentages = power.sample_percentages(counts)
+    expected = analysis.compare_responders(percentages, is_responder)
+    responders, non_responders = percentages[is_responder], percentages[~is_responder]
+    _, p_value, cohens_d = power.responder_t_test(
+        len(responders), responders.mean(axis=0), responders.var(axis=0, ddof=1),
+        len(non_responders), non_responders.mean(axis=0), non_responders.var(axis=0, ddof=1))
+    np.testing.assert_allclose(p_value, expected['p_value'])
+    np.testing.assert_allclose(cohens_d, expected['cohens_d'])
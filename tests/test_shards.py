@@ -0,0 +1,59 @@
+"""All-or-none loads of the sharded layout"""
+import threading
+
+import pytest
+
+import db
+import shards
+from generate_big_dataset import generate_big_cell_counts_dataset
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    db_name = str(tmp_path / 'samples.db')
+    data = generate_big_cell_counts_dataset(300)
+    shards.initialize_db(db_name)
+    assert shards.process_and_load_data(db_name, data)
+    return db_name, data
+
+
+def _versions(db_name):
+    return {shard: db.get_dataset_version(shard) for shard in shards.list_shards(db_name)}
+
+
+def test_cancelled_load_leaves_every_shard_unchanged(sharded, monkeypatch):
+    db_name, data = sharded
+    before = _versions(db_name)
+    cancel_event = threading.Event()
+    changed = data.assign(sample=data['sample'] + '_new')
+    first_project = changed['project'].min()
+
+    def progress(rows_written, total_rows):
+        cancel_event.set()
+
+    # Only one shard sees the cancellation; the others must roll back with it
+    original = shards.load_project
+
+    def load_project(db_name, project, df, shard_progress=None, cancel=None, content_hash=None,
+                     before_commit=None):
+        if project != first_project:
+            return original(db_name, project, df, content_hash=content_hash, before_commit=before_commit)
+        return original(db_name, project, df, progress, cancel_event, content_hash, before_commit)
+
+    monkeypatch.setattr(shards, 'load_project', load_project)
+    with pytest.raises(db.IngestCancelled):
+        shards.process_and_load_data(db_name, changed, cancel_event=cancel_event)
+    assert _versions(db_name) == before
+
+
+def test_failed_append_leaves_every_shard_unchanged(sharded):
+    db_name, data = sharded
+    before = _versions(db_name)
+    # One project's batch repeats a stored sample ID, which fails that shard's append
+    batch = data.assign(sample=data['sample'] + '_extra')
+    first_project = batch['project'].min()
+    duplicate = batch.index[batch['project'] == first_project][0]
+    batch.loc[duplicate, 'sample'] = data.loc[duplicate, 'sample']
+    assert shards.append_data(db_name, batch) == 0
+    assert _versions(db_name) == before
+    assert len(shards.load_data(db_name)) == len(data)